@@ -1,7 +1,145 @@
+import itertools
 import threading
+import time
+
+# Optional callback receiving the seconds spent blocked in acquire_multiple_locks.
+# Left as None the hot path makes no timing calls; app.py sets it for /metrics.
+lock_wait_observer = None
+
+# Optional callback told about every change to a tree, from inside the critical
+# section making it, so calls for one node come in the order the changes happened:
+#   change_observer('owner', node, uid)        node.locked_by is now uid (None = unlocked)
+#   change_observer('add', node, parent)       new leaf
+#   change_observer('remove', node, None)      node and its subtree are gone
+#   change_observer('move', node, new_parent)  subtree re-parented
+# replication.py uses it to feed read replicas.
+change_observer = None
+
+def _changed(kind, node, value):
+    observer = change_observer
+    if observer is not None:
+        observer(kind, node, value)
+
+# Optional callable given one event tuple for every lock taken or released by
+# lock, unlock and upgrade_lock:
+#   (tree, seq, time_ns, op, node_name, uid)
+# op is 'lock', 'unlock', 'upgrade' or 'release' (uid's lock on a descendant,
+# freed by an upgrade; numbered before the upgrade). tree is the tree's
+# StructureLock.number and seq comes from StructureLock.operations, which is
+# bumped while the operation holds the root's lock, so one tree's events sorted
+# by seq are in exactly the order the engine ran them. The tuple is built,
+# timestamped and passed on only after the node locks are released, so the
+# root is held no longer and threads may report out of order. It holds names,
+# not nodes, so queued events keep no tree alive and cost the collector little.
+# app.py passes the audit log's queue (a deque append) here.
+operation_observer = None
+
+class _Side:
+    """Context manager for one side (shared or exclusive) of a StructureLock"""
+
+    def __init__(self, acquire, release):
+        self._acquire = acquire
+        self._release = release
+
+    def __enter__(self):
+        self._acquire()
+
+    def __exit__(self, *exc):
+        self._release()
+
+class _Reader:
+    """One thread's side of a StructureLock: its own mutex and shared-side nesting depth"""
+
+    __slots__ = ('lock', 'depth')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.depth = 0
+
+class StructureLock:
+    """
+    Reader-writer lock guarding the shape of one tree (parent/children links).
+    lock/unlock/upgrade_lock/can_lock hold it shared, so they never block each other
+    on it; add_leaf/remove_subtree/move_subtree hold it exclusively.
+
+    Every operation takes the shared side, so it must not be a point where
+    operations on different nodes meet. It is a "big reader" lock: each thread
+    has its own mutex for the tree and holds it while on the shared side, which
+    costs one uncontended acquire and touches nothing another reader writes.
+    A writer takes every registered thread's mutex in turn and keeps the
+    registry locked until it is done. Threads it has passed wait on their own
+    mutex, and new threads wait to register, so mutations are not starved by
+    steady traffic.
+    """
+
+    _numbers = itertools.count()
+    _numbers_lock = threading.Lock()
+
+    def __init__(self):
+        with StructureLock._numbers_lock:
+            self.number = next(StructureLock._numbers)  # identifies the tree in operation_observer events
+        self.operations = 0  # operation_observer events numbered so far; only changed under the root's lock
+        self._local = threading.local()
+        self._registry = threading.Lock()  # held by the writer for its whole exclusive section
+        self._readers = {}                 # thread -> _Reader
+        self._prune_at = 64                # registry size that triggers dropping exited threads
+        self._held = None
+        self.shared = _Side(self.acquire_shared, self.release_shared)
+        self.exclusive = _Side(self.acquire_exclusive, self.release_exclusive)
+
+    def _reader(self):
+        try:
+            return self._local.reader
+        except AttributeError:
+            reader = _Reader()
+            with self._registry:
+                # Servers may start a thread per request; forget exited ones in
+                # amortized O(1) rather than only when a mutation comes along
+                if len(self._readers) >= self._prune_at:
+                    self._prune()
+                    self._prune_at = max(64, 2 * len(self._readers))
+                self._readers[threading.current_thread()] = reader
+            self._local.reader = reader
+            return reader
+
+    def _prune(self):
+        """Drop threads that have exited (they are never on the shared side again); caller holds the registry"""
+        for thread in [thread for thread in self._readers if not thread.is_alive()]:
+            del self._readers[thread]
+
+    def acquire_shared(self):
+        reader = self._reader()
+        if not reader.depth:
+            reader.lock.acquire()
+        reader.depth += 1
+
+    def release_shared(self):
+        reader = self._local.reader
+        reader.depth -= 1
+        if not reader.depth:
+            reader.lock.release()
+
+    def acquire_exclusive(self):
+        self._registry.acquire()
+        self._prune()
+        held = []
+        try:
+            for reader in self._readers.values():
+                reader.lock.acquire()
+                held.append(reader.lock)
+        except:
+            release_multiple_locks(held)
+            self._registry.release()
+            raise
+        self._held = held
+
+    def release_exclusive(self):
+        held, self._held = self._held, None
+        release_multiple_locks(held)
+        self._registry.release()
 
 class Node:
-    def __init__(self, name):
+    def __init__(self, name, structure=None):
         self.name = name
         self.parent = None
         self.children = []
@@ -12,6 +150,10 @@ class Node:
         self._lock = threading.RLock()
         # Unique identifier for consistent ordering to prevent deadlocks
         self._id = id(self)
+        # Shape lock shared by every node of the same tree (see StructureLock)
+        self._structure = structure
+        # Set by remove_subtree; a caller may still hold a reference to the node
+        self._removed = False
 
 def acquire_multiple_locks(nodes):
     """
@@ -25,11 +167,15 @@ def acquire_multiple_locks(nodes):
     # Sort by node id to ensure consistent ordering across threads
     sorted_nodes = sorted(nodes, key=lambda n: n._id)
     acquired_locks = []
+    observer = lock_wait_observer
+    start = time.perf_counter() if observer is not None else 0.0
     
     try:
         for node in sorted_nodes:
             node._lock.acquire()
             acquired_locks.append(node._lock)
+        if observer is not None:
+            observer(time.perf_counter() - start)
         return acquired_locks
     except:
         # If any lock acquisition fails, release all acquired locks
@@ -44,7 +190,8 @@ def release_multiple_locks(locks):
 
 def build_tree(node_names, m):
     """Build m-ary tree from level-order node names"""
-    nodes = {name: Node(name) for name in node_names}
+    structure = StructureLock()
+    nodes = {name: Node(name, structure) for name in node_names}
     n = len(node_names)
     
     for i in range(n):
@@ -58,41 +205,45 @@ def build_tree(node_names, m):
     
     return nodes
 
-def can_lock(node):
-    """Check if node can be locked - O(log N) - Thread Safe"""
-    with node._lock:
-        # Check descendants using set length - O(1)
-        if len(node.locked_descendants) > 0:
-            return False
-    
-    # Check ancestors for locks - need to acquire locks in order
+def _ancestors(node):
+    """Parent, grandparent, ... up to the root"""
     ancestors = []
     curr = node.parent
     while curr:
         ancestors.append(curr)
         curr = curr.parent
-    
-    if not ancestors:
-        return True
-    
-    # Acquire locks on all ancestors in consistent order
-    locks = acquire_multiple_locks(ancestors)
-    try:
-        for ancestor in ancestors:
-            if ancestor.locked_by is not None:
-                return False
-        return True
-    finally:
-        release_multiple_locks(locks)
+    return ancestors
+
+# lock, unlock, upgrade_lock and can_lock take every node lock they need in one
+# acquire_multiple_locks call and both check and update under it. Nothing is read
+# outside a node lock, so correctness does not depend on the GIL making a
+# double-check or a len() read atomic, and free-threaded builds run them safely.
+
+def can_lock(node):
+    """Check if node can be locked - O(log N) - Thread Safe"""
+    with node._structure.shared:
+        if node._removed:
+            return False
+        ancestors = _ancestors(node)
+        locks = acquire_multiple_locks([node] + ancestors)
+        try:
+            return _can_lock(node, ancestors)
+        finally:
+            release_multiple_locks(locks)
+
+def _can_lock(node, ancestors):
+    """can_lock body; caller holds the locks of node and its ancestors"""
+    # Check descendants using the set - O(1)
+    if node.locked_descendants:
+        return False
+    for ancestor in ancestors:
+        if ancestor.locked_by is not None:
+            return False
+    return True
 
 def update_ancestors(node, is_locking):
     """Update ancestor locked_descendants sets when node is locked/unlocked - O(log N) - Thread Safe"""
-    ancestors = []
-    curr = node.parent
-    while curr:
-        ancestors.append(curr)
-        curr = curr.parent
-    
+    ancestors = _ancestors(node)
     if not ancestors:
         return
     
@@ -107,93 +258,220 @@ def update_ancestors(node, is_locking):
     finally:
         release_multiple_locks(locks)
 
+def set_owner(node, uid):
+    """Force node's owner (None = unlocked) without the locking rules, keeping ancestor sets right - O(log N) - Thread Safe"""
+    with node._structure.shared:
+        if node._removed:
+            return
+        ancestors = _ancestors(node)
+        locks = acquire_multiple_locks([node] + ancestors)
+        try:
+            was_locked = node.locked_by is not None
+            node.locked_by = uid
+            _changed('owner', node, uid)
+            if was_locked != (uid is not None):
+                for ancestor in ancestors:
+                    if uid is not None:
+                        ancestor.locked_descendants.add(node)
+                    else:
+                        ancestor.locked_descendants.discard(node)
+        finally:
+            release_multiple_locks(locks)
+
 def lock(node, uid):
     """Lock node - O(log N) - Thread Safe"""
-    with node._lock:
-        if node.locked_by is not None:
-            return False
-    
-    if not can_lock(node):
-        return False
-    
-    with node._lock:
-        # Double-check after acquiring lock (another thread might have locked it)
-        if node.locked_by is not None:
-            return False
-        
-        node.locked_by = uid
+    structure = node._structure
+    with structure.shared:
+        # Cheap early exit without touching the ancestors' locks
+        with node._lock:
+            if node._removed or node.locked_by is not None or node.locked_descendants:
+                return False
     
-    update_ancestors(node, True)  # True = locking
-    return True
+        # Check and update with node and all ancestors held, so a concurrent
+        # lock of an ancestor or a descendant cannot slip in between
+        ancestors = _ancestors(node)
+        observer = operation_observer
+        locks = acquire_multiple_locks([node] + ancestors)
+        try:
+            if node.locked_by is not None or not _can_lock(node, ancestors):
+                return False
+            node.locked_by = uid
+            _changed('owner', node, uid)
+            for ancestor in ancestors:
+                ancestor.locked_descendants.add(node)
+            if observer is not None:
+                seq = structure.operations + 1
+                structure.operations = seq
+        finally:
+            release_multiple_locks(locks)
+        if observer is not None:
+            observer((structure.number, seq, time.time_ns(), 'lock', node.name, uid))
+        return True
 
 def unlock(node, uid):
     """Unlock node - O(log N) - Thread Safe"""
-    with node._lock:
-        if node.locked_by != uid:
-            return False
-        
-        node.locked_by = None
-    
-    update_ancestors(node, False)  # False = unlocking
-    return True
-
-
-
-def upgrade_lock(node, uid):
-    """Upgrade lock - O(locked_nodes * log N) - Thread Safe"""
-    with node._lock:
-        if node.locked_by is not None:
-            return False
-    
-    # Check ancestors - need to collect them first and then lock in order
-    ancestors = []
-    curr = node.parent
-    while curr:
-        ancestors.append(curr)
-        curr = curr.parent
+    structure = node._structure
+    with structure.shared:
+        with node._lock:
+            if node._removed or node.locked_by != uid:
+                return False
     
-    if ancestors:
-        # Acquire locks on all ancestors in consistent order
-        ancestor_locks = acquire_multiple_locks(ancestors)
+        ancestors = _ancestors(node)
+        observer = operation_observer
+        locks = acquire_multiple_locks([node] + ancestors)
         try:
+            if node.locked_by != uid:
+                return False
+            node.locked_by = None
+            _changed('owner', node, None)
             for ancestor in ancestors:
-                if ancestor.locked_by is not None:
-                    return False
+                ancestor.locked_descendants.discard(node)
+            if observer is not None:
+                seq = structure.operations + 1
+                structure.operations = seq
         finally:
-            release_multiple_locks(ancestor_locks)
-    
-    # Get locked descendants - need to lock node first to read safely
-    with node._lock:
-        locked_nodes = list(node.locked_descendants)
+            release_multiple_locks(locks)
+        if observer is not None:
+            observer((structure.number, seq, time.time_ns(), 'unlock', node.name, uid))
+        return True
+
+def upgrade_lock(node, uid, released=None):
+    """Upgrade lock - O(locked_nodes * log N) - Thread Safe
+
+    If released is a list, the descendants unlocked by a successful upgrade are appended to it.
+    """
+    structure = node._structure
+    with structure.shared:
+        with node._lock:
+            if node._removed or node.locked_by is not None:
+                return False
+            locked_nodes = set(node.locked_descendants)
+        ancestors = _ancestors(node)
+        observer = operation_observer
     
-    if not locked_nodes:
+        while locked_nodes:
+            # The ancestors, the node and every node on the paths down to its
+            # locked descendants (all of whose sets change)
+            path = {node}
+            for locked_node in locked_nodes:
+                curr = locked_node
+                while curr not in path:
+                    path.add(curr)
+                    curr = curr.parent
+            locks = acquire_multiple_locks(ancestors + list(path))
+            try:
+                if node.locked_descendants != locked_nodes:
+                    # Changed before we held the locks; retry with the new set
+                    locked_nodes = set(node.locked_descendants)
+                    continue
+                if node.locked_by is not None:
+                    return False
+                for ancestor in ancestors:
+                    if ancestor.locked_by is not None:
+                        return False
+                for locked_node in locked_nodes:
+                    if locked_node.locked_by != uid:
+                        return False
+            
+                # Unlock all descendants, then lock this node
+                for locked_node in locked_nodes:
+                    locked_node.locked_by = None
+                    _changed('owner', locked_node, None)
+                    curr = locked_node.parent
+                    while curr:
+                        curr.locked_descendants.discard(locked_node)
+                        curr = curr.parent
+                node.locked_by = uid
+                _changed('owner', node, uid)
+                for ancestor in ancestors:
+                    ancestor.locked_descendants.add(node)
+                if released is not None:
+                    released.extend(locked_nodes)
+                if observer is not None:
+                    # One number per release, then one for the upgrade
+                    first = structure.operations + 1
+                    structure.operations += len(locked_nodes) + 1
+            finally:
+                release_multiple_locks(locks)
+            if observer is not None:
+                now = time.time_ns()
+                for seq, locked_node in enumerate(locked_nodes, first):
+                    observer((structure.number, seq, now, 'release', locked_node.name, uid))
+                observer((structure.number, first + len(locked_nodes), now, 'upgrade', node.name, uid))
+            return True
         return False
-    
-    # Acquire locks on all locked descendants in consistent order
-    descendant_locks = acquire_multiple_locks(locked_nodes)
-    try:
-        # Check all locked descendants belong to uid
-        for locked_node in locked_nodes:
-            if locked_node.locked_by != uid:
-                return False
-        
-        # Unlock all descendants
-        for locked_node in locked_nodes:
-            locked_node.locked_by = None
-            update_ancestors(locked_node, False)  # False = unlocking
+
+def add_leaf(nodes, parent, name):
+    """Insert a new unlocked leaf under parent - O(1) - Thread Safe"""
+    with parent._structure.exclusive:
+        if name in nodes or nodes.get(parent.name) is not parent:
+            return False
         
-        # Lock this node
-        with node._lock:
-            # Double-check node is still unlocked
-            if node.locked_by is not None:
-                return False
-            node.locked_by = uid
+        leaf = Node(name, parent._structure)
+        leaf.parent = parent
+        parent.children.append(leaf)
+        nodes[name] = leaf
+        _changed('add', leaf, parent)
+        return True
+
+def remove_subtree(nodes, node):
+    """Delete node and its descendants if none of them is locked - O(subtree) - Thread Safe"""
+    with node._structure.exclusive:
+        if node.parent is None or nodes.get(node.name) is not node:
+            return False
+        # Nothing in the subtree is locked, so no ancestor set refers to it
+        if node.locked_by is not None or node.locked_descendants:
+            return False
         
-        update_ancestors(node, True)  # True = locking
+        node.parent.children.remove(node)
+        node.parent = None
+        stack = [node]
+        while stack:
+            curr = stack.pop()
+            del nodes[curr.name]
+            # Callers that looked the node up before we got the exclusive side
+            # must not lock it once they get the shared side
+            curr._removed = True
+            stack.extend(curr.children)
+        _changed('remove', node, None)
         return True
+
+def move_subtree(nodes, node, new_parent):
+    """Re-parent node's subtree under new_parent, keeping its locks - O(depth + moved locks * depth) - Thread Safe"""
+    with node._structure.exclusive:
+        if node.parent is None or nodes.get(node.name) is not node or nodes.get(new_parent.name) is not new_parent:
+            return False
+        if node.parent is new_parent:
+            return True
         
-    finally:
-        release_multiple_locks(descendant_locks)
+        new_ancestors = [new_parent] + _ancestors(new_parent)
+        # Cannot move a node under itself or one of its descendants
+        if any(ancestor is node for ancestor in new_ancestors):
+            return False
+        
+        moved = set(node.locked_descendants)
+        if node.locked_by is not None:
+            moved.add(node)
+        # Locks in the subtree may not end up below a locked node
+        if moved and any(ancestor.locked_by is not None for ancestor in new_ancestors):
+            return False
+        
+        old_ancestors = [node.parent] + _ancestors(node.parent)
+        node.parent.children.remove(node)
+        new_parent.children.append(node)
+        node.parent = new_parent
+        
+        # Only the parts of the two paths below their common ancestor change
+        if moved:
+            common = set(old_ancestors) & set(new_ancestors)
+            for ancestor in old_ancestors:
+                if ancestor not in common:
+                    ancestor.locked_descendants.difference_update(moved)
+            for ancestor in new_ancestors:
+                if ancestor not in common:
+                    ancestor.locked_descendants.update(moved)
+        _changed('move', node, new_parent)
+        return True
 
 def main():
     """Main function"""
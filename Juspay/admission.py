@@ -0,0 +1,112 @@
+"""
+Admission control for the HTTP server.
+
+Requests are grouped into operation classes (cheap locks, expensive upgrades,
+reads, tree mutations). Each class has its own concurrency limit, queue depth
+limit and maximum queue wait, so a burst of upgrades can fill up the upgrade
+class without taking slots from lock/unlock traffic.
+
+A request that finds its class at the concurrency limit waits in FIFO order.
+If the queue is already full it is rejected at once with 429; if it waits
+longer than the class allows it is rejected with 503. Either way it is turned
+away before touching the tree, so under overload the admitted requests keep
+their latency instead of everyone piling up on the root node's lock.
+
+Limits come from the environment, e.g. TREELOCK_UPGRADE_CONCURRENCY=2,
+TREELOCK_UPGRADE_QUEUE=16, TREELOCK_UPGRADE_WAIT_MS=250.
+"""
+
+import os
+import threading
+import time
+from collections import deque
+
+# class name -> (max concurrency, max queue depth, max queue wait in ms)
+DEFAULT_LIMITS = {
+    'lock': (32, 256, 100),
+    'upgrade': (4, 32, 500),
+    'read': (8, 64, 200),
+    'mutate': (2, 32, 500),
+}
+
+
+class Rejected(Exception):
+    """Raised when a request is turned away; status is 429 (queue full) or 503 (waited too long)"""
+
+    def __init__(self, message, status, reason):
+        super().__init__(message)
+        self.status = status
+        self.reason = reason
+
+
+class AdmissionClass:
+    """Bounded concurrency with a bounded, time-limited FIFO queue"""
+
+    def __init__(self, name, max_concurrency, max_queue, max_wait):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.in_flight = 0
+        self._mutex = threading.Lock()
+        # One Event per queued request, oldest first. exit() hands its slot to
+        # the oldest waiter directly, so a new arrival cannot take it first.
+        self._queue = deque()
+
+    @property
+    def waiting(self):
+        return len(self._queue)
+
+    def enter(self):
+        """Take a slot, waiting if needed; returns seconds spent queued or raises Rejected"""
+        with self._mutex:
+            if self.in_flight < self.max_concurrency and not self._queue:
+                self.in_flight += 1
+                return 0.0
+            if len(self._queue) >= self.max_queue:
+                raise Rejected('Too many queued %s requests' % self.name, 429, 'queue_full')
+            granted = threading.Event()
+            self._queue.append(granted)
+
+        start = time.monotonic()
+        granted.wait(self.max_wait)
+        with self._mutex:
+            # Set under the mutex, so this cannot miss a grant made just after the timeout
+            if not granted.is_set():
+                self._queue.remove(granted)
+                raise Rejected('Timed out waiting for a %s slot' % self.name, 503, 'timeout')
+        return time.monotonic() - start
+
+    def exit(self):
+        with self._mutex:
+            if self._queue:
+                # The slot passes to the oldest waiter; in_flight stays the same
+                self._queue.popleft().set()
+            else:
+                self.in_flight -= 1
+
+
+class AdmissionController:
+    """One AdmissionClass per operation class"""
+
+    def __init__(self, limits=None):
+        limits = limits or DEFAULT_LIMITS
+        self.classes = {name: AdmissionClass(name, conc, queue, wait_ms / 1000.0)
+                        for name, (conc, queue, wait_ms) in limits.items()}
+
+    @classmethod
+    def from_env(cls, environ=os.environ):
+        """Defaults overridden by TREELOCK_<CLASS>_CONCURRENCY / _QUEUE / _WAIT_MS"""
+        limits = {}
+        for name, (conc, queue, wait_ms) in DEFAULT_LIMITS.items():
+            prefix = 'TREELOCK_%s_' % name.upper()
+            limits[name] = (int(environ.get(prefix + 'CONCURRENCY', conc)),
+                            int(environ.get(prefix + 'QUEUE', queue)),
+                            float(environ.get(prefix + 'WAIT_MS', wait_ms)))
+        return cls(limits)
+
+    def enter(self, name):
+        return self.classes[name].enter()
+
+    def exit(self, name):
+        self.classes[name].exit()
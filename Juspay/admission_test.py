@@ -0,0 +1,75 @@
+import threading
+import time
+
+from admission import AdmissionClass, AdmissionController, Rejected
+
+def rejected(enter):
+    try:
+        enter()
+    except Rejected as e:
+        return e.status, e.reason
+    return None
+
+def queue_waiter(admission, results):
+    """Start a thread that queues for a slot and records what it got"""
+    queued = admission.waiting
+    thread = threading.Thread(target=lambda: results.append(rejected(admission.enter) or 'admitted'))
+    thread.start()
+    while admission.waiting == queued:
+        time.sleep(0.001)
+    return thread
+
+def test_slots_go_to_waiters_in_order():
+    """A freed slot goes to the oldest waiter, not to a request arriving at that moment"""
+    admission = AdmissionClass('lock', 1, 8, max_wait=2.0)
+    assert admission.enter() == 0.0
+    results = []
+    first = queue_waiter(admission, results)
+    second = queue_waiter(admission, results)
+
+    admission.exit()
+    admission.max_wait = 0.05
+    assert rejected(admission.enter) == (503, 'timeout')  # the slot went to `first`
+    first.join()
+    assert results == ['admitted'] and admission.in_flight == 1
+
+    admission.exit()
+    second.join()
+    assert results == ['admitted', 'admitted'] and admission.waiting == 0
+    admission.exit()
+    assert admission.in_flight == 0
+
+def test_queue_full_and_timeout():
+    """429 at once when the queue is full, 503 after waiting too long, and the queue empties again"""
+    admission = AdmissionClass('upgrade', 1, 1, max_wait=0.2)
+    admission.enter()
+    results = []
+    waiter = queue_waiter(admission, results)
+    start = time.monotonic()
+    assert rejected(admission.enter) == (429, 'queue_full')
+    assert time.monotonic() - start < 0.1
+    waiter.join()
+    assert results == [(503, 'timeout')]
+    assert admission.waiting == 0 and admission.in_flight == 1
+
+def test_classes_are_independent():
+    """A saturated class does not delay or reject another"""
+    controller = AdmissionController({'lock': (2, 4, 100), 'upgrade': (1, 1, 300)})
+    upgrade = controller.classes['upgrade']
+    controller.enter('upgrade')
+    results = []
+    waiter = queue_waiter(upgrade, results)
+    assert rejected(lambda: controller.enter('upgrade')) == (429, 'queue_full')
+    for _ in range(2):
+        assert controller.enter('lock') == 0.0
+    controller.exit('lock')
+    controller.exit('lock')
+    controller.exit('upgrade')
+    waiter.join()
+    assert results == ['admitted']
+
+if __name__ == "__main__":
+    test_slots_go_to_waiters_in_order()
+    test_queue_full_and_timeout()
+    test_classes_are_independent()
+    print("Admission control tests passed!")
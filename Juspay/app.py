@@ -1,295 +1,628 @@
+import atexit
+import functools
+import os
 import threading
-from flask import Flask, request, jsonify
+import time
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
 
-class Node:
-    def __init__(self, name):
-        self.name = name
-        self.parent = None
-        self.children = []
-        self.locked_by = None
-        # Set to track locked descendants for O(1) count and O(locked_nodes) access
-        self.locked_descendants = set()
-        # Thread safety: Each node has its own lock
-        self._lock = threading.RLock()
-        # Unique identifier for consistent ordering to prevent deadlocks
-        self._id = id(self)
-
-def acquire_multiple_locks(nodes):
-    """
-    Acquire locks on multiple nodes in a consistent order to prevent deadlocks.
-    Sorts nodes by their memory id to ensure consistent locking order.
-    Returns list of acquired locks for proper cleanup.
-    """
-    if not nodes:
-        return []
-    
-    # Sort by node id to ensure consistent ordering across threads
-    sorted_nodes = sorted(nodes, key=lambda n: n._id)
-    acquired_locks = []
-    
-    try:
-        for node in sorted_nodes:
-            node._lock.acquire()
-            acquired_locks.append(node._lock)
-        return acquired_locks
-    except:
-        # If any lock acquisition fails, release all acquired locks
-        for lock in acquired_locks:
-            lock.release()
-        raise
-
-def release_multiple_locks(locks):
-    """Release multiple locks in reverse order"""
-    for lock in reversed(locks):
-        lock.release()
-
-def build_tree(node_names, m):
-    """Build m-ary tree from level-order node names"""
-    nodes = {name: Node(name) for name in node_names}
-    n = len(node_names)
-    
-    for i in range(n):
-        parent = nodes[node_names[i]]
-        for j in range(1, m + 1):
-            child_idx = m * i + j
-            if child_idx < n:
-                child = nodes[node_names[child_idx]]
-                parent.children.append(child)
-                child.parent = parent
-    
-    return nodes
-
-def can_lock(node):
-    """Check if node can be locked - O(log N) - Thread Safe"""
-    with node._lock:
-        # Check descendants using set length - O(1)
-        if len(node.locked_descendants) > 0:
-            return False
-    
-    # Check ancestors for locks - need to acquire locks in order
-    ancestors = []
-    curr = node.parent
-    while curr:
-        ancestors.append(curr)
-        curr = curr.parent
-    
-    if not ancestors:
-        return True
-    
-    # Acquire locks on all ancestors in consistent order
-    locks = acquire_multiple_locks(ancestors)
-    try:
-        for ancestor in ancestors:
-            if ancestor.locked_by is not None:
-                return False
-        return True
-    finally:
-        release_multiple_locks(locks)
-
-def update_ancestors(node, is_locking):
-    """Update ancestor locked_descendants sets when node is locked/unlocked - O(log N) - Thread Safe"""
-    ancestors = []
-    curr = node.parent
-    while curr:
-        ancestors.append(curr)
-        curr = curr.parent
-    
-    if not ancestors:
-        return
-    
-    # Acquire locks on all ancestors in consistent order
-    locks = acquire_multiple_locks(ancestors)
-    try:
-        for ancestor in ancestors:
-            if is_locking:
-                ancestor.locked_descendants.add(node)
-            else:
-                ancestor.locked_descendants.discard(node)
-    finally:
-        release_multiple_locks(locks)
+import Thread_safe
+from admission import AdmissionController, Rejected
+from audit import AuditLog
+import binary_protocol
+from Thread_safe import add_leaf, build_tree, can_lock, lock, move_subtree, remove_subtree, unlock, upgrade_lock
+from contention import ContentionProfiler
+from metrics import CONTENT_TYPE, Registry
+from replication import ChangeFeed, Replica, parse_address
+from scheduler import UpgradeScheduler
+from tenants import TreeError, TreeRegistry
+from traffic import TrafficRecorder
 
-def lock(node, uid):
-    """Lock node - O(log N) - Thread Safe"""
-    with node._lock:
-        if node.locked_by is not None:
-            return False
-    
-    if not can_lock(node):
-        return False
-    
-    with node._lock:
-        # Double-check after acquiring lock (another thread might have locked it)
-        if node.locked_by is not None:
-            return False
-        
-        node.locked_by = uid
-    
-    update_ancestors(node, True)  # True = locking
-    return True
-
-def unlock(node, uid):
-    """Unlock node - O(log N) - Thread Safe"""
-    with node._lock:
-        if node.locked_by != uid:
-            return False
-        
-        node.locked_by = None
-    
-    update_ancestors(node, False)  # False = unlocking
-    return True
-
-def upgrade_lock(node, uid):
-    """Upgrade lock - O(locked_nodes * log N) - Thread Safe"""
-    with node._lock:
-        if node.locked_by is not None:
-            return False
-    
-    # Check ancestors - need to collect them first and then lock in order
-    ancestors = []
-    curr = node.parent
-    while curr:
-        ancestors.append(curr)
-        curr = curr.parent
-    
-    if ancestors:
-        # Acquire locks on all ancestors in consistent order
-        ancestor_locks = acquire_multiple_locks(ancestors)
-        try:
-            for ancestor in ancestors:
-                if ancestor.locked_by is not None:
-                    return False
-        finally:
-            release_multiple_locks(ancestor_locks)
-    
-    # Get locked descendants - need to lock node first to read safely
-    with node._lock:
-        locked_nodes = list(node.locked_descendants)
-    
-    if not locked_nodes:
-        return False
-    
-    # Acquire locks on all locked descendants in consistent order
-    descendant_locks = acquire_multiple_locks(locked_nodes)
-    try:
-        # Check all locked descendants belong to uid
-        for locked_node in locked_nodes:
-            if locked_node.locked_by != uid:
-                return False
-        
-        # Unlock all descendants
-        for locked_node in locked_nodes:
-            locked_node.locked_by = None
-            update_ancestors(locked_node, False)  # False = unlocking
-        
-        # Lock this node
-        with node._lock:
-            # Double-check node is still unlocked
-            if node.locked_by is not None:
-                return False
-            node.locked_by = uid
-        
-        update_ancestors(node, True)  # True = locking
-        return True
-        
-    finally:
-        release_multiple_locks(descendant_locks)
 
 def get_tree_state(nodes):
     """Get current state of the tree for frontend display"""
     tree_state = {}
-    for name, node in nodes.items():
-        tree_state[name] = {
-            'name': name,
-            'locked_by': node.locked_by,
-            'children': [child.name for child in node.children],
-            'parent': node.parent.name if node.parent else None
-        }
+    # Hold the tree's structure lock so nodes cannot be added, removed or moved mid-walk
+    with next(iter(nodes.values()))._structure.shared:
+        for name, node in nodes.items():
+            tree_state[name] = {
+                'name': name,
+                'locked_by': node.locked_by,
+                'children': [child.name for child in node.children],
+                'parent': node.parent.name if node.parent else None
+            }
     return tree_state
 
 # Initialize Flask app
 app = Flask(__name__)
 CORS(app, origins=["https://tree-lock.vercel.app", "https://localhost:3000"])
 
+# Metrics exposed on /metrics
+registry = Registry()
+REQUEST_LATENCY = registry.histogram(
+    'treelock_http_request_duration_seconds', 'Time spent handling HTTP requests', ['endpoint'])
+REQUESTS = registry.counter(
+    'treelock_http_requests_total', 'HTTP requests by endpoint and status code', ['endpoint', 'status'])
+OPERATION_LATENCY = registry.histogram(
+    'treelock_operation_duration_seconds', 'Time spent in core tree functions', ['operation'])
+OPERATION_RESULTS = registry.counter(
+    'treelock_operation_results_total', 'Core tree function outcomes', ['operation', 'result'])
+LOCK_WAIT = registry.histogram(
+    'treelock_lock_wait_seconds', 'Time spent blocked acquiring node locks in acquire_multiple_locks')
+Thread_safe.lock_wait_observer = LOCK_WAIT.observe
+
+def timed_operation(name, func, *args):
+    """Call a core tree function, recording its latency and outcome"""
+    start = time.perf_counter()
+    result = func(*args)
+    OPERATION_LATENCY.labels(name).observe(time.perf_counter() - start)
+    OPERATION_RESULTS.labels(name, 'failure' if result is False else 'success').inc()
+    return result
+
+# Admission control: per operation class concurrency, queue depth and queue wait
+# limits (see admission.py). Set TREELOCK_ADMISSION=0 to admit everything.
+admission = AdmissionController.from_env() if os.environ.get('TREELOCK_ADMISSION', '1') != '0' else None
+ADMISSION_WAIT = registry.histogram(
+    'treelock_admission_wait_seconds', 'Time admitted requests spent queued for a slot', ['class'])
+ADMISSION_REJECTED = registry.counter(
+    'treelock_admission_rejected_total', 'Requests turned away by admission control', ['class', 'reason'])
+
+def admitted(op_class):
+    """Run a view under admission control; op_class is a class name or a function of the URL arguments"""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(**kwargs):
+            if admission is None:
+                return view(**kwargs)
+            name = op_class(**kwargs) if callable(op_class) else op_class
+            try:
+                waited = admission.enter(name)
+            except Rejected as e:
+                ADMISSION_REJECTED.labels(name, e.reason).inc()
+                response = jsonify({'success': False, 'error': str(e)})
+                response.headers['Retry-After'] = '1'
+                return response, e.status
+            ADMISSION_WAIT.labels(name).observe(waited)
+            try:
+                return view(**kwargs)
+            finally:
+                admission.exit(name)
+        return wrapper
+    return decorator
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    start = g.pop('request_start', None)
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    if start is not None:
+        REQUEST_LATENCY.labels(endpoint).observe(time.perf_counter() - start)
+    REQUESTS.labels(endpoint, str(response.status_code)).inc()
+    return response
+
 # Global variables for tree state
 nodes = {}
+# Binary protocol node id -> Node: level order, then leaves in the order they
+# were added. A removed node's id is retired (None) and never reused, so a
+# re-added name gets a new id instead of two ids pointing at one node.
+node_ids = []
+node_ids_lock = threading.Lock()
 m = 2  # branching factor
 
 # Initialize tree on server start
 def initialize_tree():
-    global nodes
+    global nodes, node_ids
     # Sample node names - you can modify this list
     node_names = ["World", "Asia", "Africa", "China", "India", "SouthAfrica", "Egypt"]
     nodes = build_tree(node_names, m)
+    node_ids = [nodes[name] for name in node_names]
     print(f"Tree initialized with {len(nodes)} nodes and branching factor {m}")
 
 # Initialize tree when module is imported
 initialize_tree()
 
-@app.route('/lock', methods=['POST'])
-def lock_endpoint():
-    """Lock a node"""
+# Optional contention profiling; set TREELOCK_PROFILE=1 to enable /profile.
+# Named trees are profiled while loaded, and leaves added at runtime through
+# tree_changed below
+profiler = None
+if os.environ.get('TREELOCK_PROFILE'):
+    profiler = ContentionProfiler()
+    profiler.enable(nodes)
+    lock = profiler.wrap('lock', lock)
+    unlock = profiler.wrap('unlock', unlock)
+    upgrade_lock = profiler.wrap('upgrade_lock', upgrade_lock)
+
+# Optional lock history; set TREELOCK_AUDIT_DIR=<dir> to log every lock, unlock
+# and upgrade and answer /audit queries. Successful operations are reported by
+# the engine with their tree's sequence number, so the history has the engine's
+# order. Events the writer could not keep up with are counted in
+# treelock_audit_dropped_total and flagged in the /audit answers they may affect
+AUDIT_DROPPED = registry.counter(
+    'treelock_audit_dropped_total', 'Audit events lost because the audit writer fell behind')
+AUDIT_DROPPED.labels()  # exported as 0 until the first drop
+audit = (AuditLog(os.environ['TREELOCK_AUDIT_DIR'], drop_observer=AUDIT_DROPPED.inc)
+         if os.environ.get('TREELOCK_AUDIT_DIR') else None)
+if audit is not None:
+    Thread_safe.operation_observer = audit.sink
+    atexit.register(audit.close)
+
+def tree_loaded(event, entry):
+    """TreeRegistry entry_observer: profile and audit named trees under their ids while they are loaded"""
+    if event == 'load':
+        if profiler is not None:
+            profiler.enable(entry.nodes, entry.tree_id)
+        if audit is not None:
+            audit.name_tree(entry.root._structure.number, entry.tree_id)
+    elif profiler is not None:
+        profiler.forget(entry.tree_id)
+
+# Named trees served under /trees/<id>/..., each an independent concurrency domain.
+# Idle trees are snapshotted to disk and dropped when over the memory budget.
+# Replicas (TREELOCK_REPLICA_OF, see below) only mirror the default tree, so they
+# neither load nor flush snapshots, which belong to the primary
+REPLICA_OF = os.environ.get('TREELOCK_REPLICA_OF')
+trees = None
+if not REPLICA_OF:
+    trees = TreeRegistry(
+        os.environ.get('TREELOCK_SNAPSHOT_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tree_snapshots')),
+        int(float(os.environ.get('TREELOCK_MEMORY_BUDGET_MB', 256)) * 1024 * 1024),
+        entry_observer=tree_loaded if profiler is not None or audit is not None else None)
+    atexit.register(trees.flush)
+
+# Optional upgrade fairness; set TREELOCK_UPGRADE_SCHEDULER=1 so pending upgrades
+# reserve their subtree and wait up to TREELOCK_UPGRADE_MAX_WAIT_MS instead of
+# failing at the first foreign lock below them
+UPGRADE_WAIT = registry.histogram(
+    'treelock_upgrade_wait_seconds', 'Time from upgrade request to success or giving up', ['result'])
+scheduler = None
+if os.environ.get('TREELOCK_UPGRADE_SCHEDULER'):
+    upgrade_max_wait = float(os.environ.get('TREELOCK_UPGRADE_MAX_WAIT_MS', 1000)) / 1000.0
+    # A deferred lock keeps its admission slot, so defer it for at most half of
+    # what a queued lock may wait; a pending upgrade then cannot hold the lock
+    # class full for longer than its own queue tolerates
+    upgrade_max_defer = upgrade_max_wait
+    if admission is not None:
+        upgrade_max_defer = min(upgrade_max_defer, admission.classes['lock'].max_wait / 2)
+    scheduler = UpgradeScheduler(
+        max_wait=upgrade_max_wait, max_defer=upgrade_max_defer,
+        wait_observer=lambda seconds, ok: UPGRADE_WAIT.labels('success' if ok else 'failure').observe(seconds),
+        lock=lock, unlock=unlock, upgrade_lock=upgrade_lock)
+    lock, unlock, upgrade_lock = scheduler.lock, scheduler.unlock, scheduler.upgrade_lock
+
+# Engine function behind each endpoint, picked up after any profiler or scheduler wrapping
+OPERATIONS = {
+    'lock': ('lock', lock),
+    'unlock': ('unlock', unlock),
+    'upgrade': ('upgrade_lock', upgrade_lock),
+}
+
+# Optional traffic recording for replay.py; set TREELOCK_RECORD=<path> to enable
+recorder = TrafficRecorder(os.environ['TREELOCK_RECORD']) if os.environ.get('TREELOCK_RECORD') else None
+RECORDED_ENDPOINTS = {'lock_endpoint': 'lock', 'unlock_endpoint': 'unlock', 'upgrade_endpoint': 'upgrade',
+                      'tree_operation_endpoint': None}
+
+@app.before_request
+def record_traffic():
+    # Runs before admission control, so requests it turns away with 429 or 503
+    # are still part of the recorded offered load
+    if recorder is None or request.endpoint not in RECORDED_ENDPOINTS:
+        return
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        op = RECORDED_ENDPOINTS[request.endpoint] or request.view_args['op']
+        recorder.record(op, data.get('node'), data.get('uid'), request.view_args.get('tree_id', ''))
+
+def run_operation(op, node, uid, tree_id=''):
+    """Run lock, unlock or upgrade through OPERATIONS, adding failed attempts to the audit log"""
+    name, func = OPERATIONS[op]
+    result = timed_operation(name, func, node, uid)
+    if audit is None:
+        return result
+    if not result:
+        audit.record(op, node.name, uid, False, tree_id)
+    return result
+
+def node_operation(tree_nodes, op, tree_id=''):
+    """Shared body of the lock, unlock and upgrade endpoints for any tree"""
     try:
         data = request.get_json()
         node_name = data.get('node')
         uid = data.get('uid')
         
-        if node_name not in nodes:
+        if node_name not in tree_nodes:
             return jsonify({'success': False, 'error': 'Node not found'}), 400
         
-        node = nodes[node_name]
-        result = lock(node, uid)
+        result = run_operation(op, tree_nodes[node_name], uid, tree_id)
         
         return jsonify({'success': result})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/unlock', methods=['POST'])
-def unlock_endpoint():
-    """Unlock a node"""
+def retire_node_ids():
+    """Drop the binary protocol ids of nodes removed from the default tree"""
+    with node_ids_lock:
+        for node_id, node in enumerate(node_ids):
+            if node is not None and node._removed:
+                node_ids[node_id] = None
+
+def add_node(tree_nodes):
+    """Shared body of the add-leaf endpoints"""
     try:
         data = request.get_json()
-        node_name = data.get('node')
-        uid = data.get('uid')
+        name = data.get('name')
+        parent_name = data.get('parent')
         
-        if node_name not in nodes:
-            return jsonify({'success': False, 'error': 'Node not found'}), 400
+        if parent_name not in tree_nodes:
+            return jsonify({'success': False, 'error': 'Parent not found'}), 400
+        if not isinstance(name, str) or not name:
+            return jsonify({'success': False, 'error': 'Invalid node name'}), 400
         
-        node = nodes[node_name]
-        result = unlock(node, uid)
+        result = timed_operation('add_leaf', add_leaf, tree_nodes, tree_nodes[parent_name], name)
+        if result and tree_nodes is nodes:
+            with node_ids_lock:
+                node_ids.append(tree_nodes.get(name))
+        return jsonify({'success': result})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+def remove_node(tree_nodes, node_name):
+    """Shared body of the remove-subtree endpoints"""
+    try:
+        if node_name not in tree_nodes:
+            return jsonify({'success': False, 'error': 'Node not found'}), 400
         
+        result = timed_operation('remove_subtree', remove_subtree, tree_nodes, tree_nodes[node_name])
+        if result and tree_nodes is nodes:
+            retire_node_ids()
         return jsonify({'success': result})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/upgrade', methods=['POST'])
-def upgrade_endpoint():
-    """Upgrade lock on a node"""
+def move_node(tree_nodes):
+    """Shared body of the move-subtree endpoints"""
     try:
         data = request.get_json()
         node_name = data.get('node')
-        uid = data.get('uid')
+        parent_name = data.get('parent')
         
-        if node_name not in nodes:
+        if node_name not in tree_nodes or parent_name not in tree_nodes:
             return jsonify({'success': False, 'error': 'Node not found'}), 400
         
-        node = nodes[node_name]
-        result = upgrade_lock(node, uid)
-        
+        result = timed_operation('move_subtree', move_subtree, tree_nodes,
+                                 tree_nodes[node_name], tree_nodes[parent_name])
         return jsonify({'success': result})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+# Read replicas (see replication.py). A primary started with
+# TREELOCK_REPLICATION_SOCKET=<path> or TREELOCK_REPLICATION_PORT streams its
+# default tree to replicas; a process started with TREELOCK_REPLICA_OF=<path or
+# host:port> is a read-only replica serving /tree and /can_lock from its own copy,
+# refusing reads once it is more than TREELOCK_REPLICA_MAX_STALENESS_MS behind.
+change_feed = None
+replica = None
+REPLICA_MAX_STALENESS = float(os.environ.get('TREELOCK_REPLICA_MAX_STALENESS_MS', 5000)) / 1000.0
+
+def tree_changed(kind, node, value):
+    """Thread_safe.change_observer: keep the profiler's locks and the replication feed up to date"""
+    if profiler is not None:
+        profiler.changed(kind, node, value)
+    if change_feed is not None:
+        change_feed.publish(kind, node, value)
+
+if profiler is not None:
+    Thread_safe.change_observer = tree_changed
+
+@app.before_request
+def reject_named_trees_on_replica():
+    if trees is None and (request.path == '/trees' or request.path.startswith('/trees/')):
+        return jsonify({'success': False, 'error': 'Named trees are not served by replicas, use the primary'}), 404
+
+@app.before_request
+def reject_writes_on_replica():
+    if replica is not None and request.method not in ('GET', 'HEAD', 'OPTIONS'):
+        return jsonify({'success': False, 'error': 'Read-only replica, send writes to the primary'}), 403
+
+def read_nodes():
+    """Tree to serve a read from and extra response fields; the replica's copy in replica mode"""
+    if replica is None:
+        return nodes, {}
+    staleness = replica.staleness()
+    if staleness is None or staleness > REPLICA_MAX_STALENESS:
+        raise TreeError('Replica is not caught up with the primary', 503)
+    return replica.nodes, {'replica': {'seq': replica.seq, 'staleness_seconds': staleness}}
+
+@app.route('/lock', methods=['POST'])
+@admitted('lock')
+def lock_endpoint():
+    """Lock a node"""
+    return node_operation(nodes, 'lock')
+
+@app.route('/unlock', methods=['POST'])
+@admitted('lock')
+def unlock_endpoint():
+    """Unlock a node"""
+    return node_operation(nodes, 'unlock')
+
+@app.route('/upgrade', methods=['POST'])
+@admitted('upgrade')
+def upgrade_endpoint():
+    """Upgrade lock on a node"""
+    return node_operation(nodes, 'upgrade')
+
 @app.route('/tree', methods=['GET'])
+@admitted('read')
 def get_tree():
     """Get current tree state"""
     try:
-        tree_state = get_tree_state(nodes)
+        tree_nodes, extra = read_nodes()
+        tree_state = timed_operation('get_tree_state', get_tree_state, tree_nodes)
+        return jsonify({'tree': tree_state, **extra})
+    except TreeError as e:
+        return jsonify({'error': str(e)}), e.status
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/can_lock', methods=['GET'])
+@admitted('read')
+def can_lock_endpoint():
+    """Whether no ancestor or descendant of a node is locked: ?node=India"""
+    try:
+        tree_nodes, extra = read_nodes()
+        node_name = request.args.get('node')
+        node = tree_nodes.get(node_name)
+        if node is None:
+            return jsonify({'error': 'Node not found'}), 400
+        result = timed_operation('can_lock', can_lock, node)
+        return jsonify({'node': node_name, 'can_lock': result, 'locked_by': node.locked_by, **extra})
+    except TreeError as e:
+        return jsonify({'error': str(e)}), e.status
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/nodes', methods=['POST'])
+@admitted('mutate')
+def add_node_endpoint():
+    """Add a leaf: {"name": "Japan", "parent": "Asia"}"""
+    return add_node(nodes)
+
+@app.route('/nodes/<node_name>', methods=['DELETE'])
+@admitted('mutate')
+def remove_node_endpoint(node_name):
+    """Remove an unlocked subtree"""
+    return remove_node(nodes, node_name)
+
+@app.route('/move', methods=['POST'])
+@admitted('mutate')
+def move_node_endpoint():
+    """Re-parent a subtree: {"node": "India", "parent": "Africa"}"""
+    return move_node(nodes)
+
+@app.route('/trees', methods=['GET'])
+def list_trees_endpoint():
+    """List named trees and whether each is loaded in memory"""
+    return jsonify({'trees': trees.list_trees()})
+
+@app.route('/trees/<tree_id>', methods=['PUT'])
+def create_tree_endpoint(tree_id):
+    """Create a named tree from level-order node names and a branching factor"""
+    try:
+        data = request.get_json()
+        entry = trees.create(tree_id, data.get('nodes'), data.get('m', 2))
+        return jsonify({'id': entry.tree_id, 'nodes': len(entry.nodes), 'm': entry.m}), 201
+    except TreeError as e:
+        return jsonify({'error': str(e)}), e.status
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/trees/<tree_id>', methods=['DELETE'])
+def delete_tree_endpoint(tree_id):
+    """Delete a named tree and its snapshot"""
+    try:
+        trees.delete(tree_id)
+        return jsonify({'success': True})
+    except TreeError as e:
+        return jsonify({'success': False, 'error': str(e)}), e.status
+
+@app.route('/trees/<tree_id>/<any(lock, unlock, upgrade):op>', methods=['POST'])
+@admitted(lambda op, **_: 'upgrade' if op == 'upgrade' else 'lock')
+def tree_operation_endpoint(tree_id, op):
+    """Lock, unlock or upgrade a node in a named tree"""
+    try:
+        with trees.use(tree_id) as entry:
+            return node_operation(entry.nodes, op, tree_id=tree_id)
+    except TreeError as e:
+        return jsonify({'success': False, 'error': str(e)}), e.status
+
+@app.route('/trees/<tree_id>/nodes', methods=['POST'])
+@admitted('mutate')
+def tree_add_node_endpoint(tree_id):
+    """Add a leaf to a named tree"""
+    try:
+        with trees.use(tree_id) as entry:
+            return add_node(entry.nodes)
+    except TreeError as e:
+        return jsonify({'success': False, 'error': str(e)}), e.status
+
+@app.route('/trees/<tree_id>/nodes/<node_name>', methods=['DELETE'])
+@admitted('mutate')
+def tree_remove_node_endpoint(tree_id, node_name):
+    """Remove an unlocked subtree from a named tree"""
+    try:
+        with trees.use(tree_id) as entry:
+            return remove_node(entry.nodes, node_name)
+    except TreeError as e:
+        return jsonify({'success': False, 'error': str(e)}), e.status
+
+@app.route('/trees/<tree_id>/move', methods=['POST'])
+@admitted('mutate')
+def tree_move_node_endpoint(tree_id):
+    """Re-parent a subtree in a named tree"""
+    try:
+        with trees.use(tree_id) as entry:
+            return move_node(entry.nodes)
+    except TreeError as e:
+        return jsonify({'success': False, 'error': str(e)}), e.status
+
+@app.route('/trees/<tree_id>/tree', methods=['GET'])
+@admitted('read')
+def get_named_tree(tree_id):
+    """Get current state of a named tree"""
+    try:
+        with trees.use(tree_id) as entry:
+            tree_state = timed_operation('get_tree_state', get_tree_state, entry.nodes)
         return jsonify({'tree': tree_state})
+    except TreeError as e:
+        return jsonify({'error': str(e)}), e.status
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-if __name__ == "__main__":
-    app.run(debug=True, host='0.0.0.0', port=5000, threaded=True)
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus text exposition of request, operation and lock-wait metrics"""
+    return Response(registry.render(), content_type=CONTENT_TYPE)
+
+@app.route('/profile', methods=['GET'])
+def profile_endpoint():
+    """Top-K contended nodes (?top=10&sort=wait_seconds) or folded stacks (?format=folded)"""
+    if profiler is None:
+        return jsonify({'error': 'Profiling disabled, start the server with TREELOCK_PROFILE=1'}), 404
+    try:
+        if request.args.get('format') == 'folded':
+            metric = request.args.get('metric', 'wait_seconds')
+            return Response(profiler.folded(metric), content_type='text/plain; charset=utf-8')
+        top_k = int(request.args.get('top', 10))
+        return jsonify(profiler.report(top_k, request.args.get('sort', 'wait_seconds')))
+    except (KeyError, ValueError) as e:
+        return jsonify({'error': 'Bad profile query: %s' % e}), 400
+
+@app.route('/audit', methods=['GET'])
+@admitted('read')
+def audit_endpoint():
+    """Who held a node between two unix times: ?node=India&from=...&to=...[&tree=acme][&events=1]"""
+    if audit is None:
+        return jsonify({'error': 'Audit log disabled, start the server with TREELOCK_AUDIT_DIR=<dir>'}), 404
+    node_name = request.args.get('node')
+    if not node_name:
+        return jsonify({'error': 'Bad audit query: node is required'}), 400
+    try:
+        tree_id = request.args.get('tree', '')
+        end = float(request.args.get('to', time.time()))
+        start = float(request.args.get('from', end))
+    except ValueError as e:
+        return jsonify({'error': 'Bad audit query: %s' % e}), 400
+    # A lost event before `to` can leave an interval open or missing, so say how many there were
+    result = {'node': node_name, 'from': start, 'to': end,
+              'holders': audit.holders(node_name, start, end, tree_id),
+              'dropped': audit.dropped_before(end)}
+    if request.args.get('events'):
+        result['events'] = audit.events(node_name, start, end, tree_id)
+    return jsonify(result)
+
+BINARY_OPERATIONS = {
+    binary_protocol.OP_LOCK: 'lock',
+    binary_protocol.OP_UNLOCK: 'unlock',
+    binary_protocol.OP_UPGRADE: 'upgrade',
+}
+
+def binary_dispatch(op, node_id, uid):
+    """Run one binary-protocol operation on the default tree and return its status byte"""
+    op_name = BINARY_OPERATIONS.get(op)
+    if op_name is None:
+        return binary_protocol.BAD_OP
+    node = node_ids[node_id] if node_id < len(node_ids) else None
+    if node is None or node._removed:
+        return binary_protocol.NOT_FOUND
+    
+    op_class = 'upgrade' if op_name == 'upgrade' else 'lock'
+    if admission is not None:
+        try:
+            ADMISSION_WAIT.labels(op_class).observe(admission.enter(op_class))
+        except Rejected as e:
+            ADMISSION_REJECTED.labels(op_class, e.reason).inc()
+            return binary_protocol.REJECTED
+    try:
+        return binary_protocol.TRUE if run_operation(op_name, node, uid) else binary_protocol.FALSE
+    except Exception:
+        return binary_protocol.ERROR
+    finally:
+        if admission is not None:
+            admission.exit(op_class)
 
+def binary_tree_state():
+    """Lock owner of every node id, encoded for the binary protocol"""
+    owners = []
+    for node in list(node_ids):
+        if node is None or node._removed:
+            owners.append(binary_protocol.MISSING)
+        elif node.locked_by is None:
+            owners.append(binary_protocol.UNLOCKED)
+        elif isinstance(node.locked_by, int):
+            owners.append(node.locked_by)
+        else:
+            owners.append(binary_protocol.MISSING)
+    return binary_protocol.encode_tree(owners)
 
+def start_binary_server():
+    """Serve the binary protocol if TREELOCK_BINARY_PORT or TREELOCK_BINARY_SOCKET is set"""
+    if os.environ.get('TREELOCK_BINARY_SOCKET'):
+        path = os.environ['TREELOCK_BINARY_SOCKET']
+        if os.path.exists(path):
+            os.remove(path)
+        binary_protocol.serve(binary_dispatch, binary_tree_state, path=path)
+        print(f"Binary protocol listening on {path}")
+    elif os.environ.get('TREELOCK_BINARY_PORT'):
+        # Unauthenticated, so loopback only unless TREELOCK_BINARY_HOST says otherwise
+        host = os.environ.get('TREELOCK_BINARY_HOST', '127.0.0.1')
+        port = int(os.environ['TREELOCK_BINARY_PORT'])
+        binary_protocol.serve(binary_dispatch, binary_tree_state, host=host, port=port)
+        print(f"Binary protocol listening on {host}:{port}")
+
+def start_replication():
+    """Follow a primary if TREELOCK_REPLICA_OF is set, else feed replicas if a replication socket or port is set"""
+    global change_feed, replica
+    if REPLICA_OF:
+        replica = Replica(*parse_address(REPLICA_OF))
+        print(f"Replica of {REPLICA_OF}")
+    elif os.environ.get('TREELOCK_REPLICATION_SOCKET') or os.environ.get('TREELOCK_REPLICATION_PORT'):
+        change_feed = ChangeFeed(nodes, m)
+        Thread_safe.change_observer = tree_changed
+        if os.environ.get('TREELOCK_REPLICATION_SOCKET'):
+            change_feed.serve(path=os.environ['TREELOCK_REPLICATION_SOCKET'])
+        else:
+            change_feed.serve(port=int(os.environ['TREELOCK_REPLICATION_PORT']))
+        print("Streaming tree changes to replicas")
+
+services_lock = threading.Lock()
+services_started = False
+
+def init_services():
+    """Start the binary protocol server and replication in this process, once
+
+    Call it in the process that serves HTTP: `python app.py` does, and
+    serving_app() does for WSGI servers and `flask run`.
+    """
+    global services_started
+    with services_lock:
+        if services_started:
+            return
+        services_started = True
+        start_binary_server()
+        start_replication()
+
+def serving_app():
+    """App factory that starts the side services first, e.g. gunicorn -w 1 --threads 32 'app:serving_app()'"""
+    init_services()
+    return app
+
+if __name__ == "__main__":
+    # With the debug reloader this block runs in a watcher process too, which
+    # never serves; only the serving child (WERKZEUG_RUN_MAIN=true) starts them
+    use_reloader = os.environ.get('TREELOCK_RELOAD', '1') != '0'
+    if not use_reloader or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        init_services()
+    app.run(debug=True, host='0.0.0.0', port=int(os.environ.get('TREELOCK_HTTP_PORT', 5000)), threaded=True,
+            use_reloader=use_reloader)
@@ -0,0 +1,816 @@
+"""
+Append-only audit log of lock, unlock and upgrade operations.
+
+The engine reports every successful operation through
+Thread_safe.operation_observer, which the server sets to `sink`: the append of
+a bounded deque, called with one tuple after the node locks are released, so
+the request thread runs no Python code of ours and takes no lock of its own.
+Failed attempts go through record(). A background thread drains both queues
+every few milliseconds and appends each batch to the current segment file in
+blocks of up to BLOCK_EVENTS events.
+
+Order. Engine events carry their tree's sequence number, taken under the
+tree root's lock, so the writer sorts each batch by (tree, seq) and every
+node's events are back in the order the engine ran them, however the threads
+interleaved when queueing. Events after a missing number are held back for
+up to reorder_window seconds; a number still missing by then was dropped.
+Timestamps are taken after the locks are released, so the writer clamps them
+to be non-decreasing along that order and across the log: file order is time
+order.
+
+Loss. When the writer falls behind, a full engine queue discards its oldest
+events and record() discards new ones, rather than blocking the caller. Both
+are counted in `dropped`, reported to drop_observer and written into the next
+block with the earliest time the lost events may have happened, so
+dropped_before() can tell a query whether its answer may be missing events.
+
+Blocks are columnar, so a batch is encoded in a few passes over its columns
+instead of per-event Python code. Network byte order:
+
+    count (u32) | dropped (u32) | min ts (i64) | max ts (i64) | dropped since (i64) | new keys length (u32) | uids length (u32) | uid format (u8)
+    new keys: JSON list of keys first used in this block, appended to the segment's key table
+    timestamps: count x i64 ns
+    ops: count x u8, 1 = lock, 2 = unlock, 3 = upgrade, 4 = release (a descendant unlocked by an upgrade), +128 if successful
+    keys: count x u32 index into the segment's key table
+    uids: count x i64 (uid format 1) or a JSON list (uid format 0)
+
+    a key is "<tree id>:<node name>" (empty tree id for the default tree);
+    dropped since is the earliest time, in ns, of the dropped events (0 if none)
+
+When a segment reaches segment_bytes it is closed and gets a .keys index file
+holding its key table, the offset and time range of each block, for every key
+the blocks it appears in, and the locks held when the segment was opened; its
+time range is added to manifest.json. A query finds the segments covering its
+time range by binary search over the manifest and decodes only the blocks
+that hold the requested node and overlap the range, so "who held India
+between T1 and T2" stays cheap however long the log is.
+
+Segments left without an index by a crash are re-indexed by scanning them on
+startup.
+"""
+
+import bisect
+import json
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from collections import OrderedDict, deque
+from itertools import compress, islice, repeat, starmap
+from operator import gt, is_, itemgetter
+
+BLOCK = struct.Struct('!IIqqqIIB')
+UIDS_JSON, UIDS_INT = 0, 1
+SUCCESS = 0x80
+
+OP_CODES = {'lock': 1, 'unlock': 2, 'upgrade': 3, 'release': 4}
+OP_NAMES = {code: name for name, code in OP_CODES.items()}
+ACQUIRE = (OP_CODES['lock'], OP_CODES['upgrade'])
+RELEASE = OP_CODES['release']
+
+# Op byte of every queued op: names from the engine (always successful) and
+# bytes already encoded by record()
+_OP_BYTES = {name: code | SUCCESS for name, code in OP_CODES.items()}
+_OP_BYTES.update((code, code) for code in range(256))
+
+MANIFEST = 'manifest.json'
+MAX_UID_BYTES = 1024
+BLOCK_EVENTS = 4096
+_SWAP = sys.byteorder == 'little'
+
+_tree_of = itemgetter(0)
+_seq_of = itemgetter(1)
+_ts_of = itemgetter(2)
+_op_of = itemgetter(3)
+_name_of = itemgetter(4)
+_uid_of = itemgetter(5)
+
+
+def _key(tree_id, node_name):
+    return '%s:%s' % (tree_id, node_name)
+
+
+def _segment_path(directory, seq, suffix):
+    return os.path.join(directory, 'segment-%010d.%s' % (seq, suffix))
+
+
+def _apply(held, key, ts, op, ok, uid):
+    """Fold one event into held (key -> [since, uid]); returns the holding it ended, if any"""
+    if not ok:
+        return None
+    current = held.get(key)
+    if op in ACQUIRE:
+        if current is not None and current[1] == uid:
+            return None
+        held[key] = [ts, uid]
+        return current
+    if current is not None and (op == RELEASE or current[1] == uid):
+        del held[key]
+        return current
+    return None
+
+
+def _column(typecode, data):
+    """array of network-order data"""
+    values = array(typecode)
+    values.frombytes(data)
+    if _SWAP:
+        values.byteswap()
+    return values
+
+
+def _column_bytes(typecode, values):
+    values = array(typecode, values)
+    if _SWAP:
+        values.byteswap()
+    return values.tobytes()
+
+
+def _decode_block(data, offset=0):
+    """(header, new keys, timestamps, op bytes, key ids, uids) of the block at offset"""
+    count, dropped, min_ts, max_ts, dropped_since, keys_len, uids_len, uid_format = BLOCK.unpack_from(data, offset)
+    position = offset + BLOCK.size
+    new_keys = json.loads(data[position:position + keys_len]) if keys_len else []
+    position += keys_len
+    timestamps = _column('q', data[position:position + 8 * count])
+    position += 8 * count
+    ops = data[position:position + count]
+    position += count
+    ids = _column('I', data[position:position + 4 * count])
+    position += 4 * count
+    if uid_format == UIDS_INT:
+        uids = _column('q', data[position:position + uids_len]).tolist()
+    else:
+        uids = json.loads(data[position:position + uids_len])
+    header = (count, dropped, min_ts, max_ts, dropped_since)
+    return header, new_keys, timestamps, ops, ids, uids
+
+
+def _block_size(data, offset):
+    count, _, _, _, _, keys_len, uids_len, _ = BLOCK.unpack_from(data, offset)
+    return BLOCK.size + keys_len + 13 * count + uids_len
+
+
+class _SegmentIndex:
+    """Index of the open segment, in memory"""
+
+    def __init__(self, seq, held):
+        self.seq = seq
+        self.held = held        # key -> [since, uid] when the segment opened
+        self.keys = []          # key table: key id -> key
+        self.key_ids = {}       # key -> key id
+        self.postings = []      # key id -> numbers of the blocks holding it
+        self.blocks = []        # [offset, length, min_ts, max_ts, count, dropped, dropped since]
+        self.last = {}          # key id -> [ts, op, uid] of its last successful event
+        self.min_ts = None
+        self.max_ts = None
+        self.count = 0
+        self.dropped = 0
+        self.dropped_since = None  # earliest time of the segment's dropped events
+
+    def key_id(self, key):
+        return self.key_ids.get(key)
+
+    def add_key(self, key):
+        key_id = self.key_ids[key] = len(self.keys)
+        self.keys.append(key)
+        self.postings.append([])
+        return key_id
+
+    def add_block(self, offset, length, header, timestamps, ops, ids, uids):
+        """Index one written block; per distinct key, not per event"""
+        count, dropped, min_ts, max_ts, dropped_since = header
+        number = len(self.blocks)
+        self.blocks.append([offset, length, min_ts, max_ts, count, dropped, dropped_since])
+        if not count or min(ops) & SUCCESS:
+            last = dict(zip(ids, range(count)))
+            block_keys = last
+        else:
+            successes = list(map(SUCCESS.__and__, ops))
+            last = dict(zip(compress(ids, successes), compress(range(count), successes)))
+            block_keys = set(ids)
+        postings = self.postings
+        for key_id in block_keys:
+            postings[key_id].append(number)
+        for key_id, i in last.items():
+            self.last[key_id] = [timestamps[i], ops[i] & ~SUCCESS, uids[i]]
+        if self.min_ts is None:
+            self.min_ts = min_ts
+        self.max_ts = max_ts
+        self.count += count
+        if dropped:
+            self.dropped += dropped
+            if self.dropped_since is None or dropped_since < self.dropped_since:
+                self.dropped_since = dropped_since
+
+    def held_at_close(self):
+        """Locks held after the segment's last event: held at open, updated by each key's last success"""
+        held = {key: list(holding) for key, holding in self.held.items()}
+        for key_id, (ts, op, uid) in self.last.items():
+            key = self.keys[key_id]
+            if op in ACQUIRE:
+                current = held.get(key)
+                if current is None or current[1] != uid:
+                    held[key] = [ts, uid]
+            else:
+                held.pop(key, None)
+        return held
+
+    def blocks_for(self, key, start, end):
+        """Blocks that hold key and overlap [start, end], and the key's id"""
+        key_id = self.key_ids.get(key)
+        if key_id is None:
+            return None, []
+        blocks = self.blocks
+        return key_id, [blocks[number] for number in self.postings[key_id]
+                        if blocks[number][2] <= end and blocks[number][3] >= start]
+
+    def write(self, directory):
+        """Write the index file of a closed segment"""
+        _write_json(_segment_path(directory, self.seq, 'keys'), {
+            'seq': self.seq, 'min_ts': self.min_ts, 'max_ts': self.max_ts,
+            'count': self.count, 'dropped': self.dropped, 'dropped_since': self.dropped_since, 'held': self.held,
+            'keys': self.keys, 'postings': self.postings, 'blocks': self.blocks,
+            'last': {self.keys[key_id]: event for key_id, event in self.last.items()}})
+
+
+class _ClosedIndex(_SegmentIndex):
+    """Index of a closed segment, loaded from its .keys file"""
+
+    def __init__(self, directory, seq):
+        with open(_segment_path(directory, seq, 'keys')) as f:
+            data = json.load(f)
+        super().__init__(seq, data['held'])
+        self.keys = data['keys']
+        self.key_ids = {key: key_id for key_id, key in enumerate(self.keys)}
+        self.postings = data['postings']
+        self.blocks = data['blocks']
+        self.last = {self.key_ids[key]: event for key, event in data['last'].items()}
+        self.min_ts = data['min_ts']
+        self.max_ts = data['max_ts']
+        self.count = data['count']
+        self.dropped = data['dropped']
+        self.dropped_since = data['dropped_since']
+
+
+def _block_events(f, block, key_id, start, end):
+    """(ts, op, success, uid) of key_id's events in one block of an open segment file with start <= ts <= end"""
+    f.seek(block[0])
+    _, _, timestamps, ops, ids, uids = _decode_block(f.read(block[1]))
+    events = []
+    for i in compress(range(len(ids)), map(key_id.__eq__, ids)):
+        if start <= timestamps[i] <= end:
+            op = ops[i]
+            events.append((timestamps[i], op & ~SUCCESS, bool(op & SUCCESS), uids[i]))
+    return events
+
+
+def _read_events(path, blocks, key_id, start, end):
+    """(ts, op, success, uid) of key_id's events in the given blocks with start <= ts <= end"""
+    events = []
+    with open(path, 'rb') as f:
+        for block in blocks:
+            events.extend(_block_events(f, block, key_id, start, end))
+    return events
+
+
+def _write_json(path, data):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+class AuditLog:
+    """Buffered, segmented, indexed event log; see the module docstring"""
+
+    def __init__(self, directory, segment_bytes=64 * 1024 * 1024, capacity=65536,
+                 flush_interval=0.02, reorder_window=0.5, cached_indexes=8, drop_observer=None):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.reorder_window = reorder_window
+        self.drop_observer = drop_observer
+        self.dropped = 0
+        self._engine = deque(maxlen=capacity)
+        # Thread_safe.operation_observer: queue one engine event; never blocks
+        self.sink = self._engine.append
+        self._outside = deque()          # record() events
+        self._record_drops = 0       # record() calls turned away, bumped by request threads
+        self._record_drops_seen = 0
+        self._record_dropped_at = None  # time of the first record() call turned away since the last drain
+        self._waiting = []           # engine events held back behind a missing number
+        self._expected = {}          # tree number -> next seq to write
+        self._gaps = {}              # tree number -> [missing seq, monotonic time first seen]
+        self._tree_ts = {}           # tree number -> timestamp of its last written event
+        self._tree_ids = {}          # tree number -> tree id
+        self._ids = {}               # tree number -> {node name: key id in the open segment}
+        self._write_lock = threading.Lock()   # one drainer at a time
+        self._index_lock = threading.Lock()   # segment list and current index vs queries
+        self._cached_indexes = cached_indexes
+        self._index_cache = OrderedDict()
+
+        os.makedirs(directory, exist_ok=True)
+        self._segments = self._load_manifest()  # closed segments: [seq, min_ts, max_ts, dropped, dropped since]
+        self._held = {}
+        self._last_ts = 0
+        self._recover()
+        self._open_segment(self._segments[-1][0] + 1 if self._segments else 0)
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+        self._thread.start()
+
+    # Hot path
+
+    def record(self, op, node_name, uid, success, tree_id=''):
+        """Queue one event from outside the engine, e.g. a failed attempt; never blocks"""
+        if len(self._outside) >= self.capacity:
+            if self._record_dropped_at is None:
+                self._record_dropped_at = time.time_ns()
+            self._record_drops += 1
+            return
+        code = OP_CODES[op] | (SUCCESS if success else 0)
+        self._outside.append((time.time_ns(), code, _key(tree_id, node_name), uid))
+
+    def name_tree(self, tree, tree_id):
+        """Log the engine events of tree (a StructureLock.number) under tree_id; unnamed trees log under ''"""
+        self._tree_ids[tree] = tree_id
+
+    # Writer
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self._drain()
+        self._drain(final=True)
+
+    def _drain(self, final=False):
+        with self._write_lock:
+            engine = self._engine
+            events = self._waiting
+            events.extend(starmap(engine.popleft, repeat((), len(engine))))
+            records = self._outside
+            records = list(starmap(records.popleft, repeat((), len(records))))
+            dropped_since = self._record_dropped_at
+            self._record_dropped_at = None
+            dropped = self._record_drops - self._record_drops_seen
+            self._record_drops_seen += dropped
+            if dropped and dropped_since is None:
+                dropped_since = self._last_ts  # turned away just now, after the read above
+
+            ready, groups, timestamps, lost, lost_since = self._order(events, final)
+            if lost:
+                dropped += lost
+                dropped_since = lost_since if dropped_since is None else min(dropped_since, lost_since)
+            if dropped:
+                self.dropped += dropped
+                if self.drop_observer is not None:
+                    self.drop_observer(dropped)
+            if not ready and not records and not dropped:
+                return
+
+            new_keys = []
+            with self._index_lock:
+                if ready:
+                    ops = list(map(_op_of, ready))
+                    uids = list(map(_uid_of, ready))
+                    ids = self._engine_ids(groups, list(map(_name_of, ready)), new_keys)
+                else:
+                    ops, uids, ids = [], [], []
+                if records:
+                    record_timestamps, record_ops, record_keys, record_uids = zip(*records)
+                    timestamps += record_timestamps
+                    ops += record_ops
+                    ids += [self._key_id(key, new_keys) for key in record_keys]
+                    uids += record_uids
+            if (records or len(groups) > 1) and _unsorted(timestamps):
+                # Merge trees and records by time; stable, so each tree stays in seq order
+                order = sorted(range(len(timestamps)), key=timestamps.__getitem__)
+                timestamps, ops, ids, uids = (
+                    list(map(column.__getitem__, order)) for column in (timestamps, ops, ids, uids))
+            self._write_blocks(timestamps, ops, ids, uids, new_keys, dropped, dropped_since or 0)
+
+    def _order(self, events, final):
+        """
+        Engine events ready to write, in (tree, seq) order; their (tree, start,
+        stop) runs; their timestamps, clamped; the count of numbers given up on
+        and the earliest time those events may have happened. The rest wait in
+        _waiting.
+        """
+        self._waiting = []
+        if not events:
+            return [], [], [], 0, None
+        # Two stable passes on int keys sort faster than one on (tree, seq) tuples
+        events.sort(key=_seq_of)
+        events.sort(key=_tree_of)
+        trees = None
+        ready = []
+        groups = []
+        timestamps = []
+        lost = 0
+        lost_since = None
+        now = time.monotonic()
+        start, end = 0, len(events)
+        while start < end:
+            tree = events[start][0]
+            if events[-1][0] == tree:
+                stop = end
+            else:
+                if trees is None:
+                    trees = list(map(_tree_of, events))
+                stop = bisect.bisect_right(trees, tree, start)
+            expected = self._expected.get(tree, events[start][1])
+            if events[start][1] == expected and events[stop - 1][1] - expected == stop - start - 1:
+                # No gaps, the usual case
+                group = events[start:stop] if start or stop != end else events
+                expected = events[stop - 1][1] + 1
+                self._gaps.pop(tree, None)
+            else:
+                group = []
+                position = start
+                while position < stop:
+                    event = events[position]
+                    if event[1] < expected:
+                        position += 1  # arrived after its number was given up on; counted as dropped
+                        continue
+                    if event[1] == expected:
+                        group.append(event)
+                        expected += 1
+                        position += 1
+                        continue
+                    gap = self._gaps.get(tree)
+                    if gap is None or gap[0] != expected:
+                        gap = self._gaps[tree] = [expected, now]
+                    if not final and now - gap[1] < self.reorder_window:
+                        self._waiting.extend(events[position:stop])
+                        break
+                    lost += event[1] - expected
+                    # The missing events came after the tree's last written one
+                    since = group[-1][2] if group else self._tree_ts.get(tree, 0)
+                    lost_since = since if lost_since is None else min(lost_since, since)
+                    expected = event[1]
+                    del self._gaps[tree]
+            self._expected[tree] = expected
+            if group:
+                group_timestamps = list(map(_ts_of, group))
+                if _unsorted(group_timestamps):
+                    # Reported after the locks were released: keep time in engine order
+                    group_timestamps = list(_running_max(group_timestamps))
+                self._tree_ts[tree] = group_timestamps[-1]
+                groups.append((tree, len(ready), len(ready) + len(group)))
+                ready += group
+                timestamps += group_timestamps
+            start = stop
+        return ready, groups, timestamps, lost, lost_since
+
+    def _engine_ids(self, groups, names, new_keys):
+        """Key ids of the ready engine events; caller holds _index_lock"""
+        ids = []
+        for tree, start, stop in groups:
+            tree_names = names[start:stop] if len(groups) > 1 else names
+            known = self._ids.get(tree)
+            if known is None:
+                known = self._ids[tree] = {}
+            tree_ids = list(map(known.get, tree_names))
+            if None in tree_ids:
+                tree_id = self._tree_ids.get(tree, '')
+                for name in set(compress(tree_names, map(is_, tree_ids, repeat(None)))):
+                    known[name] = self._key_id(_key(tree_id, name), new_keys)
+                tree_ids = list(map(known.get, tree_names))
+            ids += tree_ids
+        return ids
+
+    def _key_id(self, key, new_keys):
+        """Id of key in the open segment's key table, adding it if new; caller holds _index_lock"""
+        key_id = self._current.key_id(key)
+        if key_id is None:
+            key_id = self._current.add_key(key)
+            new_keys.append(key)
+        return key_id
+
+    def _write_blocks(self, timestamps, ops, ids, uids, new_keys, dropped, dropped_since):
+        """Append one drain's events, in blocks of at most BLOCK_EVENTS so a query never decodes many more than it needs"""
+        last_ts = self._last_ts
+        if timestamps and timestamps[0] < last_ts:
+            clamped = bisect.bisect_left(timestamps, last_ts)
+            timestamps[:clamped] = repeat(last_ts, clamped)
+        op_bytes = bytes(map(_OP_BYTES.__getitem__, ops))
+
+        if self._file is None:
+            self._file = open(_segment_path(self.directory, self._current.seq, 'log'), 'ab')
+        for start in range(0, max(len(timestamps), 1), BLOCK_EVENTS):
+            stop = start + BLOCK_EVENTS
+            block_timestamps = timestamps[start:stop]
+            block_ops, block_ids, block_uids = op_bytes[start:stop], ids[start:stop], uids[start:stop]
+            if block_timestamps:
+                block_min, block_max = block_timestamps[0], block_timestamps[-1]
+            else:
+                # Only drops to report
+                block_min = block_max = max(last_ts, time.time_ns())
+            # The keys and drops of the whole drain go with its first block
+            keys_bytes = json.dumps(new_keys).encode() if new_keys and not start else b''
+            header = (len(block_timestamps), 0 if start else dropped, block_min, block_max,
+                      0 if start else dropped_since)
+            uid_bytes, uid_format = _encode_uids(block_uids)
+            block = b''.join((BLOCK.pack(*header, len(keys_bytes), len(uid_bytes), uid_format), keys_bytes,
+                              _column_bytes('q', block_timestamps), block_ops, _column_bytes('I', block_ids), uid_bytes))
+            self._file.write(block)
+            with self._index_lock:
+                self._current.add_block(self._offset, len(block), header, block_timestamps, block_ops,
+                                        block_ids, block_uids)
+            self._offset += len(block)
+            last_ts = block_max
+        self._file.flush()
+        self._last_ts = last_ts
+        if self._offset >= self.segment_bytes:
+            self._rotate()
+
+    def _open_segment(self, seq):
+        self._current = _SegmentIndex(seq, {key: list(holding) for key, holding in self._held.items()})
+        self._ids = {}
+        self._file = None  # created on first write, so an idle log leaves no files behind
+        self._offset = 0
+
+    def _close_segment(self):
+        """Close the current segment, index it and add it to the manifest; caller holds _write_lock"""
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        index = self._current
+        index.write(self.directory)
+        self._held = index.held_at_close()
+        with self._index_lock:
+            self._segments.append([index.seq, index.min_ts, index.max_ts, index.dropped, index.dropped_since])
+        _write_json(os.path.join(self.directory, MANIFEST), {'segments': self._segments})
+
+    def _rotate(self):
+        self._close_segment()
+        self._open_segment(self._current.seq + 1)
+
+    def flush(self):
+        """Write everything queued so far, except events waiting for a missing number"""
+        self._drain()
+
+    def close(self):
+        """Stop the writer and close the current segment"""
+        self._stop.set()
+        self._thread.join()
+        with self._write_lock:
+            if self._file is not None:
+                # Queries after close read the closed segment through its index only
+                self._rotate()
+
+    # Startup
+
+    def _load_manifest(self):
+        path = os.path.join(self.directory, MANIFEST)
+        if not os.path.exists(path):
+            return []
+        with open(path) as f:
+            return json.load(f)['segments']
+
+    def _recover(self):
+        """Rebuild the held-lock state and index segments the manifest misses (the one open at a crash)"""
+        if self._segments:
+            self._held = self._index(self._segments[-1][0]).held_at_close()
+            self._last_ts = self._segments[-1][2]
+
+        known = {entry[0] for entry in self._segments}
+        found = sorted(int(name[len('segment-'):-len('.log')]) for name in os.listdir(self.directory)
+                       if name.startswith('segment-') and name.endswith('.log'))
+        changed = False
+        for seq in found:
+            if seq in known:
+                continue
+            path = _segment_path(self.directory, seq, 'log')
+            index = _SegmentIndex(seq, {key: list(holding) for key, holding in self._held.items()})
+            with open(path, 'rb') as f:
+                data = f.read()
+            offset = 0
+            while offset + BLOCK.size <= len(data):
+                length = _block_size(data, offset)
+                if offset + length > len(data):
+                    break  # torn final block
+                header, new_keys, timestamps, ops, ids, uids = _decode_block(data, offset)
+                for key in new_keys:
+                    index.add_key(key)
+                index.add_block(offset, length, header, timestamps, ops, ids, uids)
+                self._last_ts = max(self._last_ts, header[3])
+                offset += length
+            if not index.blocks:
+                os.remove(path)
+                continue
+            index.write(self.directory)
+            self._held = index.held_at_close()
+            self._segments.append([seq, index.min_ts, index.max_ts, index.dropped, index.dropped_since])
+            changed = True
+        if changed:
+            self._segments.sort()
+            _write_json(os.path.join(self.directory, MANIFEST), {'segments': self._segments})
+
+    # Queries
+
+    def _index(self, seq):
+        """Index of a closed segment, cached LRU"""
+        index = self._index_cache.get(seq)
+        if index is None:
+            index = _ClosedIndex(self.directory, seq)
+            self._index_cache[seq] = index
+            self._trim_cache()
+        else:
+            self._index_cache.move_to_end(seq)
+        return index
+
+    def _trim_cache(self):
+        while len(self._index_cache) > self._cached_indexes:
+            self._index_cache.popitem(last=False)
+
+    def _covering(self, start_ns, end_ns):
+        """Indexes of the segments that may hold events in [start_ns, end_ns], oldest first"""
+        first = bisect.bisect_left([entry[2] for entry in self._segments], start_ns)
+        last = bisect.bisect_right([entry[1] for entry in self._segments], end_ns)
+        indexes = [self._index(entry[0]) for entry in self._segments[first:last]]
+        if self._current.min_ts is not None and self._current.min_ts <= end_ns:
+            indexes.append(self._current)
+        return indexes
+
+    def _records(self, key, start_ns, end_ns):
+        """(ts, op, success, uid) of the events on key in [start_ns, end_ns], oldest first"""
+        with self._index_lock:
+            hits = []
+            for index in self._covering(start_ns, end_ns):
+                key_id, blocks = index.blocks_for(key, start_ns, end_ns)
+                if blocks:
+                    hits.append((index.seq, key_id, blocks))
+        records = []
+        for seq, key_id, blocks in hits:
+            records.extend(_read_events(_segment_path(self.directory, seq, 'log'), blocks, key_id, start_ns, end_ns))
+        return records
+
+    def _holding_at(self, key, ts_ns):
+        """[since, uid] of the lock on key just before ts_ns, or None"""
+        with self._index_lock:
+            segments = self._segments + ([[self._current.seq, self._current.min_ts]]
+                                         if self._current.min_ts is not None else [])
+            position = bisect.bisect_right([entry[1] for entry in segments], ts_ns - 1) - 1
+            if position < 0:
+                return None
+            seq = segments[position][0]
+            index = self._current if seq == self._current.seq else self._index(seq)
+            holding = index.held.get(key)
+            key_id, blocks = index.blocks_for(key, float('-inf'), ts_ns - 1)
+        if not blocks:
+            return holding
+        # Engine events on a node alternate between taking and freeing it, so
+        # its last successful event decides; read blocks back from ts_ns until one has it
+        with open(_segment_path(self.directory, seq, 'log'), 'rb') as f:
+            for block in reversed(blocks):
+                successes = [event for event in _block_events(f, block, key_id, float('-inf'), ts_ns - 1) if event[2]]
+                if successes:
+                    ts, op, _, uid = successes[-1]
+                    return [ts, uid] if op in ACQUIRE else None
+        return holding
+
+    def dropped_before(self, end):
+        """How many events were dropped that may have happened before end (unix seconds)"""
+        end_ns = int(end * 1e9)
+        with self._index_lock:
+            dropped = sum(entry[3] for entry in self._segments if entry[3] and entry[4] <= end_ns)
+            if self._current.dropped_since is not None and self._current.dropped_since <= end_ns:
+                dropped += sum(block[5] for block in self._current.blocks if block[5] and block[6] <= end_ns)
+        return dropped
+
+    def events(self, node_name, start, end, tree_id=''):
+        """Events on a node with start <= time <= end (unix seconds), oldest first"""
+        return [{'time': ts / 1e9, 'op': OP_NAMES[op], 'uid': uid, 'success': ok}
+                for ts, op, ok, uid in self._records(_key(tree_id, node_name), int(start * 1e9), int(end * 1e9))]
+
+    def holders(self, node_name, start, end, tree_id=''):
+        """
+        Who held a node at any point between start and end (unix seconds).
+
+        Returns [{'uid': ..., 'from': t, 'to': t or None}] oldest first. 'from' is
+        when the lock was taken (possibly before start); 'to' is when it was
+        released, or None if it was still held at end.
+        """
+        key = _key(tree_id, node_name)
+        start_ns, end_ns = int(start * 1e9), int(end * 1e9)
+        held = {}
+        holding = self._holding_at(key, start_ns)
+        if holding is not None:
+            held[key] = holding
+
+        intervals = []
+        for ts, op, ok, uid in self._records(key, start_ns, end_ns):
+            ended = _apply(held, key, ts, op, ok, uid)
+            if ended is not None:
+                intervals.append({'uid': ended[1], 'from': ended[0] / 1e9, 'to': ts / 1e9})
+        if key in held:
+            since, uid = held[key]
+            intervals.append({'uid': uid, 'from': since / 1e9, 'to': None})
+        return intervals
+
+
+def _unsorted(values):
+    return any(map(gt, values, islice(values, 1, None)))
+
+
+def _running_max(values):
+    highest = values[0]
+    for value in values:
+        if value > highest:
+            highest = value
+        yield highest
+
+
+def _encode_uids(uids):
+    """uid column: packed i64 when every uid is a plain int that fits, else JSON"""
+    if uids and not set(map(type, uids)) - {int}:
+        try:
+            return _column_bytes('q', uids), UIDS_INT
+        except OverflowError:
+            pass
+    encoded = [json.dumps(uid) for uid in uids]
+    for i, uid_json in enumerate(encoded):
+        if len(uid_json) > MAX_UID_BYTES:
+            encoded[i] = json.dumps(str(uids[i])[:MAX_UID_BYTES // 4])
+    return ('[%s]' % ','.join(encoded)).encode(), UIDS_JSON
+
+
+def main():
+    import shutil
+    import tempfile
+    import Thread_safe
+    from Thread_safe import build_tree, lock, unlock
+
+    n, rounds = 1023, 100_000
+    node_names = ['n%d' % i for i in range(n)]
+    nodes = build_tree(node_names, 2)
+    targets = [nodes[node_names[i % (n // 2) + n // 2]] for i in range(rounds)]
+
+    def run(log, pairs, drain):
+        """Seconds for lock/unlock pairs on the first `pairs` targets, and for writing out what they logged if drain"""
+        if log is not None:
+            Thread_safe.operation_observer = log.sink
+        start = time.perf_counter()
+        for i, node in enumerate(targets[:pairs]):
+            lock(node, i)
+            unlock(node, i)
+        if drain:
+            # Whatever the writer has not drained yet is part of the cost
+            log.flush()
+        elapsed = time.perf_counter() - start
+        Thread_safe.operation_observer = None
+        return elapsed
+
+    def timed_flush(log):
+        start = time.perf_counter()
+        log.flush()
+        return time.perf_counter() - start
+
+    directory = tempfile.mkdtemp(prefix='treelock-audit-')
+    try:
+        # The lock path alone: short runs with and without the queue, alternating,
+        # with the writer parked while timing and draining each run's events afterwards
+        log = AuditLog(directory, segment_bytes=4 * 1024 * 1024, flush_interval=3600)
+        pairs = 2000
+        runs = rounds // pairs
+        timings = [(run(None, pairs, False), run(log, pairs, False), timed_flush(log)) for _ in range(runs)]
+        base, queued, writer = (sorted(column)[runs // 2] for column in zip(*timings))
+        log.close()
+        # End to end: the writer drains at its normal interval while timing. Under
+        # the GIL its work competes with the calling thread, as it does with
+        # request threads in the server
+        log = AuditLog(directory, segment_bytes=4 * 1024 * 1024, capacity=1 << 23)
+        timings = [(run(None, rounds, False), run(log, rounds, True)) for _ in range(5)]
+        plain, audited = (min(column) for column in zip(*timings))
+        log.close()
+        print('lock+unlock without audit:   %6.2f us/pair' % (base / pairs * 1e6))
+        print('lock+unlock, lock path:      %6.2f us/pair  (%+.1f%%, median of %d runs)' % (
+            queued / pairs * 1e6, (queued / base - 1) * 100, runs))
+        print('writer, per event:           %6.2f us' % (writer / (2 * pairs) * 1e6))
+        print('lock+unlock, end to end:     %6.2f us/pair  (%+.1f%%, writer draining every %g ms)' % (
+            audited / rounds * 1e6, (audited / plain - 1) * 100, log.flush_interval * 1000))
+
+        log = AuditLog(directory)
+        node_name = targets[-1].name
+        start = time.perf_counter()
+        held = log.holders(node_name, 0, time.time())
+        print('holders() over %d segments: %.2f ms, %d intervals' % (
+            len(log._segments), (time.perf_counter() - start) * 1000, len(held)))
+        middle = (held[0]['from'] + held[-1]['from']) / 2
+        start = time.perf_counter()
+        window = log.holders(node_name, middle, middle + 0.001)
+        print('holders() for a 1 ms window: %.2f ms, %d intervals' % (
+            (time.perf_counter() - start) * 1000, len(window)))
+        log.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
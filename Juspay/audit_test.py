@@ -0,0 +1,188 @@
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import Thread_safe
+from audit import AuditLog
+from Thread_safe import build_tree, lock, unlock, upgrade_lock
+
+def pause():
+    """Let the clock move so events get distinct timestamps"""
+    time.sleep(0.002)
+    return time.time()
+
+def test_holders_across_segments_and_restart():
+    """Holder intervals survive segment rotation, reopening and an unindexed segment"""
+    directory = tempfile.mkdtemp(prefix='treelock-audit-test-')
+    try:
+        log = AuditLog(directory, segment_bytes=64)  # a couple of events per segment
+        t0 = pause()
+        log.record('lock', 'India', 1, True)
+        log.record('lock', 'India', 2, False)
+        log.flush()
+        t1 = pause()
+        log.record('unlock', 'India', 1, True)
+        log.record('lock', 'India', 2, True)
+        log.flush()
+        t2 = pause()
+        log.record('release', 'India', 2, True)
+        log.record('upgrade', 'Asia', 2, True)
+        log.flush()
+        log.record('lock', 'India', 3, True, tree_id='acme')
+        t3 = pause()
+        log.flush()
+        assert len(log._segments) >= 3
+
+        held = log.holders('India', t0, t3)
+        assert [h['uid'] for h in held] == [1, 2]
+        assert t0 <= held[0]['from'] <= held[0]['to'] <= held[1]['from'] <= held[1]['to'] <= t2 + 0.001
+
+        # Only uid 2 held India during (t1, t2); its lock started inside the window
+        assert [h['uid'] for h in log.holders('India', t1 + 0.001, t2)] == [2]
+        # A lock taken before the window and still held shows up with to=None
+        asia = log.holders('Asia', t3, t3 + 1)
+        assert len(asia) == 1 and asia[0]['uid'] == 2 and t2 <= asia[0]['from'] <= t3 and asia[0]['to'] is None
+        assert [h['uid'] for h in log.holders('India', t0, t3, tree_id='acme')] == [3]
+        assert [e['success'] for e in log.events('India', t0, t1)] == [True, False]
+        log.close()
+
+        # Reopen, then stop a writer without closing its segment, as in a crash
+        log = AuditLog(directory, segment_bytes=64)
+        assert log.holders('India', t0, t3) == held
+        log.record('unlock', 'Asia', 2, True)
+        t4 = pause()
+        log.flush()
+        log._stop.set()
+        log._thread.join()
+
+        log = AuditLog(directory, segment_bytes=64)
+        asia = log.holders('Asia', t3, t4)
+        assert len(asia) == 1 and t3 <= asia[0]['to'] <= t4
+        assert log.holders('Asia', t4, t4 + 1) == []
+        log.close()
+    finally:
+        shutil.rmtree(directory)
+
+def test_engine_order_under_contention():
+    """Events reported by the engine after its critical sections are logged in engine order, so holder intervals are exact"""
+    directory = tempfile.mkdtemp(prefix='treelock-audit-test-')
+    nodes = build_tree(["World", "Asia", "Africa", "China", "India", "SouthAfrica", "Egypt"], 2)
+    log = AuditLog(directory)
+    Thread_safe.operation_observer = log.sink
+    acquired = {}
+    previous_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-5)  # interleave threads between the engine call and its return
+
+    def worker(uid):
+        counts = [0, 0]
+        for i in range(2000):
+            if lock(nodes["India"], uid):
+                counts[0] += 1
+                # Every other time move the lock up to Asia, which releases India
+                if i % 2 and upgrade_lock(nodes["Asia"], uid):
+                    counts[1] += 1
+                    unlock(nodes["Asia"], uid)
+                else:
+                    unlock(nodes["India"], uid)
+        acquired[uid] = counts
+
+    try:
+        start = time.time()
+        threads = [threading.Thread(target=worker, args=(uid,)) for uid in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        end = time.time()
+        log.flush()
+
+        # The raw events on a node alternate: taken by a uid, then freed by the same uid
+        for name in ('India', 'Asia'):
+            events = log.events(name, start, end)
+            assert all(e['success'] for e in events)
+            assert [e['op'] in ('lock', 'upgrade') for e in events] == [True, False] * (len(events) // 2)
+            assert all(a['uid'] == b['uid'] for a, b in zip(events[::2], events[1::2]))
+
+        india = log.holders('India', start, end)
+        asia = log.holders('Asia', start, end)
+        assert len(india) == sum(counts[0] for counts in acquired.values())
+        assert len(asia) == sum(counts[1] for counts in acquired.values()) > 0
+        for intervals in (india, asia):
+            assert all(h['to'] is not None and h['from'] <= h['to'] for h in intervals)
+            assert all(a['to'] <= b['from'] for a, b in zip(intervals, intervals[1:]))
+        log.close()
+    finally:
+        sys.setswitchinterval(previous_interval)
+        Thread_safe.operation_observer = None
+        shutil.rmtree(directory)
+
+def test_reordering_and_gaps():
+    """The writer puts engine events back in seq order, waits out a gap, then counts it as dropped"""
+    directory = tempfile.mkdtemp(prefix='treelock-audit-test-')
+    nodes = build_tree(["World", "Asia", "Africa"], 2)
+    tree = nodes["World"]._structure.number
+    drops = []
+    log = AuditLog(directory, flush_interval=3600, reorder_window=0.05, drop_observer=drops.append)
+    try:
+        log.name_tree(tree, 'acme')
+        start = pause()
+        now = time.time_ns()
+        # Reported in the wrong order, with the unlock timestamped first
+        log.sink((tree, 2, now, 'unlock', 'Asia', 5))
+        log.sink((tree, 1, now + 1000000, 'lock', 'Asia', 5))
+        log.flush()
+        events = log.events('Asia', start, time.time() + 1, tree_id='acme')
+        assert [e['op'] for e in events] == ['lock', 'unlock']
+        assert events[0]['time'] == events[1]['time']
+        assert log.events('Asia', start, time.time() + 1) == []
+
+        # seq 3 is missing: 4 waits for the reorder window, then 3 counts as dropped
+        log.sink((tree, 4, time.time_ns(), 'lock', 'Africa', 6))
+        log.flush()
+        assert log.events('Africa', start, time.time() + 1, tree_id='acme') == [] and log.dropped == 0
+        time.sleep(0.06)
+        log.flush()
+        assert [e['uid'] for e in log.events('Africa', start, time.time() + 1, tree_id='acme')] == [6]
+        assert log.dropped == 1 and drops == [1]
+        # Queries reaching past the last event written before the gap are flagged
+        assert log.dropped_before(time.time()) == 1 and log.dropped_before(start) == 0
+
+        # Arriving after it was given up on, seq 3 is not written out of order
+        log.sink((tree, 3, time.time_ns(), 'lock', 'Asia', 7))
+        log.sink((tree, 5, time.time_ns(), 'unlock', 'Africa', 6))
+        log.close()
+        assert [e['op'] for e in log.events('Asia', start, time.time() + 1, tree_id='acme')] == ['lock', 'unlock']
+        assert [e['op'] for e in log.events('Africa', start, time.time() + 1, tree_id='acme')] == ['lock', 'unlock']
+    finally:
+        shutil.rmtree(directory)
+
+def test_full_queue_is_counted():
+    """record() turns events away when its queue is full, and the count reaches the metric hook and queries"""
+    directory = tempfile.mkdtemp(prefix='treelock-audit-test-')
+    drops = []
+    log = AuditLog(directory, capacity=2, flush_interval=3600, drop_observer=drops.append)
+    try:
+        start = pause()
+        for uid in range(3):
+            log.record('lock', 'India', uid, False)
+        log.flush()
+        assert [e['uid'] for e in log.events('India', start, time.time())] == [0, 1]
+        assert log.dropped == 1 and drops == [1]
+        assert log.dropped_before(time.time()) == 1 and log.dropped_before(start) == 0
+        log.close()
+
+        # The count survives the segment being closed and the log reopened
+        log = AuditLog(directory, flush_interval=3600)
+        assert log.dropped_before(time.time()) == 1
+        log.close()
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    test_holders_across_segments_and_restart()
+    test_engine_order_under_contention()
+    test_reordering_and_gaps()
+    test_full_queue_is_counted()
+    print("Audit log tests passed!")
@@ -0,0 +1,152 @@
+"""
+Compact binary protocol for internal clients, served next to the JSON API.
+
+Nodes are addressed by integer id: the index of the node in the level-order
+name list the tree was built from (leaves added at runtime get the next ids;
+ids of removed nodes are never reused).
+Every request is a fixed 13-byte frame, network byte order:
+
+    op (u8) | node id (u32) | uid (i64)
+
+    op 1 = lock, 2 = unlock, 3 = upgrade, 4 = tree state (node id/uid ignored)
+
+Responses come back in request order. Lock, unlock and upgrade answer with a
+single status byte:
+
+    0 = false, 1 = true, 2 = unknown node, 3 = bad op, 4 = rejected (overload), 5 = error
+
+Tree state answers with status 1, a u32 count and then one i64 per node id:
+the uid holding the lock, -1 if unlocked, -2 if the node no longer exists or
+is held by a non-integer uid.
+
+Clients may pipeline: write many frames without waiting, then read the
+responses. The server parses every complete frame it has received, runs them
+in order and answers the whole batch with one write.
+"""
+
+import socket
+import socketserver
+import struct
+import threading
+
+REQUEST = struct.Struct('!BIq')
+COUNT = struct.Struct('!I')
+
+OP_LOCK, OP_UNLOCK, OP_UPGRADE, OP_TREE = 1, 2, 3, 4
+
+FALSE, TRUE, NOT_FOUND, BAD_OP, REJECTED, ERROR = range(6)
+
+UNLOCKED = -1
+MISSING = -2
+
+
+def encode_tree(owners):
+    """Tree-state response body for a list of lock owners indexed by node id"""
+    return bytes([TRUE]) + COUNT.pack(len(owners)) + struct.pack('!%dq' % len(owners), *owners)
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    """One connection: read frames, dispatch them in order, write batched responses"""
+
+    def handle(self):
+        dispatch = self.server.dispatch
+        tree_state = self.server.tree_state
+        sock = self.request
+        size = REQUEST.size
+        pending = b''
+        while True:
+            data = sock.recv(65536)
+            if not data:
+                return
+            pending += data
+            usable = len(pending) - len(pending) % size
+            out = bytearray()
+            for op, node_id, uid in REQUEST.iter_unpack(pending[:usable]):
+                if op == OP_TREE:
+                    out += tree_state()
+                else:
+                    out.append(dispatch(op, node_id, uid))
+            pending = pending[usable:]
+            if out:
+                sock.sendall(out)
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def server_bind(self):
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        super().server_bind()
+
+
+class _UnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def serve(dispatch, tree_state, host=None, port=None, path=None):
+    """
+    Start serving in a background thread and return the server.
+
+    dispatch(op, node_id, uid) -> status byte for ops 1-3
+    tree_state() -> encoded tree-state response (see encode_tree)
+    Listens on TCP host:port, or on the Unix socket path if given.
+    """
+    if path is not None:
+        server = _UnixServer(path, _Handler)
+    else:
+        server = _TCPServer((host or '127.0.0.1', port), _Handler)
+    server.dispatch = dispatch
+    server.tree_state = tree_state
+    thread = threading.Thread(target=server.serve_forever, name='binary-protocol', daemon=True)
+    thread.start()
+    return server
+
+
+class Client:
+    """Minimal blocking client with pipelining support"""
+
+    def __init__(self, host=None, port=None, path=None):
+        if path is not None:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(path)
+        else:
+            self.sock = socket.create_connection((host or '127.0.0.1', port))
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._buffer = b''
+
+    def close(self):
+        self.sock.close()
+
+    def _read(self, n):
+        while len(self._buffer) < n:
+            data = self.sock.recv(65536)
+            if not data:
+                raise ConnectionError('server closed the connection')
+            self._buffer += data
+        data, self._buffer = self._buffer[:n], self._buffer[n:]
+        return data
+
+    def pipeline(self, requests):
+        """Send (op, node_id, uid) requests in one write; return their responses in order"""
+        self.sock.sendall(b''.join(REQUEST.pack(op, node_id, uid) for op, node_id, uid in requests))
+        return [self._read_response(op) for op, _, _ in requests]
+
+    def _read_response(self, op):
+        status = self._read(1)[0]
+        if op != OP_TREE or status != TRUE:
+            return status
+        (count,) = COUNT.unpack(self._read(COUNT.size))
+        return list(struct.unpack('!%dq' % count, self._read(8 * count)))
+
+    def lock(self, node_id, uid):
+        return self.pipeline([(OP_LOCK, node_id, uid)])[0]
+
+    def unlock(self, node_id, uid):
+        return self.pipeline([(OP_UNLOCK, node_id, uid)])[0]
+
+    def upgrade(self, node_id, uid):
+        return self.pipeline([(OP_UPGRADE, node_id, uid)])[0]
+
+    def tree(self):
+        return self.pipeline([(OP_TREE, 0, 0)])[0]
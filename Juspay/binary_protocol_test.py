@@ -0,0 +1,91 @@
+import os
+import struct
+import tempfile
+import time
+
+# app.py opens its named tree registry at import; keep it out of the repo
+os.environ.setdefault('TREELOCK_SNAPSHOT_DIR', tempfile.mkdtemp(prefix='treelock-binary-test-'))
+
+import app
+import binary_protocol
+from binary_protocol import (BAD_OP, FALSE, MISSING, NOT_FOUND, OP_LOCK, OP_TREE, OP_UNLOCK, OP_UPGRADE,
+                             REQUEST, TRUE, UNLOCKED, Client, encode_tree)
+
+server = None
+
+def connect():
+    global server
+    if server is None:
+        server = binary_protocol.serve(app.binary_dispatch, app.binary_tree_state, port=0)
+    return Client(port=server.server_address[1])
+
+def node_id(name):
+    return next(i for i, node in enumerate(app.node_ids) if node is not None and node.name == name)
+
+def test_pipelined_responses_in_order():
+    """Responses to one pipelined write come back in request order, tree state included"""
+    client = connect()
+    india, china = node_id('India'), node_id('China')
+    try:
+        assert client.pipeline([(OP_LOCK, india, 1), (OP_LOCK, india, 2), (OP_TREE, 0, 0),
+                                (OP_UNLOCK, india, 2), (OP_UNLOCK, india, 1), (OP_LOCK, china, 2),
+                                (OP_UPGRADE, node_id('Asia'), 2), (OP_UNLOCK, node_id('Asia'), 2)]) == \
+            [TRUE, FALSE, [UNLOCKED] * india + [1] + [UNLOCKED] * (len(app.node_ids) - india - 1),
+             FALSE, TRUE, TRUE, TRUE, TRUE]
+    finally:
+        client.close()
+
+def test_frame_split_across_reads():
+    """A frame arriving in pieces is answered once it is complete"""
+    client = connect()
+    frame = REQUEST.pack(OP_LOCK, node_id('Egypt'), 3) + REQUEST.pack(OP_UNLOCK, node_id('Egypt'), 3)
+    try:
+        for piece in (frame[:5], frame[5:13 + 2], frame[13 + 2:]):
+            client.sock.sendall(piece)
+            time.sleep(0.05)
+        assert client._read(2) == bytes([TRUE, TRUE])
+    finally:
+        client.close()
+
+def test_bad_op_and_unknown_node():
+    client = connect()
+    try:
+        assert client.pipeline([(9, 0, 1), (OP_LOCK, 10 ** 6, 1), (OP_LOCK, node_id('World'), 1),
+                                (OP_UNLOCK, node_id('World'), 1)]) == [BAD_OP, NOT_FOUND, TRUE, TRUE]
+    finally:
+        client.close()
+
+def test_tree_state_encoding():
+    """Status, u32 count and one big-endian i64 per node id"""
+    assert encode_tree([7, UNLOCKED, MISSING]) == \
+        bytes([TRUE]) + struct.pack('!I', 3) + struct.pack('!qqq', 7, -1, -2)
+    assert encode_tree([]) == bytes([TRUE, 0, 0, 0, 0])
+
+def test_readded_name_gets_new_id():
+    """Removing a subtree retires its ids; adding the name again allocates a new one"""
+    http = app.app.test_client()
+    assert http.post('/nodes', json={'name': 'Delhi', 'parent': 'India'}).get_json()['success']
+    old_india, old_delhi = node_id('India'), node_id('Delhi')
+    assert http.delete('/nodes/India').get_json()['success']
+    assert http.post('/nodes', json={'name': 'India', 'parent': 'Asia'}).get_json()['success']
+
+    client = connect()
+    try:
+        new_india = node_id('India')
+        assert new_india not in (old_india, old_delhi)
+        state = client.pipeline([(OP_LOCK, old_india, 1), (OP_LOCK, old_delhi, 1), (OP_LOCK, new_india, 1),
+                                 (OP_TREE, 0, 0), (OP_UNLOCK, new_india, 1)])
+        assert state[:3] == [NOT_FOUND, NOT_FOUND, TRUE]
+        assert state[3][old_india] == state[3][old_delhi] == MISSING
+        assert state[3][new_india] == 1
+        assert state[4] == TRUE
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    test_pipelined_responses_in_order()
+    test_frame_split_across_reads()
+    test_bad_op_and_unknown_node()
+    test_tree_state_encoding()
+    test_readded_name_gets_new_id()
+    print("Binary protocol tests passed!")
@@ -0,0 +1,275 @@
+"""
+Opt-in contention profiler for the thread-safe engine.
+
+enable() swaps every node's RLock for a ProfiledLock that counts
+acquisitions, contended acquisitions (the lock was not immediately free),
+total wait time and total hold time. Stats are only updated by the thread
+that holds the lock, so they need no extra synchronization. disable() puts
+the plain RLocks back, so the engine pays nothing when profiling is off.
+Several trees can be profiled at once, each under its own id ('' for the
+default tree). Installed as (part of) Thread_safe.change_observer, changed()
+gives leaves added later a ProfiledLock before anyone can take it and drops
+removed nodes, so a removed and re-added name reports the new node.
+
+wrap() additionally records, per operation, the ancestor-walk length (the
+node's depth) and the size of node.locked_descendants at call time.
+
+Reports:
+    report(top_k)  - dict with the top-K nodes by wait time plus op stats
+    folded(metric) - "World;Asia;India 1234" lines for flamegraph.pl / speedscope
+
+Run this file directly to profile a synthetic threaded workload:
+    python contention.py --n 1023 --m 2 --threads 8 --ops 20000
+"""
+
+import argparse
+import random
+import threading
+import time
+
+clock = time.perf_counter
+
+
+class ProfiledLock:
+    """Reentrant lock that records acquisition, contention, wait and hold time"""
+
+    def __init__(self, inner=None):
+        self._inner = inner if inner is not None else threading.RLock()
+        self._depth = 0
+        self._held_since = 0.0
+        self.acquisitions = 0
+        self.contended = 0
+        self.wait_time = 0.0
+        self.hold_time = 0.0
+
+    def acquire(self, blocking=True, timeout=-1):
+        if self._inner.acquire(False):
+            waited = None
+        elif not blocking:
+            return False
+        else:
+            start = clock()
+            if not self._inner.acquire(True, timeout):
+                return False
+            waited = clock() - start
+
+        # We own the lock from here, so the counters are ours to update
+        self._depth += 1
+        if self._depth == 1:
+            self.acquisitions += 1
+            if waited is not None:
+                self.contended += 1
+                self.wait_time += waited
+            self._held_since = clock()
+        return True
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            self.hold_time += clock() - self._held_since
+        self._inner.release()
+
+    __enter__ = acquire
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class ContentionProfiler:
+    """Collects per-node lock stats and per-operation walk/set-size stats"""
+
+    def __init__(self):
+        self._nodes = {}      # (tree_id, name) -> Node
+        self._originals = {}  # (tree_id, name) -> RLock replaced by enable()
+        self._tree_ids = {}   # StructureLock of each profiled tree -> tree_id
+        self._nodes_lock = threading.Lock()
+        self._op_stats = {}
+        self._op_lock = threading.Lock()
+
+    def enable(self, nodes, tree_id=''):
+        """Install ProfiledLocks on all nodes of one tree. Call while the tree is idle."""
+        with self._nodes_lock:
+            for name, node in nodes.items():
+                self._tree_ids[node._structure] = tree_id
+                self._install((tree_id, name), node)
+
+    def _install(self, key, node):
+        if not isinstance(node._lock, ProfiledLock):
+            self._originals[key] = node._lock
+            node._lock = ProfiledLock()
+        self._nodes[key] = node
+
+    def forget(self, tree_id):
+        """Stop reporting a tree that has been dropped from memory"""
+        with self._nodes_lock:
+            for key in [key for key in self._nodes if key[0] == tree_id]:
+                del self._nodes[key]
+                self._originals.pop(key, None)
+            for structure in [s for s, t in self._tree_ids.items() if t == tree_id]:
+                del self._tree_ids[structure]
+
+    def changed(self, kind, node, value):
+        """Thread_safe.change_observer: profile leaves added to a profiled tree, forget removed subtrees"""
+        if kind not in ('add', 'remove'):
+            return
+        with self._nodes_lock:
+            tree_id = self._tree_ids.get(node._structure)
+            if tree_id is None:
+                return
+            if kind == 'add':
+                self._install((tree_id, node.name), node)
+                return
+            stack = [node]
+            while stack:
+                curr = stack.pop()
+                key = (tree_id, curr.name)
+                if self._nodes.get(key) is curr:
+                    del self._nodes[key]
+                    self._originals.pop(key, None)
+                stack.extend(curr.children)
+
+    def disable(self):
+        """Restore the original RLocks. Call while the trees are idle."""
+        with self._nodes_lock:
+            for key, node in self._nodes.items():
+                if key in self._originals:
+                    node._lock = self._originals.pop(key)
+            self._nodes = {}
+            self._tree_ids = {}
+
+    def wrap(self, name, func):
+        """Wrap an engine function taking (node, uid) to record walk length and set size"""
+        def profiled(node, uid, *args, **kwargs):
+            depth = 0
+            curr = node.parent
+            while curr:
+                depth += 1
+                curr = curr.parent
+            self._record_op(name, depth, len(node.locked_descendants))
+            return func(node, uid, *args, **kwargs)
+        profiled.__name__ = getattr(func, '__name__', name)
+        profiled.__doc__ = func.__doc__
+        return profiled
+
+    def _record_op(self, name, depth, set_size):
+        with self._op_lock:
+            stats = self._op_stats.get(name)
+            if stats is None:
+                stats = self._op_stats[name] = {'count': 0, 'walk_total': 0, 'walk_max': 0,
+                                                'set_total': 0, 'set_max': 0}
+            stats['count'] += 1
+            stats['walk_total'] += depth
+            stats['walk_max'] = max(stats['walk_max'], depth)
+            stats['set_total'] += set_size
+            stats['set_max'] = max(stats['set_max'], set_size)
+
+    def node_stats(self):
+        """Per-node counters for every profiled node, keyed by (tree_id, name)"""
+        with self._nodes_lock:
+            profiled = list(self._nodes.items())
+        stats = {}
+        for key, node in profiled:
+            lock = node._lock
+            if isinstance(lock, ProfiledLock):
+                stats[key] = {
+                    'acquisitions': lock.acquisitions,
+                    'contended': lock.contended,
+                    'wait_seconds': lock.wait_time,
+                    'hold_seconds': lock.hold_time,
+                }
+        return stats
+
+    def report(self, top_k=10, key='wait_seconds'):
+        """Top-K hot nodes sorted by key, plus per-operation walk and set-size stats"""
+        stats = self.node_stats()
+        hot = sorted(stats.items(), key=lambda item: item[1][key], reverse=True)[:top_k]
+        with self._op_lock:
+            ops = {}
+            for name, s in self._op_stats.items():
+                ops[name] = {
+                    'count': s['count'],
+                    'walk_mean': s['walk_total'] / s['count'],
+                    'walk_max': s['walk_max'],
+                    'locked_descendants_mean': s['set_total'] / s['count'],
+                    'locked_descendants_max': s['set_max'],
+                }
+        return {
+            'hot_nodes': [dict(tree=tree_id, node=name, **s) for (tree_id, name), s in hot],
+            'operations': ops,
+        }
+
+    def folded(self, metric='wait_seconds'):
+        """Folded stacks (root;...;node value) with values in microseconds or counts"""
+        scale = 1e6 if metric.endswith('_seconds') else 1
+        lines = []
+        with self._nodes_lock:
+            profiled = dict(self._nodes)
+        for key, s in sorted(self.node_stats().items()):
+            value = int(s[metric] * scale)
+            if value <= 0 or key not in profiled:
+                continue
+            path = []
+            curr = profiled[key]
+            while curr:
+                path.append(curr.name)
+                curr = curr.parent
+            if key[0]:
+                # Named trees get their id as the outermost frame
+                path.append(key[0])
+            lines.append('%s %d' % (';'.join(reversed(path)), value))
+        return '\n'.join(lines) + '\n'
+
+
+def print_report(report):
+    print('%-20s %12s %10s %12s %12s' % ('node', 'acquisitions', 'contended', 'wait ms', 'hold ms'))
+    for row in report['hot_nodes']:
+        print('%-20s %12d %10d %12.2f %12.2f' % (
+            '%s/%s' % (row['tree'], row['node']) if row['tree'] else row['node'], row['acquisitions'], row['contended'],
+            row['wait_seconds'] * 1000, row['hold_seconds'] * 1000))
+    print()
+    print('%-14s %8s %10s %9s %14s %13s' % ('operation', 'count', 'walk mean', 'walk max', 'set size mean', 'set size max'))
+    for name, s in sorted(report['operations'].items()):
+        print('%-14s %8d %10.2f %9d %14.2f %13d' % (
+            name, s['count'], s['walk_mean'], s['walk_max'],
+            s['locked_descendants_mean'], s['locked_descendants_max']))
+
+
+def main():
+    from Thread_safe import build_tree, lock, unlock, upgrade_lock
+
+    parser = argparse.ArgumentParser(description='Profile node lock contention on a synthetic workload')
+    parser.add_argument('--n', type=int, default=1023)
+    parser.add_argument('--m', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--ops', type=int, default=20000, help='operations per thread')
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--folded', help='write folded wait-time stacks to this file')
+    args = parser.parse_args()
+
+    node_names = ['n%d' % i for i in range(args.n)]
+    nodes = build_tree(node_names, args.m)
+    profiler = ContentionProfiler()
+    profiler.enable(nodes)
+    handlers = [profiler.wrap('lock', lock), profiler.wrap('unlock', unlock),
+                profiler.wrap('upgrade_lock', upgrade_lock)]
+
+    def worker(seed):
+        rng = random.Random(seed)
+        for _ in range(args.ops):
+            handler = rng.choices(handlers, weights=(4, 4, 1))[0]
+            handler(nodes[rng.choice(node_names)], rng.randrange(4))
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    print_report(profiler.report(args.top))
+    if args.folded:
+        with open(args.folded, 'w') as f:
+            f.write(profiler.folded())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+import shutil
+import tempfile
+
+import Thread_safe
+from Thread_safe import add_leaf, build_tree, lock, remove_subtree, unlock
+from contention import ContentionProfiler, ProfiledLock
+from tenants import NODE_BYTES_ESTIMATE, TreeRegistry
+
+NAMES = ["World", "Asia", "Africa", "China", "India", "SouthAfrica", "Egypt"]
+
+def test_added_and_readded_nodes_are_profiled():
+    """Leaves added after enable() are profiled, and a removed then re-added name reports the new node"""
+    nodes = build_tree(NAMES, 2)
+    profiler = ContentionProfiler()
+    profiler.enable(nodes)
+    Thread_safe.change_observer = profiler.changed
+    try:
+        old_india = nodes['India']
+        assert remove_subtree(nodes, old_india)
+        assert add_leaf(nodes, nodes['Asia'], 'India')
+        assert add_leaf(nodes, nodes['India'], 'Delhi')
+        assert isinstance(nodes['Delhi']._lock, ProfiledLock)
+        for _ in range(50):
+            assert lock(nodes['Delhi'], 1)
+            assert unlock(nodes['Delhi'], 1)
+    finally:
+        Thread_safe.change_observer = None
+
+    stats = profiler.node_stats()
+    assert stats[('', 'India')]['acquisitions'] == 100
+    assert stats[('', 'Delhi')]['acquisitions'] > 0
+    assert 'World;Asia;India;Delhi' in profiler.folded('acquisitions')
+
+def test_named_trees_are_profiled_while_loaded():
+    """A TreeRegistry entry_observer profiles named trees on load and forgets them when dropped"""
+    directory = tempfile.mkdtemp(prefix='treelock-contention-test-')
+    profiler = ContentionProfiler()
+
+    def observe(event, entry):
+        if event == 'load':
+            profiler.enable(entry.nodes, entry.tree_id)
+        else:
+            profiler.forget(entry.tree_id)
+
+    try:
+        trees = TreeRegistry(directory, len(NAMES) * NODE_BYTES_ESTIMATE, entry_observer=observe)
+        trees.create('acme', NAMES, 2)
+        with trees.use('acme') as entry:
+            assert lock(entry.nodes['India'], 7)
+        rows = profiler.report(top_k=20, key='acquisitions')['hot_nodes']
+        assert {(row['tree'], row['node']) for row in rows if row['acquisitions']} == \
+            {('acme', 'India'), ('acme', 'Asia'), ('acme', 'World')}
+        assert 'acme;World;Asia;India' in profiler.folded('acquisitions')
+
+        # Loading a second tree over budget evicts the first
+        trees.create('beta', NAMES, 2)
+        assert {tree_id for tree_id, _ in profiler.node_stats()} == {'beta'}
+        with trees.use('acme') as entry:
+            assert isinstance(entry.nodes['India']._lock, ProfiledLock)
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    test_added_and_readded_nodes_are_profiled()
+    test_named_trees_are_profiled_while_loaded()
+    print("Contention profiler tests passed!")
@@ -0,0 +1,33 @@
+from metrics import Registry
+
+def test_histogram_buckets_and_counts():
+    """A value on a bucket bound lands in that bucket; _bucket and _count are cumulative"""
+    registry = Registry()
+    histogram = registry.histogram('latency_seconds', 'Test latency', buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 1.0, 2.0):
+        histogram.observe(value)
+
+    lines = registry.render().splitlines()
+    assert 'latency_seconds_bucket{le="0.1"} 2' in lines
+    assert 'latency_seconds_bucket{le="1.0"} 4' in lines
+    assert 'latency_seconds_bucket{le="+Inf"} 5' in lines
+    assert 'latency_seconds_count 5' in lines
+    assert 'latency_seconds_sum 3.65' in lines
+
+def test_counter_labels_and_escaping():
+    """Label values with quotes, backslashes and newlines are escaped"""
+    registry = Registry()
+    counter = registry.counter('requests_total', 'Test requests', ['endpoint'])
+    counter.labels('/lock').inc()
+    counter.labels('/lock').inc(2)
+    counter.labels('a"b\\c\nd').inc()
+
+    lines = registry.render().splitlines()
+    assert lines[:2] == ['# HELP requests_total Test requests', '# TYPE requests_total counter']
+    assert 'requests_total{endpoint="/lock"} 3' in lines
+    assert 'requests_total{endpoint="a\\"b\\\\c\\nd"} 1' in lines
+
+if __name__ == "__main__":
+    test_histogram_buckets_and_counts()
+    test_counter_labels_and_escaping()
+    print("Metrics tests passed!")
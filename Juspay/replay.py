@@ -0,0 +1,172 @@
+"""
+Replay a traffic recording (see traffic.py) against a running server.
+
+The load is open-loop: every request has an intended send time taken from the
+recording (scaled by --speedup) or from a fixed --rate, and it is sent at that
+time whether or not earlier requests have completed. Latency is measured from
+the intended send time, so queueing caused by a slow server is counted instead
+of being hidden (coordinated omission). Service time, measured from the moment
+a worker actually sent the request, is reported alongside it. Requests recorded
+on a named tree are sent to /trees/<id>/<op>, the rest to /<op>.
+
+Usage:
+    python replay.py traffic.log --url http://localhost:5000 --concurrency 32
+    python replay.py traffic.log --rate 2000 --limit 100000 --output run.json
+"""
+
+import argparse
+import http.client
+import json
+import queue
+import threading
+import time
+from urllib.parse import quote, urlsplit
+
+from traffic import read_recording
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0
+    rank = max(0, min(len(sorted_values) - 1,
+                      int(round(pct / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+
+def schedule(requests, rate=None, speedup=1.0):
+    """Return (intended_offset_seconds, op, tree_id, node, uid) with the chosen pacing"""
+    if rate:
+        return [(i / rate, op, tree_id, node, uid) for i, (_, op, tree_id, node, uid) in enumerate(requests)]
+    return [(offset / speedup, op, tree_id, node, uid) for offset, op, tree_id, node, uid in requests]
+
+
+class Worker(threading.Thread):
+    """Sends requests from the shared queue over one keep-alive connection"""
+
+    def __init__(self, url, work, results):
+        super().__init__(daemon=True)
+        parts = urlsplit(url)
+        conn_cls = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.conn = conn_cls(parts.hostname, parts.port, timeout=30)
+        self.prefix = parts.path.rstrip('/')
+        self.work = work
+        self.results = results
+
+    def run(self):
+        while True:
+            item = self.work.get()
+            if item is None:
+                return
+            intended, op, tree_id, node, uid = item
+            sent = time.perf_counter()
+            outcome = self.send(op, tree_id, node, uid)
+            done = time.perf_counter()
+            self.results.append((op, outcome, done - intended, done - sent))
+
+    def send(self, op, tree_id, node, uid):
+        body = json.dumps({'node': node, 'uid': uid})
+        path = '/trees/%s/%s' % (quote(tree_id, safe=''), op) if tree_id else '/' + op
+        try:
+            self.conn.request('POST', self.prefix + path, body,
+                              {'Content-Type': 'application/json'})
+            response = self.conn.getresponse()
+            payload = response.read()
+            if response.status != 200:
+                return 'http_%d' % response.status
+            return 'success' if json.loads(payload).get('success') else 'rejected'
+        except (OSError, http.client.HTTPException, ValueError):
+            self.conn.close()
+            return 'error'
+
+
+def replay(plan, url, concurrency):
+    """Send the planned requests open-loop and return (results, wall seconds)"""
+    work = queue.Queue()
+    results = []
+    workers = [Worker(url, work, results) for _ in range(concurrency)]
+    for worker in workers:
+        worker.start()
+
+    start = time.perf_counter()
+    for offset, op, tree_id, node, uid in plan:
+        intended = start + offset
+        delay = intended - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        work.put((intended, op, tree_id, node, uid))
+
+    for _ in workers:
+        work.put(None)
+    for worker in workers:
+        worker.join()
+    return results, time.perf_counter() - start
+
+
+def summarize(results, wall):
+    """Aggregate outcomes and latency percentiles per operation and overall"""
+    def stats(rows):
+        latency = sorted(r[2] for r in rows)
+        service = sorted(r[3] for r in rows)
+        outcomes = {}
+        for r in rows:
+            outcomes[r[1]] = outcomes.get(r[1], 0) + 1
+        return {
+            'count': len(rows),
+            'outcomes': outcomes,
+            'latency_ms': {('p%g' % p): percentile(latency, p) * 1000 for p in PERCENTILES},
+            'service_ms': {('p%g' % p): percentile(service, p) * 1000 for p in PERCENTILES},
+            'max_latency_ms': latency[-1] * 1000 if latency else 0,
+        }
+
+    summary = {'wall_seconds': wall,
+               'throughput': len(results) / wall if wall else 0.0,
+               'all': stats(results),
+               'by_op': {}}
+    for op in sorted({r[0] for r in results}):
+        summary['by_op'][op] = stats([r for r in results if r[0] == op])
+    return summary
+
+
+def print_summary(summary):
+    print('Sent %d requests in %.2fs (%.0f req/s)' % (
+        summary['all']['count'], summary['wall_seconds'], summary['throughput']))
+    print('%-8s %8s %10s %10s %10s %10s  %s' % ('op', 'count', 'p50 ms', 'p99 ms', 'p99.9 ms', 'max ms', 'outcomes'))
+    rows = [('all', summary['all'])] + sorted(summary['by_op'].items())
+    for op, s in rows:
+        lat = s['latency_ms']
+        print('%-8s %8d %10.2f %10.2f %10.2f %10.2f  %s' % (
+            op, s['count'], lat['p50'], lat['p99'], lat['p99.9'], s['max_latency_ms'], s['outcomes']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay recorded lock traffic against a server')
+    parser.add_argument('recording')
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--rate', type=float, help='fixed requests/sec instead of recorded pacing')
+    parser.add_argument('--speedup', type=float, default=1.0, help='compress recorded pacing by this factor')
+    parser.add_argument('--limit', type=int, help='replay at most this many requests')
+    parser.add_argument('--output', help='write the summary to this JSON file')
+    args = parser.parse_args()
+
+    requests = []
+    for item in read_recording(args.recording):
+        if args.limit is not None and len(requests) >= args.limit:
+            break
+        requests.append(item)
+
+    plan = schedule(requests, args.rate, args.speedup)
+    results, wall = replay(plan, args.url, args.concurrency)
+    summary = summarize(results, wall)
+    print_summary(summary)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
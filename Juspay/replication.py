@@ -0,0 +1,231 @@
+"""
+Read replicas of the default tree, fed by the primary's change stream.
+
+The primary runs a ChangeFeed installed as Thread_safe.change_observer. Every
+lock-owner or shape change is queued with a sequence number from inside the
+critical section that makes it, so changes to one node are queued in the
+order they happened. A sender thread ships the queue to every subscriber
+every `interval` seconds, followed by a heartbeat carrying the primary's
+current sequence number and clock.
+
+Replicas connect over a local socket (Unix or loopback TCP) and get one JSON
+message per line:
+
+    {"type": "snapshot", "seq": 41, "time": ..., "m": 2, "nodes": [["World", null], ...], "locks": {...}}
+    {"type": "owner", "seq": 42, "time": ..., "node": "India", "uid": 7}     (uid null = unlocked)
+    {"type": "add", "seq": 43, "time": ..., "node": "Delhi", "parent": "India"}
+    {"type": "remove", "seq": 44, "time": ..., "node": "Delhi"}
+    {"type": "move", "seq": 45, "time": ..., "node": "India", "parent": "Africa"}
+    {"type": "heartbeat", "seq": 45, "time": ...}
+
+The snapshot is taken under the tree's exclusive structure lock, so it
+matches its sequence number exactly; only later changes follow it. A replica
+applies the stream to its own Thread_safe tree. After a heartbeat it holds
+every change the primary made up to the heartbeat's time, so
+`now - time of the last heartbeat` bounds how stale its reads are (both ends
+share the machine's clock). A replica that loses the primary keeps its last
+state, its staleness keeps growing, and it reconnects for a fresh snapshot.
+"""
+
+import json
+import os
+import socket
+import threading
+import time
+
+from Thread_safe import add_leaf, move_subtree, remove_subtree, set_owner
+from tenants import TreeEntry
+
+SEND_TIMEOUT = 1.0
+
+
+def _line(message):
+    return json.dumps(message).encode() + b'\n'
+
+
+def _listen(path=None, host=None, port=None):
+    if path is not None:
+        if os.path.exists(path):
+            os.remove(path)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(path)
+    else:
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((host or '127.0.0.1', port))
+    listener.listen(16)
+    return listener
+
+
+def _connect(path=None, host=None, port=None):
+    if path is not None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(path)
+        return sock
+    return socket.create_connection((host or '127.0.0.1', port))
+
+
+def parse_address(address):
+    """'/path/to.sock' -> (path, None, None); 'host:port' or 'port' -> (None, host, port)"""
+    if '/' in address:
+        return address, None, None
+    host, _, port = address.rpartition(':')
+    return None, host or None, int(port)
+
+
+class ChangeFeed:
+    """Primary side: queue tree changes and stream them to subscribed replicas"""
+
+    def __init__(self, nodes, m, interval=0.01):
+        self.nodes = nodes
+        self.m = m
+        self.interval = interval
+        self._structure = next(iter(nodes.values()))._structure
+        self._lock = threading.Lock()       # sequence numbers and the pending queue
+        self._pending = []
+        self._seq = 0
+        self._send_lock = threading.Lock()  # subscriber list and socket writes
+        self._subscribers = []              # [socket, sequence number of its snapshot]
+
+    def publish(self, kind, node, value):
+        """Thread_safe.change_observer: queue one change if it belongs to this tree"""
+        if node._structure is not self._structure:
+            return
+        if kind != 'owner' and value is not None:
+            value = value.name
+        with self._lock:
+            self._seq += 1
+            self._pending.append((self._seq, time.time(), kind, node.name, value))
+
+    def serve(self, path=None, host=None, port=None):
+        """Accept replicas on a Unix socket path or a TCP host:port, in background threads"""
+        listener = _listen(path, host, port)
+        threading.Thread(target=self._accept_loop, args=(listener,), name='replication-accept', daemon=True).start()
+        threading.Thread(target=self._send_loop, name='replication-send', daemon=True).start()
+        return listener
+
+    def _accept_loop(self, listener):
+        while True:
+            sock, _ = listener.accept()
+            try:
+                self._subscribe(sock)
+            except OSError:
+                sock.close()
+
+    def _snapshot(self):
+        """BFS [name, parent] pairs and lock owners; caller holds the structure lock"""
+        root = next(iter(self.nodes.values()))
+        while root.parent is not None:
+            root = root.parent
+        pairs = []
+        queue = [root]
+        for node in queue:
+            pairs.append([node.name, node.parent.name if node.parent else None])
+            queue.extend(node.children)
+        locks = {name: node.locked_by for name, node in self.nodes.items() if node.locked_by is not None}
+        return pairs, locks
+
+    def _subscribe(self, sock):
+        sock.settimeout(SEND_TIMEOUT)
+        with self._send_lock:
+            # No change can be made while we hold the exclusive side, so the
+            # snapshot is exactly the state after change number seq
+            with self._structure.exclusive:
+                with self._lock:
+                    seq, now = self._seq, time.time()
+                pairs, locks = self._snapshot()
+            sock.sendall(_line({'type': 'snapshot', 'seq': seq, 'time': now, 'm': self.m,
+                                'nodes': pairs, 'locks': locks}))
+            self._subscribers.append([sock, seq])
+
+    def _send_loop(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                batch, self._pending = self._pending, []
+                seq, now = self._seq, time.time()
+            lines = []
+            for event_seq, event_time, kind, name, value in batch:
+                message = {'type': kind, 'seq': event_seq, 'time': event_time, 'node': name}
+                if kind == 'owner':
+                    message['uid'] = value
+                elif value is not None:
+                    message['parent'] = value
+                lines.append((event_seq, _line(message)))
+            heartbeat = _line({'type': 'heartbeat', 'seq': seq, 'time': now})
+
+            with self._send_lock:
+                for subscriber in list(self._subscribers):
+                    sock, since = subscriber
+                    data = b''.join(line for event_seq, line in lines if event_seq > since)
+                    try:
+                        sock.sendall(data + heartbeat)
+                    except OSError:
+                        # Gone or too slow; it will reconnect for a fresh snapshot
+                        self._subscribers.remove(subscriber)
+                        sock.close()
+
+
+class Replica:
+    """Replica side: keep a local copy of the primary's default tree"""
+
+    def __init__(self, path=None, host=None, port=None, retry_interval=0.5):
+        self.address = (path, host, port)
+        self.retry_interval = retry_interval
+        self.nodes = None         # replaced on every snapshot
+        self.m = None
+        self.seq = 0
+        self.caught_up_at = None  # primary time up to which every change is applied
+        self.connected = False
+        self._ready = threading.Event()
+        threading.Thread(target=self._run, name='replica', daemon=True).start()
+
+    def staleness(self):
+        """Seconds of primary history this replica may be missing (None before the first snapshot)"""
+        if self.caught_up_at is None:
+            return None
+        return max(0.0, time.time() - self.caught_up_at)
+
+    def wait_ready(self, timeout=None):
+        """Block until the first snapshot is applied"""
+        return self._ready.wait(timeout)
+
+    def _run(self):
+        while True:
+            try:
+                sock = _connect(*self.address)
+            except OSError:
+                time.sleep(self.retry_interval)
+                continue
+            self.connected = True
+            try:
+                with sock, sock.makefile('rb') as stream:
+                    for line in stream:
+                        self._apply(json.loads(line))
+            except (OSError, ValueError, KeyError):
+                # Lost the primary or fell out of step; resync from a new snapshot
+                pass
+            self.connected = False
+            time.sleep(self.retry_interval)
+
+    def _apply(self, message):
+        kind = message['type']
+        if kind == 'snapshot':
+            entry = TreeEntry.from_snapshot({'id': 'replica', 'm': message['m'],
+                                             'nodes': message['nodes'], 'locks': message['locks']})
+            self.nodes = entry.nodes
+            self.m = message['m']
+            self.seq = message['seq']
+            self.caught_up_at = message['time']
+            self._ready.set()
+        elif kind == 'owner':
+            set_owner(self.nodes[message['node']], message['uid'])
+        elif kind == 'add':
+            add_leaf(self.nodes, self.nodes[message['parent']], message['node'])
+        elif kind == 'remove':
+            remove_subtree(self.nodes, self.nodes[message['node']])
+        elif kind == 'move':
+            move_subtree(self.nodes, self.nodes[message['node']], self.nodes[message['parent']])
+        elif kind == 'heartbeat':
+            self.caught_up_at = max(self.caught_up_at, message['time'])
+        self.seq = max(self.seq, message['seq'])
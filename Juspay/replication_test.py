@@ -0,0 +1,75 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import Thread_safe
+from Thread_safe import build_tree, lock, unlock, upgrade_lock, add_leaf, move_subtree, remove_subtree
+from replication import ChangeFeed, Replica
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "replica did not catch up"
+        time.sleep(0.01)
+
+def tree_shape(nodes):
+    return {name: (node.parent.name if node.parent else None, node.locked_by,
+                   sorted(d.name for d in node.locked_descendants))
+            for name, node in nodes.items()}
+
+def test_replica_follows_primary():
+    """A replica started mid-stream converges to the primary's shape and locks"""
+    nodes = build_tree(["World", "Asia", "Africa", "China", "India", "SouthAfrica", "Egypt"], 2)
+    other = build_tree(["Other", "Leaf"], 2)  # changes to other trees are not streamed
+    feed = ChangeFeed(nodes, 2, interval=0.005)
+    path = os.path.join(tempfile.mkdtemp(), 'feed.sock')
+    Thread_safe.change_observer = feed.publish
+    try:
+        assert lock(nodes["India"], 1)
+        feed.serve(path=path)
+        replica = Replica(path=path, retry_interval=0.01)
+        assert replica.wait_ready(5)
+
+        assert lock(other["Leaf"], 5)
+        assert add_leaf(nodes, nodes["China"], "Beijing")
+        assert lock(nodes["Beijing"], 1)
+        assert upgrade_lock(nodes["Asia"], 1)
+        assert unlock(nodes["Asia"], 1)
+        assert lock(nodes["Egypt"], 2)
+        assert move_subtree(nodes, nodes["India"], nodes["Africa"])
+        assert remove_subtree(nodes, nodes["China"])
+
+        wait_for(lambda: replica.seq == feed._seq and replica.staleness() < 1)
+        assert tree_shape(replica.nodes) == tree_shape(nodes)
+    finally:
+        Thread_safe.change_observer = None
+
+REPLICA_APP_CHECK = '''
+import app
+client = app.app.test_client()
+assert app.trees is None
+for path in ('/trees', '/trees/acme/tree'):
+    assert client.get(path).status_code == 404, path
+assert client.post('/trees/acme/lock', json={'node': 'India', 'uid': 1}).status_code == 404
+'''
+
+def test_replica_app_leaves_named_trees_alone():
+    """A replica process neither serves nor snapshots named trees, even at exit"""
+    directory = tempfile.mkdtemp(prefix='treelock-replica-test-')
+    try:
+        snapshots = os.path.join(directory, 'snapshots')
+        env = dict(os.environ, TREELOCK_REPLICA_OF=os.path.join(directory, 'feed.sock'),
+                   TREELOCK_SNAPSHOT_DIR=snapshots)
+        subprocess.run([sys.executable, '-c', REPLICA_APP_CHECK], env=env, check=True,
+                       cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True)
+        assert not os.path.exists(snapshots)
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    test_replica_follows_primary()
+    test_replica_app_leaves_named_trees_alone()
+    print("Replication tests passed!")
@@ -0,0 +1,140 @@
+"""
+Throughput of the thread-safe engine against thread count.
+
+Every thread loops over a random mix on one shared tree: lock a random node
+(45%), unlock one of its own locks (45%) or probe can_lock (10%), for a fixed
+time. Run it on a regular and on a free-threaded CPython to see what the GIL
+costs:
+
+    python scaling_benchmark.py
+    python3.13t scaling_benchmark.py                  # also reruns itself with -X gil=1
+    python scaling_benchmark.py --python python3.13t  # one table for both builds
+
+Every build runs in its own process and the results are printed side by side,
+with the speedup over one thread in brackets.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shlex
+import subprocess
+import sys
+import sysconfig
+import threading
+import time
+
+from Thread_safe import build_tree, can_lock, lock, unlock
+
+
+def describe_build():
+    free_threaded = bool(sysconfig.get_config_var('Py_GIL_DISABLED'))
+    gil = getattr(sys, '_is_gil_enabled', lambda: True)()
+    return '%s %s%s, GIL %s' % (platform.python_implementation(), platform.python_version(),
+                                ' free-threaded' if free_threaded else '', 'on' if gil else 'off')
+
+
+def measure(threads, seconds, n, m, seed=0):
+    """Operations per second with the given number of threads"""
+    names = ['n%d' % i for i in range(n)]
+    nodes = build_tree(names, m)
+    stop = threading.Event()
+    barrier = threading.Barrier(threads + 1)
+    counts = [0] * threads
+
+    def worker(uid):
+        rng = random.Random(seed * 1000 + uid)
+        held = []
+        count = 0
+        barrier.wait()
+        while not stop.is_set():
+            for _ in range(100):
+                r = rng.random()
+                if r < 0.45 or (r < 0.9 and not held):
+                    node = nodes[names[rng.randrange(n)]]
+                    if lock(node, uid):
+                        held.append(node)
+                elif r < 0.9:
+                    unlock(held.pop(rng.randrange(len(held))), uid)
+                else:
+                    can_lock(nodes[names[rng.randrange(n)]])
+            count += 100
+        counts[uid] = count
+
+    workers = [threading.Thread(target=worker, args=(uid,)) for uid in range(threads)]
+    for thread in workers:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    time.sleep(seconds)
+    stop.set()
+    for thread in workers:
+        thread.join()
+    return sum(counts) / (time.perf_counter() - start)
+
+
+def run_build(args):
+    return {
+        'build': describe_build(),
+        'results': [{'threads': threads, 'ops_per_sec': measure(threads, args.seconds, args.nodes, args.m)}
+                    for threads in args.threads],
+    }
+
+
+def run_elsewhere(command, args):
+    """Run this benchmark under another interpreter command and return its result"""
+    argv = shlex.split(command) + [os.path.abspath(__file__), '--worker',
+                                   '--threads', ','.join(map(str, args.threads)),
+                                   '--seconds', str(args.seconds), '--nodes', str(args.nodes), '--m', str(args.m)]
+    output = subprocess.run(argv, check=True, capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+    return json.loads(output)
+
+
+def print_table(builds):
+    print('%d CPUs available' % os.cpu_count())
+    width = max(28, max(len(build['build']) for build in builds) + 2)
+    print('threads' + ''.join(build['build'].rjust(width) for build in builds))
+    for row, threads in enumerate(result['threads'] for result in builds[0]['results']):
+        cells = []
+        for build in builds:
+            ops = build['results'][row]['ops_per_sec']
+            base = build['results'][0]['ops_per_sec']
+            cells.append(('%.0f ops/s [%.2fx]' % (ops, ops / base)).rjust(width))
+        print('%7d' % threads + ''.join(cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', default='1,2,4,8,16', type=lambda s: [int(t) for t in s.split(',')],
+                        help='comma-separated thread counts (default 1,2,4,8,16)')
+    parser.add_argument('--seconds', type=float, default=2.0, help='duration of each measurement')
+    parser.add_argument('--nodes', type=int, default=4095)
+    parser.add_argument('--m', type=int, default=2)
+    parser.add_argument('--python', action='append', default=[],
+                        help='also run under this interpreter command, e.g. python3.13t (repeatable)')
+    parser.add_argument('--output', help='write the results as JSON')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_build(args)))
+        return
+
+    builds = [run_build(args)]
+    if not getattr(sys, '_is_gil_enabled', lambda: True)():
+        # Same free-threaded interpreter with the GIL switched back on
+        builds.append(run_elsewhere('%s -X gil=1' % shlex.quote(sys.executable), args))
+    for command in args.python:
+        builds.append(run_elsewhere(command, args))
+
+    print_table(builds)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'cpus': os.cpu_count(), 'builds': builds}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
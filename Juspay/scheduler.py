@@ -0,0 +1,165 @@
+"""
+Optional fairness layer so upgrades are not starved by lock/unlock churn.
+
+upgrade_lock only succeeds at a quiet moment: the node and its ancestors are
+free and every locked descendant belongs to the caller. With other users
+constantly locking leaves under the node, that moment rarely comes.
+
+UpgradeScheduler wraps the engine's lock/unlock/upgrade_lock:
+
+  * A pending upgrade places a reservation on its node. New locks by other
+    users on the node or anywhere below it are deferred while the
+    reservation exists (for at most max_defer seconds), so the subtree can
+    only drain. A deferred lock still occupies its caller (an HTTP request
+    holds its admission slot meanwhile), so keep max_defer short compared
+    with how long callers may queue for that slot.
+  * Overlapping reservations (one node is an ancestor of the other) take
+    turns by priority, then age. Only the reservation at the head retries.
+  * A reservation retries whenever something is unlocked and gives up after
+    max_wait seconds, which bounds the upgrade's wait.
+
+Reservations are kept per tree (keyed by the tree's StructureLock), each
+tree with its own condition variable, so a pending upgrade in one tree never
+defers, wakes or scans anything in another. They cost nothing when a tree
+has none: lock and unlock find no entry and go straight to the engine.
+"""
+
+import itertools
+import threading
+import time
+
+import Thread_safe
+
+
+class Reservation:
+    """A pending upgrade of node by uid"""
+
+    def __init__(self, node, uid, priority, seq):
+        self.node = node
+        self.uid = uid
+        self.key = (-priority, seq)  # lower sorts first: higher priority, then older
+
+    def overlaps(self, other):
+        return _is_ancestor_or_self(self.node, other.node) or _is_ancestor_or_self(other.node, self.node)
+
+
+def _is_ancestor_or_self(ancestor, node):
+    curr = node
+    while curr:
+        if curr is ancestor:
+            return True
+        curr = curr.parent
+    return False
+
+
+class _TreeReservations:
+    """Pending upgrades in one tree"""
+
+    def __init__(self):
+        self.cond = threading.Condition(threading.Lock())
+        self.reservations = []
+
+
+class UpgradeScheduler:
+    """Fair upgrade scheduling over the thread-safe engine"""
+
+    def __init__(self, max_wait=1.0, max_defer=None, wait_observer=None,
+                 lock=Thread_safe.lock, unlock=Thread_safe.unlock, upgrade_lock=Thread_safe.upgrade_lock):
+        self.max_wait = max_wait
+        self.max_defer = max_wait if max_defer is None else max_defer
+        # Called with (seconds waited, succeeded) after every upgrade
+        self.wait_observer = wait_observer
+        self._lock = lock
+        self._unlock = unlock
+        self._upgrade_lock = upgrade_lock
+        # StructureLock -> _TreeReservations, present only while the tree has any.
+        # Lock order: _mutex, then a tree's cond.
+        self._trees = {}
+        self._mutex = threading.Lock()
+        self._seq = itertools.count()
+
+    def _blocking_reservation(self, tree, node, uid):
+        """A reservation by another user covering node, if any; caller holds tree.cond"""
+        for reservation in tree.reservations:
+            if reservation.uid != uid and _is_ancestor_or_self(reservation.node, node):
+                return reservation
+        return None
+
+    def _is_head(self, tree, reservation):
+        """True if no overlapping reservation is ahead of this one; caller holds tree.cond"""
+        for other in tree.reservations:
+            if other is not reservation and other.key < reservation.key and other.overlaps(reservation):
+                return False
+        return True
+
+    def lock(self, node, uid):
+        """Lock node, deferring while another user's pending upgrade covers it"""
+        tree = self._trees.get(node._structure)
+        if tree is not None:
+            deadline = time.monotonic() + self.max_defer
+            with tree.cond:
+                while self._blocking_reservation(tree, node, uid) is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    tree.cond.wait(remaining)
+        return self._lock(node, uid)
+
+    def unlock(self, node, uid):
+        """Unlock node and wake pending upgrades that may now succeed"""
+        result = self._unlock(node, uid)
+        tree = self._trees.get(node._structure) if result else None
+        if tree is not None:
+            with tree.cond:
+                tree.cond.notify_all()
+        return result
+
+    def upgrade_lock(self, node, uid, released=None, priority=0):
+        """Upgrade, reserving the subtree and retrying until it succeeds or max_wait passes"""
+        start = time.monotonic()
+        result = self._upgrade_lock(node, uid, released)
+        # Nothing locked below means there is nothing to wait for
+        if result or not node.locked_descendants:
+            if self.wait_observer is not None:
+                self.wait_observer(time.monotonic() - start, result)
+            return result
+
+        deadline = start + self.max_wait
+        structure = node._structure
+        with self._mutex:
+            tree = self._trees.get(structure)
+            if tree is None:
+                tree = self._trees[structure] = _TreeReservations()
+            with tree.cond:
+                reservation = Reservation(node, uid, priority, next(self._seq))
+                tree.reservations.append(reservation)
+        try:
+            while True:
+                with tree.cond:
+                    # Wait for our turn among overlapping reservations
+                    while not self._is_head(tree, reservation):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            return False
+                        tree.cond.wait(remaining)
+                result = self._upgrade_lock(node, uid, released)
+                if result:
+                    return True
+                with tree.cond:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    # Woken by unlocks; the timeout also covers a wakeup that
+                    # raced with our attempt
+                    tree.cond.wait(min(remaining, 0.05))
+        finally:
+            with self._mutex:
+                with tree.cond:
+                    tree.reservations.remove(reservation)
+                    tree.cond.notify_all()
+                    if not tree.reservations:
+                        # Deferred locks still waiting on this tree's cond
+                        # re-check an empty list and go ahead
+                        del self._trees[structure]
+            if self.wait_observer is not None:
+                self.wait_observer(time.monotonic() - start, result)
@@ -0,0 +1,75 @@
+import threading
+import time
+
+from Thread_safe import build_tree
+from scheduler import UpgradeScheduler
+
+NAMES = ["World", "Asia", "Africa", "China", "India", "SouthAfrica", "Egypt"]
+
+def pending_upgrade(scheduler, node, uid, results):
+    """Start an upgrade in a thread and wait until it has reserved its subtree"""
+    thread = threading.Thread(target=lambda: results.append(scheduler.upgrade_lock(node, uid)))
+    thread.start()
+    while node._structure not in scheduler._trees:
+        time.sleep(0.001)
+    return thread
+
+def test_waits_are_bounded_and_per_tree():
+    """A blocked upgrade gives up after max_wait, deferred locks after max_defer, other trees are not delayed"""
+    scheduler = UpgradeScheduler(max_wait=0.3, max_defer=0.05)
+    nodes = build_tree(NAMES, 2)
+    other = build_tree(NAMES, 2)
+    assert scheduler.lock(nodes["India"], 1)
+    assert scheduler.lock(nodes["China"], 2)  # never released: the upgrade cannot succeed
+
+    results = []
+    start = time.monotonic()
+    upgrade = pending_upgrade(scheduler, nodes["Asia"], 1, results)
+
+    # Deferred inside the reserved subtree, but only for max_defer
+    assert not scheduler.lock(nodes["Asia"], 3)
+    deferred = time.monotonic() - start
+    assert 0.04 <= deferred < 0.25, deferred
+    # Not deferred outside it, nor in another tree
+    t0 = time.monotonic()
+    assert scheduler.lock(nodes["Egypt"], 3)
+    assert scheduler.lock(other["China"], 3)
+    assert time.monotonic() - t0 < 0.03
+    assert list(scheduler._trees) == [nodes["Asia"]._structure]
+
+    upgrade.join()
+    assert results == [False]
+    assert 0.3 <= time.monotonic() - start < 0.6
+    assert scheduler._trees == {}
+
+def test_upgrade_succeeds_under_sibling_churn():
+    """Other users relocking a sibling leaf cannot starve a pending upgrade"""
+    scheduler = UpgradeScheduler(max_wait=2.0, max_defer=0.05)
+    nodes = build_tree(NAMES, 2)
+    assert scheduler.lock(nodes["India"], 1)
+    stop = threading.Event()
+
+    def churn(uid):
+        while not stop.is_set():
+            if scheduler.lock(nodes["China"], uid):
+                time.sleep(0.005)
+                scheduler.unlock(nodes["China"], uid)
+
+    churners = [threading.Thread(target=churn, args=(uid,)) for uid in (2, 3)]
+    for thread in churners:
+        thread.start()
+    time.sleep(0.02)
+    try:
+        start = time.monotonic()
+        assert scheduler.upgrade_lock(nodes["Asia"], 1)
+        assert time.monotonic() - start < 1.0
+        assert nodes["Asia"].locked_by == 1 and nodes["India"].locked_by is None
+    finally:
+        stop.set()
+        for thread in churners:
+            thread.join()
+
+if __name__ == "__main__":
+    test_waits_are_bounded_and_per_tree()
+    test_upgrade_succeeds_under_sibling_churn()
+    print("Upgrade scheduler tests passed!")
@@ -0,0 +1,234 @@
+"""
+Stress and linearizability checker for the thread-safe engine.
+
+Each round builds a fresh tree, starts many threads together and has each run
+a random mix of lock, unlock, upgrade_lock and can_lock calls, recording when
+every call started and returned and what it answered. Meanwhile a checker
+thread repeatedly takes the tree's exclusive structure lock (which waits for
+in-flight operations to finish) and verifies the invariants on the quiescent
+tree. After the round the invariants are checked again and the history is
+checked for linearizability against a sequential model of the rules: some
+order of the calls, consistent with real time (a call that returned before
+another started comes first), must give exactly the recorded answers.
+
+The search is Wing & Gong's with Lowe's memoization of (linearized calls,
+state) pairs, so keep rounds short; many short rounds find more than a few
+long ones.
+
+    python stress_test.py --threads 16 --rounds 200 --ops 200
+"""
+
+import argparse
+import faulthandler
+import random
+import sys
+import threading
+import time
+
+from Thread_safe import build_tree, can_lock, lock, unlock, upgrade_lock
+from tree_mutation_test import check_invariants
+
+OPERATIONS = ('lock', 'unlock', 'upgrade', 'can_lock')
+WEIGHTS = (4, 3, 2, 1)
+
+
+class Model:
+    """Sequential semantics of the locking rules over a tuple of owners (None = unlocked)"""
+
+    def __init__(self, n, m):
+        self.ancestors = [[] for _ in range(n)]
+        self.descendants = [[] for _ in range(n)]
+        for i in range(1, n):
+            parent = (i - 1) // m
+            self.ancestors[i] = [parent] + self.ancestors[parent]
+            for ancestor in self.ancestors[i]:
+                self.descendants[ancestor].append(i)
+
+    def step(self, state, op, i, uid):
+        """(answer, next state) of one call"""
+        free = (all(state[a] is None for a in self.ancestors[i])
+                and all(state[d] is None for d in self.descendants[i]))
+        if op == 'can_lock':
+            return free, state
+        if op == 'lock':
+            if state[i] is not None or not free:
+                return False, state
+            return True, state[:i] + (uid,) + state[i + 1:]
+        if op == 'unlock':
+            if state[i] != uid:
+                return False, state
+            return True, state[:i] + (None,) + state[i + 1:]
+        # upgrade
+        locked = [d for d in self.descendants[i] if state[d] is not None]
+        if (state[i] is not None or not locked or any(state[a] is not None for a in self.ancestors[i])
+                or any(state[d] != uid for d in locked)):
+            return False, state
+        owners = list(state)
+        for d in locked:
+            owners[d] = None
+        owners[i] = uid
+        return True, tuple(owners)
+
+
+def is_linearizable(history, model, initial):
+    """history: (start, end, op, node index, uid, answer) tuples"""
+    n = len(history)
+    events = sorted([(start, 0, i) for i, (start, _, _, _, _, _) in enumerate(history)]
+                    + [(end, 1, i) for i, (_, end, _, _, _, _) in enumerate(history)])
+    # Doubly linked list of call/return entries; entry 0 is the head sentinel
+    size = len(events) + 1
+    nxt = list(range(1, size)) + [None]
+    prv = [None] + list(range(size - 1))
+    kind = [None] + [event[1] for event in events]
+    call = [None] + [event[2] for event in events]
+    return_entry = [None] * n
+    for entry in range(1, size):
+        if kind[entry] == 1:
+            return_entry[call[entry]] = entry
+
+    def lift(entry):
+        for e in (entry, return_entry[call[entry]]):
+            nxt[prv[e]] = nxt[e]
+            if nxt[e] is not None:
+                prv[nxt[e]] = prv[e]
+
+    def unlift(entry):
+        for e in (return_entry[call[entry]], entry):
+            nxt[prv[e]] = e
+            if nxt[e] is not None:
+                prv[nxt[e]] = e
+
+    state = initial
+    linearized = 0
+    stack = []
+    seen = set()
+    entry = nxt[0]
+    while nxt[0] is not None:
+        if kind[entry] == 0:
+            i = call[entry]
+            _, _, op, node, uid, answer = history[i]
+            result, new_state = model.step(state, op, node, uid)
+            if result == answer:
+                key = (linearized | (1 << i), new_state)
+                if key not in seen:
+                    seen.add(key)
+                    stack.append((entry, state))
+                    state = new_state
+                    linearized |= 1 << i
+                    lift(entry)
+                    entry = nxt[0]
+                    continue
+            entry = nxt[entry]
+        else:
+            # A call returned before any order could place it: backtrack
+            if not stack:
+                return False
+            entry, state = stack.pop()
+            linearized &= ~(1 << call[entry])
+            unlift(entry)
+            entry = nxt[entry]
+    return True
+
+
+def run_round(n, m, threads, ops, uids, seed, switch_interval=1e-5):
+    """Run one round; returns (history, invariant checks made) or raises AssertionError"""
+    names = ['n%d' % i for i in range(n)]
+    nodes = build_tree(names, m)
+    structure = nodes[names[0]]._structure
+    functions = {'lock': lock, 'unlock': unlock, 'upgrade': upgrade_lock, 'can_lock': can_lock}
+    histories = [[] for _ in range(threads)]
+    failures = []
+    barrier = threading.Barrier(threads + 1)
+    done = threading.Event()
+
+    def worker(index):
+        rng = random.Random(seed * 1000 + index)
+        history = histories[index]
+        plan = [(rng.choices(OPERATIONS, WEIGHTS)[0], rng.randrange(n), rng.randrange(uids)) for _ in range(ops)]
+        barrier.wait()
+        try:
+            for op, i, uid in plan:
+                func = functions[op]
+                node = nodes[names[i]]
+                start = time.perf_counter_ns()
+                answer = func(node) if op == 'can_lock' else func(node, uid)
+                history.append((start, time.perf_counter_ns(), op, i, uid, answer))
+        except Exception as e:
+            failures.append(e)
+
+    checks = [0]
+
+    def checker():
+        while not done.is_set():
+            with structure.exclusive:
+                try:
+                    check_invariants(nodes)
+                except AssertionError as e:
+                    failures.append(e)
+                    return
+            checks[0] += 1
+            time.sleep(0.0005)
+
+    # With a GIL, threads otherwise run thousands of calls per time slice and
+    # rarely interleave inside one; switching every few microseconds makes the
+    # races the checker looks for likely (it has no effect without a GIL)
+    previous_interval = sys.getswitchinterval()
+    sys.setswitchinterval(switch_interval)
+    try:
+        workers = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(threads)]
+        for thread in workers:
+            thread.start()
+        watcher = threading.Thread(target=checker, daemon=True)
+        watcher.start()
+        barrier.wait()
+        deadline = time.monotonic() + 30
+        for thread in workers:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        done.set()
+    finally:
+        sys.setswitchinterval(previous_interval)
+    if any(thread.is_alive() for thread in workers):
+        faulthandler.dump_traceback(file=sys.stderr)
+        raise AssertionError('workers still running after 30s: deadlock or livelock')
+    watcher.join()
+    if failures:
+        raise AssertionError('round %d failed: %r' % (seed, failures[0]))
+    check_invariants(nodes)
+
+    history = [call for thread_history in histories for call in thread_history]
+    if not is_linearizable(history, Model(n, m), (None,) * n):
+        raise AssertionError('round %d: history of %d calls is not linearizable' % (seed, len(history)))
+    return history, checks[0]
+
+
+def test_random_mix_is_linearizable():
+    """Random concurrent mixes keep the invariants and have a legal sequential order"""
+    for seed in range(20):
+        run_round(n=7, m=2, threads=8, ops=100, uids=3, seed=seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--rounds', type=int, default=100)
+    parser.add_argument('--ops', type=int, default=200, help='calls per thread per round')
+    parser.add_argument('--nodes', type=int, default=15)
+    parser.add_argument('--m', type=int, default=2)
+    parser.add_argument('--uids', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    gil = getattr(sys, '_is_gil_enabled', lambda: True)()
+    print('Python %s, GIL %s' % (sys.version.split()[0], 'enabled' if gil else 'disabled'))
+    calls = checks = 0
+    start = time.perf_counter()
+    for seed in range(args.seed, args.seed + args.rounds):
+        history, round_checks = run_round(args.nodes, args.m, args.threads, args.ops, args.uids, seed)
+        calls += len(history)
+        checks += round_checks
+    print('%d rounds, %d calls, %d invariant checks under load: all linearizable (%.1fs)' % (
+        args.rounds, calls, checks, time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    main()
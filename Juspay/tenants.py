@@ -0,0 +1,265 @@
+"""
+Named tree namespaces for hosting many independent hierarchies in one process.
+
+Each tree has its own branching factor and its own nodes, so its per-node
+RLocks form an independent concurrency domain: operations on one customer's
+tree never wait on another's. Trees are loaded lazily from snapshots on first
+use and, when the estimated memory of loaded trees exceeds the budget, the
+least recently used idle trees are written back to a snapshot and dropped.
+
+Snapshots are JSON files in the snapshot directory. Since trees can be
+reshaped at runtime, nodes are stored as [name, parent] pairs in BFS order:
+    {"id": "acme", "m": 2, "nodes": [["World", null], ["Asia", "World"], ...],
+     "locks": {"India": 7}}
+"""
+
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from Thread_safe import add_leaf, build_tree, update_ancestors
+
+# Approximate bytes held by one Thread_safe.Node (object, RLock, set, list,
+# short name), measured with tracemalloc
+NODE_BYTES_ESTIMATE = 640
+
+TREE_ID_PATTERN = re.compile(r'[A-Za-z0-9_-]{1,64}')
+
+
+class TreeError(Exception):
+    """Raised for unknown, duplicate or malformed trees; status is the HTTP code to return"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class TreeEntry:
+    """One loaded tree and its bookkeeping"""
+
+    def __init__(self, tree_id, node_names, m):
+        self.tree_id = tree_id
+        self.m = m
+        self.nodes = build_tree(node_names, m)
+        self.root = self.nodes[node_names[0]]
+        self.in_use = 0
+        self.accounted_bytes = 0  # this tree's share of TreeRegistry's running total
+
+    @property
+    def estimated_bytes(self):
+        return len(self.nodes) * NODE_BYTES_ESTIMATE
+
+    def snapshot(self):
+        """Serializable state; only call while no operation is in flight"""
+        pairs = []
+        queue = [self.root]
+        for node in queue:
+            pairs.append([node.name, node.parent.name if node.parent else None])
+            queue.extend(node.children)
+        return {
+            'id': self.tree_id,
+            'm': self.m,
+            'nodes': pairs,
+            'locks': {name: node.locked_by for name, node in self.nodes.items()
+                      if node.locked_by is not None},
+        }
+
+    @classmethod
+    def from_snapshot(cls, data):
+        nodes = data['nodes']
+        if nodes and isinstance(nodes[0], str):
+            # Level-order names, as written before trees could be reshaped
+            entry = cls(data['id'], nodes, data['m'])
+        else:
+            entry = cls(data['id'], [nodes[0][0]], data['m'])
+            for name, parent in nodes[1:]:
+                add_leaf(entry.nodes, entry.nodes[parent], name)
+        for name, uid in data['locks'].items():
+            node = entry.nodes[name]
+            node.locked_by = uid
+            update_ancestors(node, True)
+        return entry
+
+
+class TreeRegistry:
+    """LRU cache of named trees backed by snapshot files.
+
+    entry_observer, if given, is called as entry_observer('load', entry) when a
+    tree is created or loaded, before any operation can use it, and as
+    entry_observer('drop', entry) when it is evicted or deleted.
+    """
+
+    def __init__(self, snapshot_dir, memory_budget_bytes, entry_observer=None):
+        self.snapshot_dir = snapshot_dir
+        self.memory_budget_bytes = memory_budget_bytes
+        self.entry_observer = entry_observer
+        self._loaded = OrderedDict()  # tree_id -> TreeEntry, least recently used first
+        self._loaded_bytes = 0        # sum of estimated_bytes over _loaded, kept up to date
+        self._mutex = threading.Lock()
+        # Serializes loading and creation per tree id without blocking other trees;
+        # tree_id -> [lock, holders and waiters], dropped when nobody needs it
+        self._load_locks = {}
+        os.makedirs(snapshot_dir, exist_ok=True)
+
+    def _path(self, tree_id):
+        return os.path.join(self.snapshot_dir, tree_id + '.json')
+
+    def _check_id(self, tree_id):
+        if not TREE_ID_PATTERN.fullmatch(tree_id):
+            raise TreeError('Invalid tree id')
+
+    @contextmanager
+    def _load_lock(self, tree_id):
+        with self._mutex:
+            record = self._load_locks.setdefault(tree_id, [threading.Lock(), 0])
+            record[1] += 1
+        try:
+            with record[0]:
+                yield
+        finally:
+            with self._mutex:
+                record[1] -= 1
+                if not record[1]:
+                    del self._load_locks[tree_id]
+
+    def _account(self, entry):
+        """Bring the running total up to date with entry's size; caller holds _mutex"""
+        size = entry.estimated_bytes
+        self._loaded_bytes += size - entry.accounted_bytes
+        entry.accounted_bytes = size
+
+    def _forget(self, entry):
+        """Take a dropped entry out of the running total; caller holds _mutex"""
+        self._loaded_bytes -= entry.accounted_bytes
+        entry.accounted_bytes = 0
+
+    def _notify(self, event, entry):
+        if self.entry_observer is not None:
+            self.entry_observer(event, entry)
+
+    def create(self, tree_id, node_names, m):
+        """Create a new empty-lock tree; fails if the id is already taken"""
+        self._check_id(tree_id)
+        if not isinstance(m, int) or m < 1:
+            raise TreeError('Branching factor m must be a positive integer')
+        if not node_names or not all(isinstance(n, str) for n in node_names):
+            raise TreeError('nodes must be a non-empty list of names')
+        if len(set(node_names)) != len(node_names):
+            raise TreeError('Node names must be unique')
+
+        with self._load_lock(tree_id):
+            if tree_id in self._loaded or os.path.exists(self._path(tree_id)):
+                raise TreeError('Tree already exists', 409)
+            entry = TreeEntry(tree_id, node_names, m)
+            self._write_snapshot(entry)
+            self._notify('load', entry)
+            with self._mutex:
+                self._loaded[tree_id] = entry
+                self._account(entry)
+        self._evict_if_needed()
+        return entry
+
+    def delete(self, tree_id):
+        """Drop a tree and its snapshot; fails while operations are in flight"""
+        self._check_id(tree_id)
+        with self._load_lock(tree_id):
+            with self._mutex:
+                entry = self._loaded.get(tree_id)
+                if entry is not None and entry.in_use:
+                    raise TreeError('Tree is busy', 409)
+                if entry is not None:
+                    del self._loaded[tree_id]
+                    self._forget(entry)
+            if entry is not None:
+                self._notify('drop', entry)
+            try:
+                os.remove(self._path(tree_id))
+            except FileNotFoundError:
+                if entry is None:
+                    raise TreeError('Tree not found', 404)
+
+    @contextmanager
+    def use(self, tree_id):
+        """Pin a tree in memory for the duration of an operation, loading it if needed"""
+        self._check_id(tree_id)
+        entry = self._pin(tree_id)
+        try:
+            yield entry
+        finally:
+            with self._mutex:
+                entry.in_use -= 1
+                # Nodes may have been added or removed meanwhile
+                self._account(entry)
+            self._evict_if_needed()
+
+    def _pin(self, tree_id):
+        with self._mutex:
+            entry = self._loaded.get(tree_id)
+            if entry is not None:
+                entry.in_use += 1
+                self._loaded.move_to_end(tree_id)
+                return entry
+
+        with self._load_lock(tree_id):
+            with self._mutex:
+                entry = self._loaded.get(tree_id)
+            if entry is None:
+                try:
+                    with open(self._path(tree_id)) as f:
+                        data = json.load(f)
+                except FileNotFoundError:
+                    raise TreeError('Tree not found', 404)
+                entry = TreeEntry.from_snapshot(data)
+                self._notify('load', entry)
+            with self._mutex:
+                self._loaded[tree_id] = entry
+                self._loaded.move_to_end(tree_id)
+                self._account(entry)
+                entry.in_use += 1
+                return entry
+
+    def _evict_if_needed(self):
+        """Snapshot and drop idle trees, least recently used first, until under budget"""
+        while True:
+            with self._mutex:
+                if self._loaded_bytes <= self.memory_budget_bytes:
+                    return
+                victim = next((e for e in self._loaded.values() if not e.in_use), None)
+                if victim is None:
+                    return
+
+            # Holding the load lock makes concurrent users of this tree wait for
+            # the snapshot and then reload it, instead of mutating it mid-write
+            with self._load_lock(victim.tree_id):
+                with self._mutex:
+                    if victim.in_use or self._loaded.get(victim.tree_id) is not victim:
+                        continue
+                    del self._loaded[victim.tree_id]
+                    self._forget(victim)
+                self._write_snapshot(victim)
+                self._notify('drop', victim)
+
+    def _write_snapshot(self, entry):
+        path = self._path(entry.tree_id)
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(entry.snapshot(), f)
+        os.replace(tmp, path)
+
+    def flush(self):
+        """Write every loaded tree back to its snapshot (used at shutdown)"""
+        with self._mutex:
+            entries = list(self._loaded.values())
+        for entry in entries:
+            with self._load_lock(entry.tree_id):
+                self._write_snapshot(entry)
+
+    def list_trees(self):
+        """All known tree ids with whether each is currently loaded"""
+        ids = {name[:-5] for name in os.listdir(self.snapshot_dir) if name.endswith('.json')}
+        with self._mutex:
+            loaded = set(self._loaded)
+        return [{'id': tree_id, 'loaded': tree_id in loaded} for tree_id in sorted(ids | loaded)]
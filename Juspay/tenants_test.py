@@ -0,0 +1,55 @@
+import os
+import shutil
+import tempfile
+
+from Thread_safe import add_leaf, lock
+from tenants import NODE_BYTES_ESTIMATE, TreeError, TreeRegistry
+
+NAMES = ["World", "Asia", "Africa", "China", "India", "SouthAfrica", "Egypt"]
+
+def test_ids_budget_and_load_locks():
+    """Ids are matched in full, the memory total follows reshaping, and load locks do not pile up"""
+    directory = tempfile.mkdtemp(prefix='treelock-tenants-test-')
+    try:
+        trees = TreeRegistry(directory, memory_budget_bytes=2 * len(NAMES) * NODE_BYTES_ESTIMATE)
+        for bad in ('bad\n', '../x', '', 'x' * 65):
+            try:
+                trees.create(bad, NAMES, 2)
+                assert False, 'accepted %r' % bad
+            except TreeError as e:
+                assert e.status == 400
+        assert os.listdir(directory) == []
+
+        trees.create('a', NAMES, 2)
+        trees.create('b', NAMES, 2)
+        assert trees._loaded_bytes == 2 * len(NAMES) * NODE_BYTES_ESTIMATE
+        with trees.use('a') as entry:
+            assert add_leaf(entry.nodes, entry.nodes['India'], 'Delhi')
+            assert lock(entry.nodes['Delhi'], 7)
+        # One node over budget: 'b' is the least recently used idle tree
+        assert [t['id'] for t in trees.list_trees() if t['loaded']] == ['a']
+        assert trees._loaded_bytes == (len(NAMES) + 1) * NODE_BYTES_ESTIMATE
+
+        # Reloading 'b' evicts 'a', whose snapshot keeps the new leaf and its lock
+        with trees.use('b'):
+            pass
+        with trees.use('a') as entry:
+            assert entry.nodes['Delhi'].locked_by == 7
+        assert trees._loaded_bytes == sum(e.estimated_bytes for e in trees._loaded.values())
+
+        for missing in ('nope', 'nope2'):
+            try:
+                with trees.use(missing):
+                    pass
+                assert False
+            except TreeError as e:
+                assert e.status == 404
+        trees.delete('a')
+        trees.delete('b')
+        assert trees._load_locks == {} and trees._loaded_bytes == 0
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    test_ids_budget_and_load_locks()
+    print("Tree registry tests passed!")
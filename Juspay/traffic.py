@@ -0,0 +1,90 @@
+"""
+Compact recording format for lock, unlock and upgrade traffic, on the default
+tree (/lock, ...) and on named trees (/trees/<id>/lock, ...).
+
+One request per line, in the same op codes as the offline query format
+(1 = lock, 2 = unlock, 3 = upgrade), with the tree id ("" for the default
+tree), node name and uid as they came in the request, JSON-encoded together
+so that names containing spaces and uids of any JSON type (including null)
+read back unchanged:
+
+    <delta_us> <op> [<tree>, <node>, <uid>]
+
+delta_us is the gap in microseconds since the previous request, so lines
+stay short and a recording can be replayed with its original pacing.
+The first line is a header: "# treelock-traffic v3 <unix start time>".
+v2 recordings ("<delta_us> <op> [<node>, <uid>]") and v1 recordings
+("<delta_us> <op> <node> <uid>", plain text) are still read as default tree
+traffic.
+"""
+
+import atexit
+import json
+import threading
+import time
+
+HEADER = '# treelock-traffic v3'
+
+OP_CODES = {'lock': 1, 'unlock': 2, 'upgrade': 3}
+OP_NAMES = {code: name for name, code in OP_CODES.items()}
+
+
+class TrafficRecorder:
+    """Append incoming lock requests to a recording file. Safe to call from many threads."""
+
+    def __init__(self, path):
+        self._file = open(path, 'w', buffering=1 << 16)
+        self._mutex = threading.Lock()
+        self._last = None
+        self._file.write('%s %.6f\n' % (HEADER, time.time()))
+        atexit.register(self.close)
+
+    def record(self, op, node_name, uid, tree_id=''):
+        """Record one request; op is 'lock', 'unlock' or 'upgrade', tree_id '' for the default tree"""
+        with self._mutex:
+            if self._file is None:
+                return
+            # Read the clock under the mutex so deltas follow write order and are never negative
+            now = time.perf_counter_ns()
+            delta = 0 if self._last is None else (now - self._last) // 1000
+            self._last = now
+            self._file.write('%d %d %s\n' % (delta, OP_CODES[op], json.dumps([tree_id, node_name, uid])))
+
+    def close(self):
+        with self._mutex:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def read_recording(path):
+    """Yield (offset_seconds, op, tree_id, node_name, uid) tuples from a recording file"""
+    offset_us = 0
+    version = 3
+    with open(path) as f:
+        for line in f:
+            if line.startswith('# treelock-traffic v1'):
+                version = 1
+            elif line.startswith('# treelock-traffic v2'):
+                version = 2
+            if not line.strip() or line.startswith('#'):
+                continue
+            tree_id = ''
+            if version == 1:
+                delta, op, node_name, uid = line.split()
+                uid = _parse_uid(uid)
+            elif version == 2:
+                delta, op, fields = line.split(' ', 2)
+                node_name, uid = json.loads(fields)
+            else:
+                delta, op, fields = line.split(' ', 2)
+                tree_id, node_name, uid = json.loads(fields)
+            offset_us += int(delta)
+            yield offset_us / 1e6, OP_NAMES[int(op)], tree_id, node_name, uid
+
+
+def _parse_uid(uid):
+    try:
+        return int(uid)
+    except ValueError:
+        return uid
@@ -0,0 +1,58 @@
+import os
+import tempfile
+import threading
+
+from traffic import TrafficRecorder, read_recording
+
+def test_recording_round_trip():
+    """Tree ids, node names with whitespace and uids of any JSON type read back unchanged"""
+    path = os.path.join(tempfile.mkdtemp(), 'traffic.log')
+    requests = [('lock', '', 'New York', 7), ('unlock', 'acme', 'Tab\there', 'alice'),
+                ('upgrade', '', 'India', None), ('lock', 'a b/c', '123', '123'), ('lock', '', 'Zürich', 1.5)]
+    recorder = TrafficRecorder(path)
+    for op, tree_id, node_name, uid in requests:
+        recorder.record(op, node_name, uid, tree_id)
+    recorder.close()
+
+    replayed = list(read_recording(path))
+    assert [request[1:] for request in replayed] == requests
+    assert [type(request[-1]) for request in replayed] == [type(request[-1]) for request in requests]
+    assert all(a[0] <= b[0] for a, b in zip(replayed, replayed[1:]))
+
+def test_reads_v1_recordings():
+    """Recordings from before the JSON encoding still replay"""
+    path = os.path.join(tempfile.mkdtemp(), 'traffic.log')
+    with open(path, 'w') as f:
+        f.write('# treelock-traffic v1 1700000000.000000\n0 1 India 7\n1500 2 India bob\n')
+    assert list(read_recording(path)) == [(0.0, 'lock', '', 'India', 7), (0.0015, 'unlock', '', 'India', 'bob')]
+
+def test_reads_v2_recordings():
+    """Recordings from before tree ids were added replay as default tree traffic"""
+    path = os.path.join(tempfile.mkdtemp(), 'traffic.log')
+    with open(path, 'w') as f:
+        f.write('# treelock-traffic v2 1700000000.000000\n0 1 ["New York", 7]\n20 3 ["India", null]\n')
+    assert list(read_recording(path)) == [(0.0, 'lock', '', 'New York', 7), (2e-05, 'upgrade', '', 'India', None)]
+
+def test_concurrent_deltas_are_not_negative():
+    """Requests recorded from many threads never produce a negative gap"""
+    path = os.path.join(tempfile.mkdtemp(), 'traffic.log')
+    recorder = TrafficRecorder(path)
+    threads = [threading.Thread(target=lambda: [recorder.record('lock', 'India', i) for i in range(2000)])
+               for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    recorder.close()
+
+    with open(path) as f:
+        deltas = [int(line.split(' ', 1)[0]) for line in f if not line.startswith('#')]
+    assert len(deltas) == 16000
+    assert min(deltas) >= 0
+
+if __name__ == "__main__":
+    test_recording_round_trip()
+    test_reads_v1_recordings()
+    test_reads_v2_recordings()
+    test_concurrent_deltas_are_not_negative()
+    print("Traffic recording tests passed!")
@@ -0,0 +1,76 @@
+from Thread_safe import build_tree, can_lock, lock, unlock, upgrade_lock, add_leaf, remove_subtree, move_subtree
+
+def check_invariants(nodes):
+    """Every locked_descendants set matches the actual locked descendants, and no lock sits below another"""
+    for node in nodes.values():
+        expected = set()
+        stack = list(node.children)
+        while stack:
+            curr = stack.pop()
+            if curr.locked_by is not None:
+                expected.add(curr)
+            stack.extend(curr.children)
+        assert node.locked_descendants == expected, node.name
+        if node.locked_by is not None:
+            assert not expected, node.name
+        for child in node.children:
+            assert child.parent is node
+            assert nodes[child.name] is child
+
+def test_add_remove_move():
+    """Mutations keep descendant-lock sets correct without a rebuild"""
+    nodes = build_tree(["World", "Asia", "Africa", "China", "India", "SouthAfrica", "Egypt"], 2)
+
+    assert add_leaf(nodes, nodes["India"], "Delhi")
+    assert not add_leaf(nodes, nodes["India"], "Delhi")  # duplicate name
+    assert lock(nodes["Delhi"], 1)
+    assert not lock(nodes["India"], 1)
+    check_invariants(nodes)
+
+    # Move a subtree holding a lock from Asia to Africa
+    assert move_subtree(nodes, nodes["India"], nodes["Africa"])
+    assert nodes["Delhi"] in nodes["Africa"].locked_descendants
+    assert nodes["Delhi"] not in nodes["Asia"].locked_descendants
+    assert lock(nodes["Asia"], 2)
+    check_invariants(nodes)
+
+    # Locks may not end up below a locked node, and no cycles
+    assert not move_subtree(nodes, nodes["India"], nodes["Asia"])
+    assert not move_subtree(nodes, nodes["Africa"], nodes["Delhi"])
+    assert not move_subtree(nodes, nodes["World"], nodes["Asia"])
+
+    # Only unlocked subtrees can be removed
+    assert not remove_subtree(nodes, nodes["India"])
+    assert upgrade_lock(nodes["India"], 1)
+    assert not remove_subtree(nodes, nodes["India"])
+    assert unlock(nodes["India"], 1)
+    assert remove_subtree(nodes, nodes["India"])
+    assert "India" not in nodes and "Delhi" not in nodes
+    check_invariants(nodes)
+
+def test_removed_nodes_refuse_operations():
+    """A reference looked up before remove_subtree cannot lock, unlock or probe the removed node"""
+    nodes = build_tree(["World", "Asia", "Africa", "China", "India", "SouthAfrica", "Egypt"], 2)
+    assert add_leaf(nodes, nodes["India"], "Delhi")
+    india, delhi = nodes["India"], nodes["Delhi"]
+    assert remove_subtree(nodes, india)
+
+    for node in (india, delhi):
+        assert not can_lock(node)
+        assert not lock(node, 1)
+        assert not upgrade_lock(node, 1)
+        assert node.locked_by is None
+    assert not unlock(india, None)
+    assert not add_leaf(nodes, delhi, "Mumbai")
+    assert not move_subtree(nodes, india, nodes["Asia"])
+    check_invariants(nodes)
+
+    # The name can be reused by a new node, which works as usual
+    assert add_leaf(nodes, nodes["Asia"], "India")
+    assert lock(nodes["India"], 1) and not lock(nodes["Asia"], 2)
+    check_invariants(nodes)
+
+if __name__ == "__main__":
+    test_add_remove_move()
+    test_removed_nodes_refuse_operations()
+    print("Tree mutation tests passed!")
@@ -0,0 +1,338 @@
+"""
+Benchmark suite comparing the tree locking engines.
+
+Engines:
+    submission  - Submission.py (counters + recursive collect_locked_descendants)
+    optimized   - Optimized.py (locked_descendants sets on every ancestor)
+    thread_safe - Juspay/Thread_safe.py (sets + per-node RLocks)
+
+Every (scenario, engine) pair runs in its own spawned process so that memory
+is measured in isolation and a crash in one engine (e.g. RecursionError on a
+deep chain) does not take down the run. The memory column is the growth of
+peak RSS from just before build_tree to the end of the run; the harness's own
+name, workload and latency lists are allocated before that point, so it
+counts the engine's tree and whatever its operations allocate.
+
+Usage:
+    python benchmark.py                               # all scenarios, all engines
+    python benchmark.py --scenario hot-subtree --n 1000000 --ops 200000
+    python benchmark.py --output results.json
+    python benchmark.py --compare old.json new.json   # diff two result files
+"""
+
+import argparse
+import importlib
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import sys
+import time
+from queue import Empty
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+ENGINES = {
+    'submission': 'Submission',
+    'optimized': 'Optimized',
+    'thread_safe': 'Thread_safe',
+}
+
+# Preset workloads. Any field can be overridden from the command line.
+#   n            - number of nodes
+#   m            - branching factor (m=1 gives a chain of depth n)
+#   ops          - number of measured operations
+#   lock_density - fraction of nodes we try to lock before measuring
+#   mix          - relative weights of (lock, unlock, upgrade)
+#   skew         - fraction of operations that target the hot subtree
+#   hot_depth    - depth of the hot subtree's root
+#   users        - number of distinct uids
+SCENARIOS = {
+    'balanced': dict(n=100_000, m=2, ops=100_000, lock_density=0.01,
+                     mix=(1, 1, 0), skew=0.0, hot_depth=2, users=16),
+    'wide': dict(n=100_000, m=16, ops=100_000, lock_density=0.01,
+                 mix=(1, 1, 0), skew=0.0, hot_depth=1, users=16),
+    'chain': dict(n=2_000, m=1, ops=20_000, lock_density=0.01,
+                  mix=(1, 1, 1), skew=0.0, hot_depth=0, users=4),
+    'lock-dense': dict(n=100_000, m=4, ops=100_000, lock_density=0.5,
+                       mix=(1, 1, 0), skew=0.0, hot_depth=1, users=16),
+    'upgrade-heavy': dict(n=100_000, m=4, ops=50_000, lock_density=0.05,
+                          mix=(2, 1, 4), skew=0.0, hot_depth=3, users=2),
+    'hot-subtree': dict(n=100_000, m=4, ops=100_000, lock_density=0.01,
+                        mix=(2, 2, 1), skew=0.9, hot_depth=3, users=8),
+}
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+def load_engine(engine):
+    """Import an engine module by its short name"""
+    for path in (ROOT, os.path.join(ROOT, 'Juspay')):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    return importlib.import_module(ENGINES[engine])
+
+
+def subtree_ranges(root, n, m):
+    """Level-order index ranges [start, end) covering the subtree of root"""
+    if m == 1:
+        return [(root, n)] if root < n else []
+    ranges = []
+    start = end = root
+    while start < n:
+        ranges.append((start, min(end + 1, n)))
+        start, end = m * start + 1, m * end + m
+    return ranges
+
+
+def hot_subtree_root(n, m, depth):
+    """Index of the first node at the given depth, clamped to the tree"""
+    idx = 0
+    for _ in range(depth):
+        child = m * idx + 1
+        if child >= n:
+            break
+        idx = child
+    return idx
+
+
+def sample_from_ranges(rng, ranges, total):
+    """Pick a uniformly random index from a list of disjoint ranges"""
+    k = rng.randrange(total)
+    for start, end in ranges:
+        if k < end - start:
+            return start + k
+        k -= end - start
+    raise ValueError('empty ranges')
+
+
+def generate_workload(cfg, seed):
+    """Build (prelock, ops) index lists for a scenario. Deterministic in seed."""
+    rng = random.Random(seed)
+    n, m = cfg['n'], cfg['m']
+    users = cfg['users']
+
+    prelock = [(rng.randrange(n), rng.randrange(users))
+               for _ in range(int(n * cfg['lock_density']))]
+
+    hot = subtree_ranges(hot_subtree_root(n, m, cfg['hot_depth']), n, m)
+    hot_total = sum(end - start for start, end in hot)
+
+    op_types = rng.choices((1, 2, 3), weights=cfg['mix'], k=cfg['ops'])
+    ops = []
+    for op_type in op_types:
+        if cfg['skew'] and rng.random() < cfg['skew']:
+            idx = sample_from_ranges(rng, hot, hot_total)
+        else:
+            idx = rng.randrange(n)
+        ops.append((op_type, idx, rng.randrange(users)))
+    return prelock, ops
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0
+    rank = max(0, min(len(sorted_values) - 1,
+                      int(round(pct / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+
+def run_engine(engine, cfg, seed):
+    """Run one scenario against one engine in the current process"""
+    module = load_engine(engine)
+    prelock, ops = generate_workload(cfg, seed)
+
+    node_names = ['n%d' % i for i in range(cfg['n'])]
+    by_index = [None] * cfg['n']
+    latencies = [0] * len(ops)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.perf_counter()
+    nodes = module.build_tree(node_names, cfg['m'])
+    build_seconds = time.perf_counter() - start
+    for i, name in enumerate(node_names):
+        by_index[i] = nodes[name]
+    del nodes, node_names
+
+    for idx, uid in prelock:
+        module.lock(by_index[idx], uid)
+
+    # Resolve in place so the measured phase allocates no harness lists
+    handlers = {1: module.lock, 2: module.unlock, 3: module.upgrade_lock}
+    for i, (op_type, idx, uid) in enumerate(ops):
+        ops[i] = (handlers[op_type], by_index[idx], uid)
+    resolved = ops
+    successes = 0
+    clock = time.perf_counter_ns
+
+    start = clock()
+    for i, (handler, node, uid) in enumerate(resolved):
+        t0 = clock()
+        if handler(node, uid):
+            successes += 1
+        latencies[i] = clock() - t0
+    elapsed = (clock() - start) / 1e9
+
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    latencies.sort()
+    return {
+        'ops': len(resolved),
+        'successes': successes,
+        'build_seconds': build_seconds,
+        'elapsed_seconds': elapsed,
+        'ops_per_sec': len(resolved) / elapsed if elapsed else 0.0,
+        'latency_ns': {('p%g' % p): percentile(latencies, p) for p in PERCENTILES},
+        'latency_max_ns': latencies[-1] if latencies else 0,
+        'peak_rss_kb': rss_after,
+        'engine_rss_kb': max(0, rss_after - rss_before),
+    }
+
+
+def _child(engine, cfg, seed, queue):
+    """Entry point for the isolated per-engine process"""
+    try:
+        queue.put({'status': 'ok', **run_engine(engine, cfg, seed)})
+    except BaseException as e:
+        queue.put({'status': 'error', 'error': '%s: %s' % (type(e).__name__, e)})
+
+
+def run_isolated(engine, cfg, seed, timeout):
+    """Run one engine in a spawned process and collect its result"""
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_child, args=(engine, cfg, seed, queue))
+    proc.start()
+    # Poll rather than block for the whole timeout: a child that dies hard
+    # (e.g. a C stack overflow) never puts anything on the queue
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            result = queue.get(timeout=0.5)
+            break
+        except Empty:
+            pass
+        if not proc.is_alive():
+            try:
+                # It may have put its result just before exiting
+                result = queue.get(timeout=1)
+            except Empty:
+                result = {'status': 'error', 'error': 'crashed (exit code %s)' % proc.exitcode}
+            break
+        if time.monotonic() > deadline:
+            result = {'status': 'error', 'error': 'timed out after %gs' % timeout}
+            break
+    proc.join(5)
+    if proc.is_alive():
+        proc.terminate()
+        proc.join()
+    return result
+
+
+def format_row(scenario, engine, result):
+    if result['status'] != 'ok':
+        return '%-14s %-12s %s' % (scenario, engine, result['error'])
+    lat = result['latency_ns']
+    return '%-14s %-12s %12.0f %10.2f %10.2f %10.2f %10d' % (
+        scenario, engine, result['ops_per_sec'],
+        lat['p50'] / 1000, lat['p99'] / 1000, lat['p99.9'] / 1000,
+        result['engine_rss_kb'] // 1024)
+
+
+def run_suite(args):
+    """Run the selected scenarios and engines, print a table, optionally save JSON"""
+    scenarios = args.scenario or list(SCENARIOS)
+    engines = args.engine or list(ENGINES)
+    overrides = {key: getattr(args, key) for key in ('n', 'm', 'ops', 'lock_density', 'skew', 'hot_depth', 'users')
+                 if getattr(args, key) is not None}
+    if args.mix:
+        overrides['mix'] = tuple(float(w) for w in args.mix.split(','))
+
+    report = {
+        'created': datetime.now(timezone.utc).isoformat(),
+        'python': sys.version.split()[0],
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'seed': args.seed,
+        'results': [],
+    }
+
+    print('%-14s %-12s %12s %10s %10s %10s %10s' % (
+        'scenario', 'engine', 'ops/sec', 'p50 us', 'p99 us', 'p99.9 us', 'mem MB'))
+    for scenario in scenarios:
+        cfg = dict(SCENARIOS[scenario], **overrides)
+        for engine in engines:
+            result = run_isolated(engine, cfg, args.seed, args.timeout)
+            print(format_row(scenario, engine, result))
+            sys.stdout.flush()
+            report['results'].append({'scenario': scenario, 'engine': engine,
+                                      'config': cfg, **result})
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print('Results written to %s' % args.output)
+
+
+def compare(old_path, new_path):
+    """Print per (scenario, engine) throughput and latency changes between two runs"""
+    with open(old_path) as f:
+        old = {(r['scenario'], r['engine']): r for r in json.load(f)['results']}
+    with open(new_path) as f:
+        new = {(r['scenario'], r['engine']): r for r in json.load(f)['results']}
+
+    print('%-14s %-12s %12s %12s %12s' % ('scenario', 'engine', 'ops/sec', 'p99', 'memory'))
+    for key in sorted(old.keys() & new.keys()):
+        a, b = old[key], new[key]
+        if a['status'] != 'ok' or b['status'] != 'ok':
+            print('%-14s %-12s %s -> %s' % (key[0], key[1], a['status'], b['status']))
+            continue
+        if a['config'] != b['config']:
+            print('%-14s %-12s config differs, skipped' % key)
+            continue
+        print('%-14s %-12s %+11.1f%% %+11.1f%% %+11.1f%%' % (
+            key[0], key[1],
+            _change(a['ops_per_sec'], b['ops_per_sec']),
+            _change(a['latency_ns']['p99'], b['latency_ns']['p99']),
+            _change(_memory(a), _memory(b))))
+
+
+def _memory(result):
+    # Result files written before engine_rss_kb existed only have the process peak
+    return result.get('engine_rss_kb', result['peak_rss_kb'])
+
+
+def _change(before, after):
+    return (after - before) * 100.0 / before if before else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the tree locking engines')
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS))
+    parser.add_argument('--engine', action='append', choices=sorted(ENGINES))
+    parser.add_argument('--n', type=int)
+    parser.add_argument('--m', type=int)
+    parser.add_argument('--ops', type=int)
+    parser.add_argument('--lock-density', dest='lock_density', type=float)
+    parser.add_argument('--mix', help='lock,unlock,upgrade weights, e.g. 1,1,2')
+    parser.add_argument('--skew', type=float)
+    parser.add_argument('--hot-depth', dest='hot_depth', type=int)
+    parser.add_argument('--users', type=int)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--timeout', type=float, default=3600.0,
+                        help='seconds allowed per (scenario, engine) run')
+    parser.add_argument('--output', help='write machine-readable results to this JSON file')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+    else:
+        run_suite(args)
+
+
+if __name__ == "__main__":
+    main()
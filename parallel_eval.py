@@ -0,0 +1,368 @@
+"""
+Parallel offline query evaluator, partitioned by subtree.
+
+Reads the same input as Optimized.py's main() and prints the same output,
+but spreads the work over several processes.
+
+Nodes above --split-depth form the shared "top" of the tree; every node at
+that depth roots a partition. By default the split is the shallowest depth
+with at least one partition per worker, so every worker has work. A query on a partition node can only observe
+the rest of the tree through its top ancestors (is any of them locked?), and
+the top only observes a partition through its locked nodes. So:
+
+  * the query stream is cut into epochs at every query that targets a top node;
+  * within an epoch each partition's queries run independently in the worker
+    process that owns it, with a fixed "blocked" flag for the partition;
+  * top queries are evaluated by the coordinator between epochs, using the
+    partitions' locked-node counts (and, for upgrade, their lock owners).
+
+An upgrade on a top node that succeeds clears the affected partitions, which
+is exactly what the serial engine does when it unlocks those descendants.
+Worker processes are persistent and receive all of their queries up front,
+so a stream with no top queries needs a single round trip per worker.
+
+Usage:
+    python parallel_eval.py --workers 8 < queries.txt
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+
+from Optimized import Node, lock, unlock, upgrade_lock, update_ancestors
+
+HANDLERS = {1: lock, 2: unlock, 3: upgrade_lock}
+
+
+def level_starts(n, m, depth):
+    """Level-order index of the first node at each depth 0..depth+1"""
+    starts = [0]
+    width = 1
+    for _ in range(depth + 1):
+        starts.append(min(n, starts[-1] + width))
+        width *= m
+    return starts
+
+
+def default_split_depth(n, m, workers):
+    """Shallowest depth with at least `workers` nodes, or the deepest level if none has that many"""
+    depth = 1
+    while True:
+        starts = level_starts(n, m, depth + 1)
+        if starts[depth + 1] - starts[depth] >= workers or starts[depth + 2] == starts[depth + 1]:
+            return depth
+        depth += 1
+
+
+def subtree_indices(root, n, m):
+    """All level-order indices in the subtree of root"""
+    if m == 1:
+        return range(root, n)
+    indices = []
+    start = end = root
+    while start < n:
+        indices.extend(range(start, min(end + 1, n)))
+        start, end = m * start + 1, m * end + m
+    return indices
+
+
+def build_partition(root, names, n, m):
+    """Build an Optimized subtree rooted at root, with no parent above it"""
+    nodes = {}
+    for i in subtree_indices(root, n, m):
+        node = Node(names[i])
+        if i != root:
+            parent = nodes[names[(i - 1) // m]]
+            node.parent = parent
+            parent.children.append(node)
+        nodes[names[i]] = node
+    return nodes
+
+
+def locked_count(root):
+    return len(root.locked_descendants) + (root.locked_by is not None)
+
+
+def locked_nodes(root):
+    nodes = list(root.locked_descendants)
+    if root.locked_by is not None:
+        nodes.append(root)
+    return nodes
+
+
+def _worker(conn, partitions, m, epochs):
+    """
+    Worker process. partitions maps partition root index -> (names, n) where
+    names covers the indices of that subtree; epochs maps epoch number to a
+    list of (query index, op, partition, node name, uid).
+    """
+    trees = {}
+    for root, (names, n) in partitions.items():
+        trees[root] = build_partition(root, names, n, m)
+    roots = {root: trees[root][names[root]] for root, (names, _) in partitions.items()}
+    results = []
+
+    while True:
+        msg = conn.recv()
+        kind = msg[0]
+        if kind == 'epoch':
+            _, epoch, blocked, clears = msg
+            for root in clears:
+                for node in locked_nodes(roots[root]):
+                    node.locked_by = None
+                    update_ancestors(node, False)
+            touched = set()
+            for qidx, op, root, name, uid in epochs.pop(epoch, ()):
+                touched.add(root)
+                if root in blocked and op != 2:
+                    # A locked top ancestor makes lock and upgrade fail; unlock
+                    # does not look at ancestors and is evaluated as usual.
+                    results.append((qidx, False))
+                else:
+                    results.append((qidx, HANDLERS[op](trees[root][name], uid)))
+            conn.send({root: locked_count(roots[root]) for root in touched})
+        elif kind == 'owners':
+            conn.send({root: {node.locked_by for node in locked_nodes(roots[root])} for root in msg[1]})
+        elif kind == 'finish':
+            conn.send(results)
+            conn.close()
+            return
+
+
+class TopState:
+    """Coordinator's view: lock owners of top nodes and locked counts per partition"""
+
+    def __init__(self, n, m, top_count, partition_roots):
+        self.m = m
+        self.top_count = top_count
+        self.locked_by = [None] * top_count
+        self.counts = dict.fromkeys(partition_roots, 0)
+        # For each top node: top nodes and partition roots strictly below it.
+        # Walking down level by level stops at the partition level.
+        limit = partition_roots[-1] + 1
+        self.top_below = []
+        self.partitions_below = []
+        for t in range(top_count):
+            below = []
+            start = end = t
+            while True:
+                start, end = m * start + 1, m * end + m
+                if start >= limit:
+                    break
+                below.extend(range(start, min(end + 1, limit)))
+            self.top_below.append([i for i in below if i < top_count])
+            self.partitions_below.append([i for i in below if i >= top_count])
+
+    def ancestor_locked(self, idx):
+        while idx > 0:
+            idx = (idx - 1) // self.m
+            if self.locked_by[idx] is not None:
+                return True
+        return False
+
+    def blocked_partitions(self):
+        blocked = set()
+        for t in range(self.top_count):
+            if self.locked_by[t] is not None:
+                blocked.update(self.partitions_below[t])
+        return blocked
+
+
+class Coordinator:
+    """Drives the workers through the epochs and evaluates top queries"""
+
+    def __init__(self, state, conns, owner):
+        self.state = state
+        self.conns = conns
+        self.owner = owner            # partition root -> worker number
+        self.pending_clears = [set() for _ in conns]
+
+    def run_epoch(self, epoch, workers_with_queries):
+        blocked = self.state.blocked_partitions()
+        active = set(workers_with_queries)
+        active.update(w for w, clears in enumerate(self.pending_clears) if clears)
+        for w in active:
+            mine = {p for p in blocked if self.owner[p] == w}
+            self.conns[w].send(('epoch', epoch, mine, self.pending_clears[w]))
+            self.pending_clears[w] = set()
+        for w in active:
+            self.state.counts.update(self.conns[w].recv())
+
+    def owners(self, partitions):
+        by_worker = {}
+        for p in partitions:
+            by_worker.setdefault(self.owner[p], []).append(p)
+        owners = set()
+        for w, parts in by_worker.items():
+            self.conns[w].send(('owners', parts))
+        for w in by_worker:
+            for uids in self.conns[w].recv().values():
+                owners.update(uids)
+        return owners
+
+    def top_query(self, op, t, uid):
+        """Evaluate one query on a top node with the same rules as Optimized.py"""
+        state = self.state
+        if op == 2:
+            if state.locked_by[t] != uid:
+                return False
+            state.locked_by[t] = None
+            return True
+
+        if state.locked_by[t] is not None or state.ancestor_locked(t):
+            return False
+        locked_top = [d for d in state.top_below[t] if state.locked_by[d] is not None]
+        locked_parts = [p for p in state.partitions_below[t] if state.counts[p]]
+
+        if op == 1:
+            if locked_top or locked_parts:
+                return False
+            state.locked_by[t] = uid
+            return True
+
+        if not locked_top and not locked_parts:
+            return False
+        if any(state.locked_by[d] != uid for d in locked_top):
+            return False
+        if locked_parts and self.owners(locked_parts) != {uid}:
+            return False
+        for d in locked_top:
+            state.locked_by[d] = None
+        for p in locked_parts:
+            state.counts[p] = 0
+            self.pending_clears[self.owner[p]].add(p)
+        state.locked_by[t] = uid
+        return True
+
+
+def evaluate(names, m, queries, workers=None, split_depth=None):
+    """Evaluate (op, node name, uid) queries; returns a list of booleans in query order"""
+    n = len(names)
+    workers = workers or os.cpu_count() or 1
+    if split_depth is None:
+        split_depth = default_split_depth(n, m, workers)
+    starts = level_starts(n, m, split_depth)
+    top_count = starts[split_depth]
+    partition_roots = list(range(top_count, starts[split_depth + 1]))
+
+    if workers < 2 or len(partition_roots) < 2:
+        return evaluate_serial(names, m, queries)
+
+    index = {name: i for i, name in enumerate(names)}
+    partition = [0] * n
+    for i in range(top_count, n):
+        partition[i] = i if i < starts[split_depth + 1] else partition[(i - 1) // m]
+
+    # Cut the stream into epochs and sort partition queries by owner
+    load = dict.fromkeys(partition_roots, 0)
+    classified = []
+    epoch = 0
+    for qidx, (op, name, uid) in enumerate(queries):
+        i = index[name]
+        if i < top_count:
+            classified.append((qidx, op, i, uid, None))
+            epoch += 1
+        else:
+            p = partition[i]
+            load[p] += 1
+            classified.append((qidx, op, name, uid, (epoch, p)))
+
+    # Longest-processing-time assignment of partitions to workers by query count
+    workers = min(workers, len(partition_roots))
+    owner = {}
+    worker_load = [0] * workers
+    for p in sorted(partition_roots, key=lambda p: -load[p]):
+        w = worker_load.index(min(worker_load))
+        owner[p] = w
+        worker_load[w] += load[p] + 1
+
+    epochs = [{} for _ in range(workers)]
+    epoch_workers = {}
+    for qidx, op, target, uid, where in classified:
+        if where is None:
+            continue
+        e, p = where
+        w = owner[p]
+        epochs[w].setdefault(e, []).append((qidx, op, p, target, uid))
+        epoch_workers.setdefault(e, set()).add(w)
+
+    specs = [{} for _ in range(workers)]
+    for p in partition_roots:
+        sub = {i: names[i] for i in subtree_indices(p, n, m)}
+        specs[owner[p]][p] = (sub, n)
+
+    ctx = multiprocessing.get_context()
+    conns = []
+    procs = []
+    for w in range(workers):
+        parent_conn, child_conn = ctx.Pipe()
+        proc = ctx.Process(target=_worker, args=(child_conn, specs[w], m, epochs[w]), daemon=True)
+        proc.start()
+        child_conn.close()
+        conns.append(parent_conn)
+        procs.append(proc)
+    del specs, epochs
+
+    state = TopState(n, m, top_count, partition_roots)
+    coordinator = Coordinator(state, conns, owner)
+    results = [None] * len(queries)
+    epoch = 0
+    pos = 0
+    total = len(classified)
+    while pos < total:
+        if classified[pos][4] is None:
+            qidx, op, t, uid, _ = classified[pos]
+            results[qidx] = coordinator.top_query(op, t, uid)
+            epoch += 1
+            pos += 1
+            continue
+        coordinator.run_epoch(epoch, epoch_workers.get(epoch, ()))
+        while pos < total and classified[pos][4] is not None:
+            pos += 1
+
+    for conn in conns:
+        conn.send(('finish',))
+    for conn in conns:
+        for qidx, result in conn.recv():
+            results[qidx] = result
+    for proc in procs:
+        proc.join()
+    return results
+
+
+def evaluate_serial(names, m, queries):
+    """Reference path: the plain Optimized engine, one query at a time"""
+    from Optimized import build_tree
+    nodes = build_tree(names, m)
+    return [HANDLERS[op](nodes[name], uid) for op, name, uid in queries]
+
+
+def read_input(stream):
+    """Parse the N, m, Q, names, queries format used by main()"""
+    tokens = stream.read().split()
+    n, m, q = int(tokens[0]), int(tokens[1]), int(tokens[2])
+    names = tokens[3:3 + n]
+    pos = 3 + n
+    queries = []
+    for _ in range(q):
+        queries.append((int(tokens[pos]), tokens[pos + 1], int(tokens[pos + 2])))
+        pos += 3
+    return names, m, queries
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Evaluate a lock query file in parallel')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: all cores)')
+    parser.add_argument('--split-depth', type=int, default=None,
+                        help='nodes above this depth are shared; each node at it roots a partition '
+                             '(default: the shallowest depth with a partition per worker)')
+    args = parser.parse_args()
+
+    names, m, queries = read_input(sys.stdin)
+    results = evaluate(names, m, queries, args.workers, args.split_depth)
+    sys.stdout.write(''.join('true\n' if r else 'false\n' for r in results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+import random
+
+from parallel_eval import default_split_depth, evaluate, evaluate_serial
+
+def random_case(rng):
+    n = rng.randint(1, 60)
+    m = rng.randint(1, 4)
+    names = ['n%d' % i for i in range(n)]
+    # Few nodes and uids so locks collide and upgrades succeed often
+    hot = rng.sample(names, min(n, rng.randint(1, 12)))
+    queries = [(rng.choice((1, 1, 2, 3)), rng.choice(hot), rng.randint(1, 3)) for _ in range(rng.randint(0, 120))]
+    return names, m, queries
+
+def test_matches_serial_engine():
+    """Random trees, query streams, worker counts and split depths give the serial engine's answers"""
+    rng = random.Random(31)
+    for _ in range(180):
+        names, m, queries = random_case(rng)
+        workers = rng.randint(2, 4)
+        split_depth = rng.choice((None, 1, 2, 3))
+        assert evaluate(names, m, queries, workers, split_depth) == evaluate_serial(names, m, queries), \
+            (len(names), m, workers, split_depth)
+
+def test_default_split_gives_every_worker_a_partition():
+    """The default split depth reaches one partition per worker where the tree is deep enough"""
+    assert default_split_depth(7, 2, 2) == 1
+    assert default_split_depth(100, 2, 8) == 3
+    assert default_split_depth(1000, 4, 8) == 2
+    assert default_split_depth(7, 2, 8) == 2  # only 4 leaves: the deepest level
+
+if __name__ == "__main__":
+    test_matches_serial_engine()
+    test_default_split_gives_every_worker_a_partition()
+    print("Parallel evaluator tests passed!")
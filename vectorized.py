@@ -0,0 +1,171 @@
+"""
+NumPy-vectorized batch lock-feasibility probes over an array-backed state.
+
+Nodes are identified by their level-order index, so the parent of i is
+(i - 1) // m and the descendants of i at depth k below it form the
+contiguous range starting at i*m^k + (m^k - 1)/(m - 1) of length m^k.
+
+ArrayTreeState keeps one int64 array of lock owners (-1 = unlocked) and
+derives two boolean arrays from it:
+    ancestor_locked[i]   - some strict ancestor of i is locked
+    descendant_locked[i] - some strict descendant of i is locked
+Both are rebuilt in O(n + locked * depth) NumPy work (a difference array over
+the locked nodes' subtree ranges, and a vectorized parent walk from the
+locked nodes), after which any batch of probes is a couple of fancy-indexing passes.
+
+Usage:
+    state = ArrayTreeState.from_nodes(nodes, node_names, m)
+    ok = state.can_lock_many(np.array([3, 17, 42]))
+
+Run this file directly for a speed comparison with per-node Optimized.can_lock.
+"""
+
+try:
+    import numpy as np
+except ImportError as e:
+    raise ImportError('vectorized.py requires numpy; install it with "pip install numpy"') from e
+
+UNLOCKED = -1
+
+
+class ArrayTreeState:
+    """Lock owners of an m-ary level-order tree plus derived probe arrays"""
+
+    def __init__(self, n, m, locked_by=None):
+        self.n = n
+        self.m = m
+        if locked_by is None:
+            locked_by = np.full(n, UNLOCKED, dtype=np.int64)
+        self.locked_by = np.asarray(locked_by, dtype=np.int64)
+        self._dirty = True
+        self.ancestor_locked = None
+        self.descendant_locked = None
+
+    @classmethod
+    def from_nodes(cls, nodes, node_names, m):
+        """Snapshot lock owners from a Submission/Optimized/Thread_safe tree (integer uids)"""
+        locked_by = np.fromiter(
+            (UNLOCKED if nodes[name].locked_by is None else nodes[name].locked_by for name in node_names),
+            dtype=np.int64, count=len(node_names))
+        return cls(len(node_names), m, locked_by)
+
+    def set_owner(self, idx, uid):
+        """Record that node idx is now locked by uid (None to unlock)"""
+        self.locked_by[idx] = UNLOCKED if uid is None else uid
+        self._dirty = True
+
+    def refresh(self):
+        """Rebuild the derived arrays if any owner changed since the last probe"""
+        if not self._dirty:
+            return
+        locked = np.flatnonzero(self.locked_by != UNLOCKED)
+        self.ancestor_locked = self._below_any(locked)
+        self.descendant_locked = self._above_any(locked)
+        self._dirty = False
+
+    def _below_any(self, locked):
+        """Mark every strict descendant of the locked nodes"""
+        n, m = self.n, self.m
+        marked = np.zeros(n, dtype=bool)
+        if locked.size == 0:
+            return marked
+        if m == 1:
+            marked[locked.min() + 1:] = True
+            return marked
+
+        opens = []
+        closes = []
+        starts = locked
+        width = 1
+        while True:
+            starts = starts * m + 1
+            width *= m
+            starts = starts[starts < n]
+            if starts.size == 0:
+                break
+            opens.append(starts)
+            closes.append(np.minimum(starts + width, n))
+        if not opens:
+            return marked
+        diff = (np.bincount(np.concatenate(opens), minlength=n + 1)
+                - np.bincount(np.concatenate(closes), minlength=n + 1))
+        return np.cumsum(diff[:n]) > 0
+
+    def _above_any(self, locked):
+        """Mark every strict ancestor of the locked nodes"""
+        marked = np.zeros(self.n, dtype=bool)
+        if locked.size == 0:
+            return marked
+        if self.m == 1:
+            marked[:locked.max()] = True
+            return marked
+
+        # locked is sorted and (i - 1) // m is monotonic, so parents stay sorted
+        # and duplicates are adjacent
+        current = locked
+        while True:
+            current = current[current > 0]
+            if current.size == 0:
+                break
+            current = (current - 1) // self.m
+            current = current[np.concatenate(([True], current[1:] != current[:-1]))]
+            # Ancestors already marked have had their own ancestors marked too
+            fresh = current[~marked[current]]
+            marked[fresh] = True
+            current = fresh
+        return marked
+
+    def _indices(self, indices):
+        """Probe indices as an int64 array; NumPy would wrap negative ones round to the last nodes"""
+        indices = np.asarray(indices, dtype=np.int64)
+        if indices.size and (indices.min() < 0 or indices.max() >= self.n):
+            raise ValueError('node indices must be in [0, %d)' % self.n)
+        return indices
+
+    def can_lock_many(self, indices):
+        """Vectorized can_lock: no ancestor and no descendant of each index is locked"""
+        indices = self._indices(indices)
+        self.refresh()
+        return ~(self.ancestor_locked[indices] | self.descendant_locked[indices])
+
+    def lockable_many(self, indices):
+        """Vectorized probe for lock(): can_lock and the node itself is free"""
+        indices = self._indices(indices)
+        return self.can_lock_many(indices) & (self.locked_by[indices] == UNLOCKED)
+
+
+def main():
+    import random
+    import time
+    from Optimized import build_tree, can_lock, lock
+
+    n, m, probes = 1_000_000, 4, 100_000
+    rng = random.Random(1)
+    node_names = ['n%d' % i for i in range(n)]
+    nodes = build_tree(node_names, m)
+    for _ in range(n // 100):
+        lock(nodes[node_names[rng.randrange(n)]], rng.randrange(8))
+    indices = [rng.randrange(n) for _ in range(probes)]
+
+    start = time.perf_counter()
+    expected = [can_lock(nodes[node_names[i]]) for i in indices]
+    loop_seconds = time.perf_counter() - start
+
+    state = ArrayTreeState.from_nodes(nodes, node_names, m)
+    index_array = np.array(indices)
+    start = time.perf_counter()
+    state.refresh()
+    refresh_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    got = state.can_lock_many(index_array)
+    probe_seconds = time.perf_counter() - start
+
+    assert got.tolist() == expected
+    print('per-node can_lock loop: %8.2f ms' % (loop_seconds * 1000))
+    print('array refresh:          %8.2f ms' % (refresh_seconds * 1000))
+    print('can_lock_many:          %8.2f ms  (%.0fx faster than the loop, %.0fx including refresh)' % (
+        probe_seconds * 1000, loop_seconds / probe_seconds, loop_seconds / (probe_seconds + refresh_seconds)))
+
+
+if __name__ == "__main__":
+    main()
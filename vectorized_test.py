@@ -0,0 +1,56 @@
+import random
+
+import numpy as np
+
+from Optimized import build_tree, can_lock, update_ancestors
+from vectorized import ArrayTreeState
+
+def random_case(rng):
+    n = rng.randint(1, 80)
+    m = rng.randint(1, 4)
+    names = ['n%d' % i for i in range(n)]
+    nodes = build_tree(names, m)
+    # Owners are set directly so nested locks, which lock() would refuse, are covered too
+    for name in rng.sample(names, rng.randint(0, min(n, 6))):
+        nodes[name].locked_by = rng.randint(0, 3)
+        update_ancestors(nodes[name], True)
+    return names, m, nodes
+
+def test_matches_per_node_can_lock():
+    """Random trees and lock states, including m = 1 chains, give Optimized.can_lock's answers"""
+    rng = random.Random(32)
+    for _ in range(500):
+        names, m, nodes = random_case(rng)
+        state = ArrayTreeState.from_nodes(nodes, names, m)
+        indices = np.arange(len(names))
+        assert state.can_lock_many(indices).tolist() == [can_lock(nodes[name]) for name in names], (len(names), m)
+        assert state.lockable_many(indices).tolist() == \
+            [nodes[name].locked_by is None and can_lock(nodes[name]) for name in names], (len(names), m)
+
+def test_set_owner_refreshes_probes():
+    """Owner changes after a probe are seen by the next probe"""
+    state = ArrayTreeState(7, 2)
+    assert state.can_lock_many([0, 1, 3]).tolist() == [True, True, True]
+    state.set_owner(1, 5)
+    assert state.can_lock_many([0, 1, 3, 2]).tolist() == [False, True, False, True]
+    state.set_owner(1, None)
+    assert state.can_lock_many([0, 3]).tolist() == [True, True]
+
+def test_rejects_out_of_range_indices():
+    """Negative indices are not wrapped round to the last nodes"""
+    state = ArrayTreeState(7, 2)
+    for indices in ([-1], [0, 7]):
+        for probe in (state.can_lock_many, state.lockable_many):
+            try:
+                probe(indices)
+            except ValueError:
+                pass
+            else:
+                raise AssertionError('%s accepted %r' % (probe.__name__, indices))
+    assert state.can_lock_many([]).tolist() == []
+
+if __name__ == "__main__":
+    test_matches_per_node_can_lock()
+    test_set_owner_refreshes_probes()
+    test_rejects_out_of_range_indices()
+    print("Vectorized probe tests passed!")